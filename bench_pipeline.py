@@ -0,0 +1,231 @@
+import gc
+import os
+import sys
+import json
+import time
+import ctypes
+import random
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import cv2
+import lib_ffprobe_json as l_ffj
+import lib_ts_index as l_tsi
+import lib_screen_detect as l_sd
+import lib_blackness as l_bl
+import lib_frame_dedup as l_fdd
+import lib_ocr_dispatch as l_ocrd
+import lib_ocr_columnar as l_ocol
+import main_screen_detect_iterate as m_sdi
+
+# the checked-in ocr results, real fixtures for the ocr result stages
+OCR_FIXTURES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+                for name in ("143800_vfr__vbr_ocr.json", "144850_vfr__vbr_ocr.json")]
+
+def synthetic_ffprobe_json(path, n_frames, fps=30.0, jitter=0.3, duplicates=0.05, audio_every=2, seed=0):
+    """
+    ffprobe -show_frames -print_format json like file with n_frames video frames.
+    jitter: frame interval varies by +- jitter of 1/fps, duplicates: share of repeated pts_time
+    (vbr), an audio frame every audio_every video frames.
+    """
+    rng = random.Random(seed)
+    t = 0.0
+    with open(path, 'w') as f:
+        f.write('{\n    "frames": [\n')
+        first = True
+        for i in range(n_frames):
+            if i and rng.random() >= duplicates:
+                t += (1.0 / fps) * (1.0 + rng.uniform(-jitter, jitter))
+            frames = [{"media_type": "video", "stream_index": 0, "key_frame": int(i % 60 == 0),
+                       "pts_time": f"{t:.6f}", "pkt_size": str(rng.randint(500, 60000)),
+                       "pict_type": "I" if i % 60 == 0 else rng.choice("PB"), "width": 1920, "height": 1080}]
+            if audio_every and i % audio_every == 0:
+                frames.append({"media_type": "audio", "stream_index": 1, "key_frame": 1,
+                               "pts_time": f"{t:.6f}", "pkt_size": "371"})
+            for frame in frames:
+                f.write(("" if first else ",\n") + "        " + json.dumps(frame))
+                first = False
+        f.write('\n    ]\n}\n')
+
+def synthetic_frame(width=1920, height=1080, n_screens=2, seed=0):
+    """bright noisy background with n_screens dark rectangles (monitors) and some text like lines"""
+    rng = np.random.default_rng(seed)
+    image = rng.integers(170, 230, (height, width, 3), dtype=np.uint8)
+    for s in range(n_screens):
+        w = int(width * rng.uniform(0.2, 0.3))
+        h = int(w / rng.uniform(1.3, 1.8))
+        x = int(width * (0.05 + 0.45 * s) + rng.integers(0, width // 20))
+        y = int(height * 0.3 + rng.integers(0, height // 10))
+        cv2.rectangle(image, (x, y), (x + w, y + h), (20, 20, 20), -1)
+        for line_y in range(y + 20, y + h - 10, 25):
+            cv2.putText(image, "lorem 123", (x + 10, line_y), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 1)
+    return image
+
+def _status_kb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return None
+
+def _reset_peak_rss():
+    """
+    free what can be freed and reset the VmHWM high water mark to the current rss (linux),
+    False where that is not possible
+    """
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+        return _status_kb("VmHWM") is not None
+    except OSError:
+        return False
+
+def measure(fn, n_items, repeat=3):
+    """
+    best wall time of repeat runs, then one run for the peak rss growth (VmHWM - VmRSS before,
+    sees the OpenCV / numpy buffers) and one under tracemalloc for the python heap peak
+    (only allocations python makes, cv2 images do not show up there).
+    Returns dict with seconds, items_per_s, peak_rss_mb (None where it can not be measured) and py_heap_mb
+    """
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    peak_rss_mb = None
+    if _reset_peak_rss():
+        rss_before = _status_kb("VmRSS")
+        fn()
+        peak_rss_mb = (_status_kb("VmHWM") - rss_before) / 1024
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": best, "items_per_s": n_items / best if best else float("inf"),
+            "peak_rss_mb": peak_rss_mb, "py_heap_mb": peak / 1e6}
+
+def bench_timestamps(tmp_dir, sizes, jitter, repeat):
+    for n_frames in sizes:
+        path = os.path.join(tmp_dir, f"bench_{n_frames}_vfr.json")
+        synthetic_ffprobe_json(path, n_frames, jitter=jitter)
+        yield "parse ffprobe json", n_frames, measure(lambda: l_ffj.get_timestamps_array(path), n_frames, repeat)
+        yield "build ts index", n_frames, measure(lambda: l_tsi.build_timestamp_index(path), n_frames, repeat)
+        yield "load ts index", n_frames, measure(lambda: l_tsi.get_timestamps(path), n_frames, repeat)
+        vid_ts = l_tsi.get_timestamps(path)
+        n_selected = len(l_ffj.framearrays_from_timespan(-1, -1, 2, vid_ts)["index"])
+        yield "frame selection 2fps", n_frames, measure(lambda: l_ffj.framearrays_from_timespan(-1, -1, 2, vid_ts),
+                                                         n_selected, repeat)
+        n_adaptive = len(l_tsi.get_adaptive_framearrays(path)["index"])
+        yield f"adaptive selection ({n_adaptive} frames)", n_frames, measure(lambda: l_tsi.get_adaptive_framearrays(path),
+                                                                            n_frames, repeat)
+
+def bench_frames(resolutions, n_images, repeat):
+    for width, height in resolutions:
+        images = [synthetic_frame(width, height, seed=i) for i in range(n_images)]
+        label = f"{width}x{height}"
+        yield "find_screens", label, measure(lambda: [m_sdi.find_screens(image) for image in images], n_images, repeat)
+        for downscale in (2, 4):
+            yield f"detect_screens downscale {downscale}", label, measure(
+                lambda: [l_sd.detect_screens(image, {"downscale": downscale}) for image in images], n_images, repeat)
+
+        def tracked():
+            tracker = l_sd.ScreenTracker(redetect_every=30)
+            for image in images:
+                tracker.update(image)
+        yield "ScreenTracker", label, measure(tracked, n_images, repeat)
+
+        grays = [cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) for image in images]
+        rects = np.array([(x, y, width // 4, height // 4) for x in range(0, width - width // 4, 16)
+                          for y in range(0, height - height // 4, 16)])
+        yield f"blackness integral ({len(rects)} rects)", label, measure(
+            lambda: [l_bl.BlacknessIntegral(gray).blackness_percentage(rects) for gray in grays], n_images, repeat)
+        yield "blackness per roi (100 rects)", label, measure(
+            lambda: [l_bl.get_blackness_percentage(image[y:y+h, x:x+w]) for image in images for x, y, w, h in rects[:100]],
+            n_images * 100, repeat)
+
+        def dedup():
+            frame_dedup = l_fdd.FrameDedup()
+            for i, image in enumerate(images):
+                frame_dedup.check(i, image, [])
+        yield "frame dedup", label, measure(dedup, n_images, repeat)
+
+def bench_ocr_results(tmp_dir, repeat):
+    for fixture in OCR_FIXTURES:
+        if not os.path.exists(fixture):
+            continue
+        with open(fixture, 'r') as f:
+            ocr_json = json.load(f)
+        n_words = sum(len(entry["google_ocr"] or []) for entry in ocr_json.values())
+        label = f"{os.path.basename(fixture)} ({len(ocr_json)} frames)"
+
+        def load():
+            with open(fixture, 'r') as f:
+                json.load(f)
+        yield "ocr json load", label, measure(load, n_words, repeat)
+
+        def write():
+            with l_ocrd.JsonObjectWriter(os.path.join(tmp_dir, "bench_out.json")) as writer:
+                for key, entry in ocr_json.items():
+                    writer.write(key, entry)
+        yield "ocr json write", label, measure(write, n_words, repeat)
+
+        cols_dir = os.path.join(tmp_dir, "bench.cols")
+        yield "ocr json to columns", label, measure(lambda: l_ocol.ocr_json_to_columns(ocr_json, cols_dir), n_words, repeat)
+        yield "ocr columns to json", label, measure(
+            lambda: l_ocol.columns_to_ocr_json(l_ocol.load_ocr_columns(cols_dir)), n_words, repeat)
+
+def format_row(stage, size, result):
+    rss = f"{result['peak_rss_mb']:>9.2f} MB" if result["peak_rss_mb"] is not None else f"{'n/a':>12}"
+    return (f"{stage:<38} {str(size):<40} {result['seconds']*1000:>10.2f} ms {result['items_per_s']:>14.1f}/s "
+            f"{rss} {result['py_heap_mb']:>9.2f} MB")
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="time the pipeline stages on synthetic data and the checked-in ocr jsons")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="video frames in the synthetic ffprobe json")
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--resolutions", nargs="+", default=["1280x720", "1920x1080"])
+    parser.add_argument("--images", type=int, default=10, help="synthetic frames per resolution")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stages", nargs="+", default=["timestamps", "frames", "ocr"], choices=["timestamps", "frames", "ocr"])
+    parser.add_argument("--out", help="also write the table here, eg. bench_output.txt")
+    parser.add_argument("--json", help="write the results as json")
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    resolutions = [tuple(int(v) for v in r.split("x")) for r in args.resolutions]
+    rows = []
+    lines = [f"{'stage':<38} {'size':<40} {'best time':>13} {'throughput':>16} {'peak rss':>12} {'py heap':>12}"]
+    print(lines[0])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        benches = []
+        if "timestamps" in args.stages:
+            benches.append(bench_timestamps(tmp_dir, args.sizes, args.jitter, args.repeat))
+        if "frames" in args.stages:
+            benches.append(bench_frames(resolutions, args.images, args.repeat))
+        if "ocr" in args.stages:
+            benches.append(bench_ocr_results(tmp_dir, args.repeat))
+        for bench in benches:
+            for stage, size, result in bench:
+                rows.append({"stage": stage, "size": size, **result})
+                lines.append(format_row(stage, size, result))
+                print(lines[-1], flush=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    # python bench_pipeline.py --sizes 10000 100000 --out bench_output.txt
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,54 @@
+import threading
+import time
+import pytest
+from google.api_core import exceptions
+from google.cloud import vision
+
+class StubVisionClient:
+    """
+    Stands in for vision.ImageAnnotatorClient: the image content b"word1 word2" comes back
+    as those words, content starting with b"error" as an error response (RESOURCE_EXHAUSTED when it
+    mentions quota, else INVALID_ARGUMENT) and b"unavailable" raises ServiceUnavailable. delay makes calls
+    overlap, max_active is the most calls seen at the same time, batch_sizes the number
+    of images in each batch_annotate_images call.
+    """
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+        self.batch_sizes = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def _response(self, content):
+        if content.startswith(b"error"):
+            code = 8 if b"quota" in content else 3
+            return vision.AnnotateImageResponse(error={"code": code, "message": content.decode()})
+        words = [{"symbols": [{"text": ch} for ch in word], "confidence": 0.9,
+                  "bounding_box": {"vertices": [{"x": i, "y": 0}, {"x": i + 1, "y": 0}, {"x": i + 1, "y": 1}, {"x": i, "y": 1}]}}
+                 for i, word in enumerate(content.decode().split())]
+        return vision.AnnotateImageResponse(
+            full_text_annotation={"pages": [{"blocks": [{"paragraphs": [{"words": words}]}]}]})
+
+    def document_text_detection(self, image):
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if image.content.startswith(b"unavailable"):
+                raise exceptions.ServiceUnavailable("stub is unavailable")
+            return self._response(image.content)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def batch_annotate_images(self, requests):
+        with self._lock:
+            self.batch_sizes.append(len(requests))
+        return vision.BatchAnnotateImagesResponse(responses=[self._response(request.image.content) for request in requests])
+
+@pytest.fixture
+def stub_client():
+    return StubVisionClient()
@@ -1,4 +1,5 @@
 import lib_ffprobe_json as l_ffj
+import lib_ts_index as l_tsi
 import lib_google_ocr as l_gocr
 import os
 import json
@@ -18,7 +19,7 @@ with open(in_ffprobe_ocr_json_filepath, 'r') as f:
 key_list=list(in_ocr_json.keys())
 outjson={}
 framerate=2
-vid_timestamplist=l_ffj.get_timestamps_from_frames(in_ffprobe_json_filepath)
+vid_timestamplist=l_tsi.get_timestamps(in_ffprobe_json_filepath)
 framelist=l_ffj.framelist_from_timespan(-1,-1,framerate,vid_timestamplist)
 
 for ii,key in enumerate(key_list):
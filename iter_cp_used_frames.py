@@ -1,11 +1,12 @@
 import lib_ffprobe_json as l_ffj
+import lib_ts_index as l_tsi
+import lib_frame_index as l_fidx
+import lib_frame_stage as l_fstg
 import cv2
 import lib_google_ocr as l_gocr
 import os
 import json
-import re
 import sys
-import shutil
 
 # video_basename = "20250924_145147" 145147 is the video basename
 video_basename = "145147"
@@ -15,36 +16,29 @@ in_frames_basename = f"{video_basename}_vfr_"
 in_frames_path = f"../{video_basename}/"
 out_frames_path = f"../{video_basename}_out/"
 os.makedirs(out_frames_path, exist_ok=True)
-png_files = os.listdir(in_frames_path)
-# Filter the list to only include .png files that match the pattern for the video file we are processing
-all_png_files_in_folder = []
-pattern_matching_png_files = []
-
-for filename in png_files:
-    if filename.endswith(".png") and filename.startswith(in_frames_basename):
-        all_png_files_in_folder.append(filename)
-for filename in all_png_files_in_folder:
-    match = re.match(rf"{in_frames_basename}([\d]+)\.png", filename)
-    if match:
-        pattern_matching_png_files.append({"frame_from_filename":int(match.group(1)),"filename":filename})
-
-# Sort the pattern_matching_png_files list based on the frame_from_filename
-pattern_matching_png_files.sort(key=lambda x: x["frame_from_filename"])
+# png index: -vsync vfr gives fewer pngs than ffprobe has unique timestamps, pngs are matched
+# on pts_time and a missing frame gets the nearest png instead of stopping the run.
+# pts_time per png from the showinfo log of the extraction (see README), or for
+# -frame_pts 1 pngs use time_base=(1, 90000) instead
+in_showinfo_log = f"../{video_basename}/extraction_log.txt"
+frame_index = l_fidx.FrameFileIndex(in_frames_path, in_frames_basename, showinfo_log=in_showinfo_log)
 
 # use lib_ffprobe_json to get timestamps that are unique from a list of video only timestamps from json
 # and then specify a timespan and framreate to get the frames you want to ocr
 framerate=2
-vid_timestamplist=l_ffj.get_timestamps_from_frames(in_ffprobe_json_filepath)
+vid_timestamplist=l_tsi.get_timestamps(in_ffprobe_json_filepath)
 framelist=l_ffj.framelist_from_timespan(-1,-1,framerate,vid_timestamplist)
 
-# now we check that all the frames we need to ocr are in the png_files list
-for frame in framelist:
-  if frame["vbr_frameno"] not in [f["frame_from_filename"] for f in pattern_matching_png_files]:
-    print(f"missing frame {frame['vbr_frameno']}")
-    exit(1)
-  else:
-    print(f"copying {frame['vbr_frameno']}")
-    shutil.copyfile(in_frames_path+pattern_matching_png_files[frame["vbr_frameno"]-1]["filename"], out_frames_path+pattern_matching_png_files[frame["vbr_frameno"]-1]["filename"])
-    
-    # shutil.copyfile(in_frames_path+pattern_matching_png_files[frame["vbr_frameno"]-1]["filename"], out_frames_path+pattern_matching_png_files[frame["vbr_frameno"]-1]["filename"])
-
+resolved, report = frame_index.resolve_framelist(framelist)
+if not len(frame_index):
+    print(f"no pngs in {in_frames_path}")
+    sys.exit(1)
+# stage_mode: auto (reflink, hardlink, else copy), copy, or manifest to only write the
+# manifest and let later stages read the pngs where they are
+stage_mode = "auto"
+manifest_path = out_frames_path+f"{video_basename}_frames_manifest.json"
+stage_counts = l_fstg.stage_frames(resolved, out_frames_path, stage_mode, manifest_path)
+print(f"staged: {stage_counts}, manifest {manifest_path}")
+print(f"{report['exact']} of {report['requested']} frames exact, {report['nearest']} nearest (max distance {report['max_distance']:.3f}s), {report['unverified']} unverified")
+if report["missing"]:
+    print(f"missing frames: {report['missing']}")
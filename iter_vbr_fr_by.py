@@ -1,4 +1,5 @@
 import lib_ffprobe_json as l_ffj
+import lib_ts_index as l_tsi
 import cv2
 import lib_google_ocr as l_gocr
 import os
@@ -35,7 +36,7 @@ for filename in all_png_files_in_folder:
 # use lib_ffprobe_json to get timestamps that are unique from a list of video only timestamps from json
 # and then specify a timespan and framreate to get the frames you want to ocr
 framerate=2
-vid_timestamplist=l_ffj.get_timestamps_from_frames(in_ffprobe_json_filepath)
+vid_timestamplist=l_tsi.get_timestamps(in_ffprobe_json_filepath)
 print(f'len timestamps {len(vid_timestamplist)} last timestamp {vid_timestamplist[-1]}')
 exit()
 framelist=l_ffj.framelist_from_timespan(-1,-1,framerate,vid_timestamplist)
@@ -1,6 +1,7 @@
 import cv2
 import logging
 import numpy as np
+import lib_metrics as l_met
 
 logging=logging.getLogger(__name__)
 
@@ -68,6 +69,53 @@ def get_black_pixel_ratio(roi, threshold=30):
     black_ratio = (black_pixels / total_pixels) * 100
     return black_ratio
 
+class BlacknessIntegral:
+    """
+    Summed-area tables for one frame, so mean luminance / blackness and black
+    pixel ratio of any rectangle cost O(1) instead of a pass over the ROI.
+
+    Args:
+        gray: grayscale frame (uint8), the one already made for edge detection
+        threshold: black pixel threshold for black_pixel_ratio, same meaning as in get_black_pixel_ratio
+    """
+    def __init__(self, gray, threshold=30):
+        self.gray = gray
+        self.threshold = threshold
+        # float64 sums, int32 would overflow on 4K frames
+        with l_met.timer("blackness.integral"):
+            self.sum_table = cv2.integral(gray, sdepth=cv2.CV_64F)
+        self._black_table = None
+
+    @property
+    def black_table(self):
+        # built on first use, detect_screens only needs the luminance table
+        if self._black_table is None:
+            black_mask = (self.gray <= self.threshold).astype(np.uint8)
+            self._black_table = cv2.integral(black_mask, sdepth=cv2.CV_32S)
+        return self._black_table
+
+    @staticmethod
+    def _rect_sums(table, rects):
+        rects = np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+        x, y, w, h = rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3]
+        sums = table[y+h, x+w] - table[y, x+w] - table[y+h, x] + table[y, x]
+        return sums.astype(np.float64), (w * h).astype(np.float64)
+
+    def mean_luminance(self, rects):
+        """mean gray value per (x, y, w, h) rect, one value per row of rects"""
+        sums, areas = self._rect_sums(self.sum_table, rects)
+        l_met.count("blackness.rects", len(sums))
+        return sums / areas
+
+    def blackness_percentage(self, rects):
+        """vectorized get_blackness_percentage(roi, method='luminance') for a batch of rects"""
+        return (255 - self.mean_luminance(rects)) / 255 * 100
+
+    def black_pixel_ratio(self, rects):
+        """vectorized get_black_pixel_ratio(roi, self.threshold) for a batch of rects"""
+        sums, areas = self._rect_sums(self.black_table, rects)
+        return sums / areas * 100
+
 def is_predominantly_black(roi, blackness_threshold=70):
     """
     Simple function to determine if an area is predominantly black.
@@ -1,7 +1,9 @@
 import json
+import re
 import numpy as np
 import matplotlib.pyplot as plt
 from collections import OrderedDict
+import lib_metrics as l_met
 
 
 def get_vid_frame_timestamps(in_ffprobe_json_frames):  
@@ -19,53 +21,277 @@ def what_time_at_frame_no(frameno,vid_ts_list):
   return vid_ts_list[frameno]
 
 def closest_frame_to_time(time,vid_ts_list):
-  return np.argmin(np.abs(np.array(vid_ts_list)-time))
+  return np.argmin(np.abs(np.asarray(vid_ts_list)-time))
 
-def framelist_from_timespan(start_time,end_time,frame_rate,vid_ts_list):
+def closest_frames_to_times(times,vid_ts_list):
+  """
+  Batched closest_frame_to_time, one sorted search for all requested times.
+
+  Args:
+      times: requested times in seconds (array like)
+      vid_ts_list: video timestamps, list or float64 array
+
+  Returns:
+      np.ndarray: int64 frame index for each requested time. ties go to the
+      earlier timestamp, same as np.argmin
+  """
+  ts=np.asarray(vid_ts_list,dtype=np.float64)
+  times=np.asarray(times,dtype=np.float64)
+  if len(ts)==1:
+    return np.zeros(len(times),dtype=np.int64)
+
+  # unique_ts is in appearance order, that is almost always sorted but not guaranteed
+  order=None
+  if np.any(np.diff(ts)<0):
+    order=np.argsort(ts,kind='stable')
+    ts=ts[order]
+
+  right=np.clip(np.searchsorted(ts,times,side='left'),1,len(ts)-1)
+  left=right-1
+  closest=np.where(times-ts[left]<=ts[right]-times,left,right)
+  if order is not None:
+    closest=order[closest]
+  return closest.astype(np.int64)
+
+def framearrays_from_timespan(start_time,end_time,frame_rate,vid_ts_list):
+  """
+  Pick the closest vbr frame for every 1/frame_rate step between start_time and end_time.
+
+  Returns:
+      dict: columnar selection, one np.ndarray per key:
+      index, vbr_frameno, requested_time, pts_time, prev_pts_time, next_pts_time.
+      prev/next are -1 where there is no neighbouring frame
+  """
+  ts=np.asarray(vid_ts_list,dtype=np.float64)
   if end_time==-1:
-    end_time=vid_ts_list[-1]
+    end_time=ts[-1]
   if start_time==-1:
-    start_time=vid_ts_list[0]
-  list_of_frametimes = np.arange(start_time,end_time,1/frame_rate)
-  list_of_frametimes=list_of_frametimes.tolist()
+    start_time=ts[0]
+  requested_times=np.arange(start_time,end_time,1/frame_rate)
+
+  framenos=closest_frames_to_times(requested_times,ts)
+  framenos[framenos<1]=1 #frame 0 is never used, same as before
+  return _framearrays(framenos,requested_times,ts)
+
+def _framearrays(framenos,requested_times,ts):
+  prev_times=np.full(len(framenos),-1.0)
+  next_times=np.full(len(framenos),-1.0)
+  has_prev=framenos>0
+  has_next=framenos<len(ts)-1
+  prev_times[has_prev]=ts[framenos[has_prev]-1]
+  next_times[has_next]=ts[framenos[has_next]+1]
+
+  return {"index":np.arange(len(framenos)),
+          "vbr_frameno":framenos,
+          "requested_time":requested_times,
+          "pts_time":ts[framenos],
+          "prev_pts_time":prev_times,
+          "next_pts_time":next_times}
+
+def change_scores(pkt_size,pict_type=None,key_frame=None,window=15):
+  """
+  How much bigger each frame's packet is than the median of the previous window
+  frames of the same picture type. In vbr h264 a static screen gives tiny P frames,
+  a frame with a big P (or an unusually big I) is where the picture changed.
+
+  Args:
+      pkt_size: int array, -1 where unknown (score 0)
+      pict_type: 'I'/'P'/'B' array, or None
+      key_frame: 1 for keyframes, used as I/P when pict_type is missing
+
+  Returns:
+      np.ndarray: float64 score per frame, ~1 for ordinary frames
+  """
+  sizes=np.asarray(pkt_size,dtype=np.float64)
+  if pict_type is None:
+    types=np.where(np.asarray(key_frame)==1,'I','P') if key_frame is not None else np.full(len(sizes),'P')
+  else:
+    types=np.asarray(pict_type)
+  scores=np.zeros(len(sizes))
+  for t in np.unique(types):
+    idx=np.flatnonzero((types==t)&(sizes>=0))
+    if len(idx)==0:
+      continue
+    group=sizes[idx]
+    # median of the previous window frames of this type, the first frame compares with itself
+    padded=np.concatenate([np.full(window,group[0]),group[:-1]])
+    baseline=np.median(np.lib.stride_tricks.sliding_window_view(padded,window),axis=1)
+    scores[idx]=group/np.maximum(baseline,1.0)
+  return scores
+
+def adaptive_request_times(change_times,start_time,end_time,min_interval=0.25,max_interval=2.0):
+  """
+  Times to sample: every change, but not closer than min_interval (a burst of changes
+  gets one more sample min_interval after the last pick so the settled picture is seen),
+  and never more than max_interval apart.
+  """
+  picks=[start_time]
+  pending=False
+  for t in change_times:
+    if t<picks[-1]+min_interval:
+      pending=True
+      continue
+    if pending:
+      picks.append(picks[-1]+min_interval)
+      pending=False
+      if t<picks[-1]+min_interval:
+        pending=True
+        continue
+    picks.append(t)
+  if pending and picks[-1]+min_interval<=end_time:
+    picks.append(picks[-1]+min_interval)
+
+  picks=np.asarray(picks+[end_time],dtype=np.float64)
+  gaps=np.diff(picks)
+  # at least a itself, also when a pick coincides with the next one or with end_time (gap 0)
+  fill=[np.linspace(a,b,max(1,int(np.ceil(g/max_interval))),endpoint=False) for a,b,g in zip(picks[:-1],picks[1:],gaps)]
+  return np.concatenate(fill) if fill else picks[:1]
+
+def framearrays_adaptive(start_time,end_time,vid_ts_list,pkt_size,pict_type=None,key_frame=None,
+                         min_interval=0.25,max_interval=2.0,change_factor=2.0,window=15):
+  """
+  Frame selection driven by content change instead of a fixed frame rate: frames whose
+  change_scores is >= change_factor, thinned to min_interval, with a frame at least
+  every max_interval for static stretches.
+  The arrays (pkt_size etc.) are per unique timestamp, as from get_vid_frame_arrays
+  or lib_ts_index.load_timestamp_index.
+
+  Returns:
+      dict: same columns as framearrays_from_timespan, requested_time is the time asked for
+  """
+  ts=np.asarray(vid_ts_list,dtype=np.float64)
+  if len(ts)<2:
+    # frame 0 is never used, nothing to pick from (framearrays_from_timespan gives the same)
+    return _framearrays(np.zeros(0,dtype=np.int64),np.zeros(0),ts)
+  if end_time==-1:
+    end_time=ts[-1]
+  if start_time==-1:
+    start_time=ts[0]
+  scores=change_scores(pkt_size,pict_type,key_frame,window)
+  in_span=(ts>=start_time)&(ts<end_time)
+  change_times=np.sort(ts[in_span&(scores>=change_factor)])
+  requested_times=adaptive_request_times(change_times,start_time,end_time,min_interval,max_interval)
+
+  framenos=closest_frames_to_times(requested_times,ts)
+  framenos[framenos<1]=1 #frame 0 is never used, same as framearrays_from_timespan
+  # two requests can land on the same frame, keep the first
+  _,first=np.unique(framenos,return_index=True)
+  first.sort()
+  return _framearrays(framenos[first],requested_times[first],ts)
+
+def framelist_from_framearrays(framearrays):
+  """list of dicts view of framearrays_from_timespan, the format the iter_* scripts use"""
+  columns={key:framearrays[key].tolist() for key in framearrays}
   list_of_framedics=[]
-  for i, frametime in enumerate(list_of_frametimes):
-    # print(f"framechoice_no {i} time {frametime}")
-    thisframeno=closest_frame_to_time(frametime,vid_ts_list)
-
-    if thisframeno<1:
-      # print(f"resulting frame for time {frametime} is less than 1, corrected to 1")
-      thisframeno=1
-      # print(f"the corrected frame, no 1 is at time {what_time_at_frame_no(thisframeno,vid_timestamplist)}")
-    thisframetime=what_time_at_frame_no(thisframeno,vid_ts_list)
-
-    nextframtime=-1
-    prevframtime=-1
-    # print(f"closest frame to {frametime} is {thisframeno}") #frametime is the requested time
-    # print(f"time at frame {thisframeno} is {thisframetime}, diff is {frametime-thisframetime}") #thisframetime is the pts time of the closest frame to the requested time
-    if thisframeno<len(vid_ts_list)-1:
-      nextframtime=what_time_at_frame_no(thisframeno+1,vid_ts_list)
-      # print(f"time at next frame is {nextframtime},diff is {nextframtime-thisframetime}")
-    if thisframeno>0:
-      prevframtime=what_time_at_frame_no(thisframeno-1,vid_ts_list)
-      # print(f"time at prev frame is {prevframtime},diff is {thisframetime-prevframtime}")
-    
-    list_of_framedics.append({"index":i,"vbr_frameno":int(thisframeno),"requested_time":frametime,"pts_time":thisframetime,"prev_pts_time":prevframtime,"next_pts_time":nextframtime})
-
-
-              
+  for i in range(len(columns["index"])):
+    prevframtime=columns["prev_pts_time"][i]
+    nextframtime=columns["next_pts_time"][i]
+    list_of_framedics.append({"index":columns["index"][i],
+                              "vbr_frameno":columns["vbr_frameno"][i],
+                              "requested_time":columns["requested_time"][i],
+                              "pts_time":columns["pts_time"][i],
+                              "prev_pts_time":-1 if prevframtime==-1 else prevframtime,
+                              "next_pts_time":-1 if nextframtime==-1 else nextframtime})
   return list_of_framedics
 
+def framelist_from_timespan(start_time,end_time,frame_rate,vid_ts_list):
+  return framelist_from_framearrays(framearrays_from_timespan(start_time,end_time,frame_rate,vid_ts_list))
+
+def iter_ffprobe_frames(in_ffprobe_json_filepath,fields=("media_type","pts_time"),chunk_size=1<<20):
+  """
+  Incremental reader for the "frames" array of ffprobe -show_frames json.
+  Only one frame object is decoded at a time, the whole document is never loaded.
+
+  Args:
+      in_ffprobe_json_filepath: ffprobe -print_format json output
+      fields: keys to keep from each frame, eg. pkt_size, pict_type, key_frame
+      chunk_size: characters read from the file per refill
+
+  Yields:
+      dict: the requested fields of each frame (missing keys are left out)
+  """
+  decoder=json.JSONDecoder()
+  frames_key=re.compile(r'"frames"\s*:\s*\[')
+  with open(in_ffprobe_json_filepath,'r') as f:
+    buf=''
+    while True:
+      match=frames_key.search(buf)
+      if match:
+        buf=buf[match.end():]
+        break
+      chunk=f.read(chunk_size)
+      if not chunk:
+        return
+      buf=buf[-64:]+chunk #keep the tail in case the key is split between chunks
+
+    pos=0
+    while True:
+      while pos<len(buf) and buf[pos] in ' \t\r\n,':
+        pos+=1
+      if pos<len(buf):
+        if buf[pos]==']':
+          return
+        try:
+          frame,end=decoder.raw_decode(buf,pos)
+        except json.JSONDecodeError:
+          end=None #frame is split between chunks, read more
+        if end is not None:
+          pos=end
+          yield {key:frame[key] for key in fields if key in frame}
+          continue
+      chunk=f.read(chunk_size)
+      if not chunk:
+        raise ValueError(f"unexpected end of frames array in {in_ffprobe_json_filepath}")
+      buf=buf[pos:]+chunk
+      pos=0
+
+@l_met.timed("ffprobe_json.parse")
+def get_vid_frame_arrays(in_ffprobe_json_filepath,extra_fields=()):
+  """
+  Streaming version of get_vid_frame_timestamps that returns compact arrays.
+
+  Args:
+      in_ffprobe_json_filepath: ffprobe -show_frames json
+      extra_fields: any of 'pkt_size', 'pict_type', 'key_frame'
+
+  Returns:
+      dict: 'pts_time' float64 unique timestamps in appearance order,
+      'video_frame' index of the first video frame with that timestamp,
+      plus one array per extra field (pkt_size -1 and pict_type '?' when missing)
+  """
+  fields=("media_type","pts_time")+tuple(extra_fields)
+  all_actual_timestamps=[]
+  extra={key:[] for key in extra_fields}
+  for frame in iter_ffprobe_frames(in_ffprobe_json_filepath,fields):
+    if frame.get('media_type')!='video' or 'pts_time' not in frame:
+      continue
+    all_actual_timestamps.append(float(frame['pts_time']))
+    for key in extra_fields:
+      extra[key].append(frame.get(key))
+
+  l_met.count("ffprobe_json.video_frames",len(all_actual_timestamps))
+  all_ts=np.array(all_actual_timestamps,dtype=np.float64)
+  _,first_seen=np.unique(all_ts,return_index=True)
+  first_seen.sort() # unique in appearance order, like the OrderedDict version
+  arrays={"pts_time":all_ts[first_seen],"video_frame":first_seen.astype(np.int64)}
+  for key in extra_fields:
+    values=[extra[key][i] for i in first_seen]
+    if key=='pict_type':
+      arrays[key]=np.array([v if v else '?' for v in values],dtype='U1')
+    elif key=='key_frame':
+      arrays[key]=np.array([int(v or 0) for v in values],dtype=np.int8)
+    else:
+      arrays[key]=np.array([int(v) if v is not None else -1 for v in values],dtype=np.int64)
+  return arrays
+
+def get_timestamps_array(in_ffprobe_json_filepath):
+  """unique video pts_time as a float64 array, usable as vid_ts_list everywhere"""
+  return get_vid_frame_arrays(in_ffprobe_json_filepath)["pts_time"]
+
 def get_timestamps_from_frames(in_ffprobe_json_filepath):
-    with open(in_ffprobe_json_filepath, 'r') as f:
-        data = json.load(f)
-    frames = data.get('frames', [])
+    vid_timestamplist=get_timestamps_array(in_ffprobe_json_filepath).tolist()
 
-    vid_timestamplist=get_vid_frame_timestamps(frames)
-    
     return vid_timestamplist
 
-    
-
 if __name__ == '__main__':
     pass
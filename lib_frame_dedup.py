@@ -0,0 +1,163 @@
+import cv2
+import logging
+import numpy as np
+
+logging=logging.getLogger(__name__)
+
+def _screen_rois(gray, screens, inset):
+    rois = []
+    for x, y, w, h in (screens or [(0, 0, gray.shape[1], gray.shape[0])]):
+        dx, dy = int(w * inset), int(h * inset)
+        rois.append(gray[y+dy:y+h-dy, x+dx:x+w-dx])
+    return rois
+
+def frame_signature(image, screens=None, size=(48, 48), inset=0.03):
+    """
+    Small grayscale thumbnails of the screen ROIs (whole frame if no screens),
+    used to tell if anything on the screens changed since the last OCR.
+
+    Args:
+        image: BGR np.ndarray
+        screens: (x, y, w, h) list from find_screens / detect_screens
+        size: thumbnail size, INTER_AREA averages away the camera noise
+        inset: part of each ROI side left out, so the bezel edge moving a pixel is not a change
+
+    Returns:
+        list: one float32 thumbnail per ROI
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return [cv2.resize(roi, size, interpolation=cv2.INTER_AREA).astype(np.float32) for roi in _screen_rois(gray, screens, inset)]
+
+def signature_changed(ref_signature, signature, threshold=10.0):
+    """
+    True if any thumbnail cell moved more than threshold gray levels. Max and not
+    mean, a few changed digits on one screen is a change we want to OCR.
+    """
+    if ref_signature is None or len(ref_signature) != len(signature):
+        return True
+    for ref_thumb, thumb in zip(ref_signature, signature):
+        if np.max(np.abs(ref_thumb - thumb)) > threshold:
+            return True
+    return False
+
+def detail_rois(image, screens=None, inset=0.03):
+    """full resolution grayscale screen ROIs, blurred a little against camera noise, for rois_changed"""
+    gray = cv2.GaussianBlur(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), (3, 3), 0)
+    return _screen_rois(gray, screens, inset)
+
+def rois_changed(ref_rois, rois, pixel_threshold=24, min_changed_pixels=5):
+    """
+    Full resolution check for the changes a thumbnail averages away: a few digits or a
+    short word are a handful of 48x48 cells that move less than the thumbnail threshold.
+    A pixel counts as changed when it is pixel_threshold brighter than the brightest or
+    darker than the darkest reference pixel around it, so a 1 pixel shift of the camera
+    is not a change. The ROIs must be cut with the same rectangles.
+    """
+    if ref_rois is None or len(ref_rois) != len(rois):
+        return True
+    kernel = np.ones((3, 3), np.uint8)
+    for ref_roi, roi in zip(ref_rois, rois):
+        if ref_roi.shape != roi.shape:
+            return True
+        brighter = cv2.subtract(roi, cv2.dilate(ref_roi, kernel))
+        darker = cv2.subtract(cv2.erode(ref_roi, kernel), roi)
+        changed = cv2.countNonZero(cv2.threshold(cv2.max(brighter, darker), pixel_threshold, 255, cv2.THRESH_BINARY)[1])
+        if changed >= min_changed_pixels:
+            return True
+    return False
+
+def same_screens(ref_screens, screens, tolerance=8):
+    """screens at the same place, give or take tolerance pixels (detection jitters a little)"""
+    if not ref_screens or not screens:
+        return not ref_screens and not screens
+    if len(ref_screens) != len(screens):
+        return False
+    return bool(np.all(np.abs(np.asarray(ref_screens) - np.asarray(screens)) <= tolerance))
+
+class FrameDedup:
+    """
+    Keeps the last frame that was sent to OCR and tells for each new frame
+    if it needs OCR or can reuse the reference frame's result.
+    Compared against the reference, not the previous frame, so slow drift is still caught.
+    A frame is only a duplicate when the thumbnails (signature_changed) and the full
+    resolution ROIs (rois_changed) both show no change.
+    """
+    def __init__(self, size=(48, 48), threshold=10.0, pixel_threshold=24, min_changed_pixels=5):
+        self.size = size
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        self.min_changed_pixels = min_changed_pixels
+        self.ref_key = None
+        self.ref_signature = None
+        self.ref_screens = None
+        self.ref_rois = None
+        self.ocr_frames = 0
+        self.skipped_frames = 0
+
+    def check(self, key, image, screens=None):
+        """
+        Returns:
+            None if the frame needs OCR (it becomes the new reference),
+            else the key of the reference frame whose OCR result can be reused
+        """
+        signature = frame_signature(image, screens, self.size)
+        if self.ref_key is not None and same_screens(self.ref_screens, screens) and not signature_changed(self.ref_signature, signature, self.threshold):
+            # cut with the reference rectangles, the same pixels of the image are compared
+            if not rois_changed(self.ref_rois, detail_rois(image, self.ref_screens), self.pixel_threshold, self.min_changed_pixels):
+                self.skipped_frames += 1
+                return self.ref_key
+        self.ref_key, self.ref_signature, self.ref_screens = key, signature, screens
+        self.ref_rois = detail_rois(image, screens)
+        self.ocr_frames += 1
+        return None
+
+def iter_dedup_ocr(frames, ocr_fn, dedup=None):
+    """
+    OCR only the frames that changed.
+
+    Args:
+        frames: iterable of (key, image, screens)
+        ocr_fn: image -> google_ocr word list, eg. lambda img: l_gocr.g_cv_doc_text_detect(l_gocr.g_encode_image(img), api_key)
+        dedup: FrameDedup, a new one if None
+
+    Yields:
+        tuple: (key, entry) where entry is {"google_ocr": words} or, for a skipped
+        frame, {"google_ocr": words of the reference, "ocr_ref": reference key}
+        (same field as main_pipeline, which also adds ocr_ref_frame, the reference's frame string)
+    """
+    dedup = dedup if dedup is not None else FrameDedup()
+    ref_result = None
+    for key, image, screens in frames:
+        ref_key = dedup.check(key, image, screens)
+        if ref_key is None:
+            ref_result = ocr_fn(image)
+            yield key, {"google_ocr": ref_result}
+        else:
+            yield key, {"google_ocr": ref_result, "ocr_ref": ref_key}
+    logging.info(f"dedup: {dedup.ocr_frames} frames sent to ocr, {dedup.skipped_frames} reused")
+
+def resolve_ocr_refs(outjson):
+    """
+    Fill in google_ocr for entries that only have an ocr_ref (when the results were
+    collected out of order). outjson is {key: entry}, changed in place; ocr_ref is the
+    key of the reference entry, also when the keys became strings in a json file.
+    """
+    def ref_entry(ref_key):
+        if ref_key in outjson:
+            return outjson[ref_key]
+        return outjson.get(str(ref_key))
+
+    for entry in outjson.values():
+        ref_key = entry.get("ocr_ref")
+        seen = set()
+        while entry.get("google_ocr") is None and ref_key is not None and ref_key not in seen:
+            seen.add(ref_key)
+            ref = ref_entry(ref_key)
+            if ref is None:
+                break
+            entry["google_ocr"] = ref.get("google_ocr")
+            ref_key = ref.get("ocr_ref")
+    return outjson
+
+if __name__ == "__main__":
+    pass
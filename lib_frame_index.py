@@ -0,0 +1,139 @@
+import os
+import re
+import logging
+import numpy as np
+
+logging=logging.getLogger(__name__)
+
+def parse_showinfo_log(log_path):
+    """
+    pts_time of every png ffmpeg wrote, from the showinfo log of the extraction run:
+    ffmpeg -i <video> -vsync vfr -vf showinfo <basename>_%06d.png > extraction_log.txt 2>&1
+
+    showinfo sees the frames before -vsync vfr drops the ones whose timestamp is not after the
+    last written one, and its n: counts those too, so n is not the png number. The lines are
+    taken in order and the frames vfr drops are skipped the same way.
+
+    Returns:
+        list: pts_time of png 1, 2, ... (%06d numbering)
+    """
+    pattern = re.compile(r'\bn:\s*\d+\s+pts:\s*(-?\d+)\s+pts_time:\s*(-?[\d.]+)')
+    written = []
+    last_pts = None
+    with open(log_path, 'r', errors='replace') as f:
+        for line in f:
+            match = pattern.search(line)
+            if not match:
+                continue
+            pts = int(match.group(1))
+            if last_pts is not None and pts <= last_pts:
+                continue
+            last_pts = pts
+            written.append(float(match.group(2)))
+    return written
+
+class FrameFileIndex:
+    """
+    Which png is there for a pts_time / vbr_frameno, without scanning lists.
+    pngs are matched on pts_time, which comes from -frame_pts 1 filenames (pts in the
+    filename, pts_time = pts * time_base) or from the showinfo log of the %06d extraction.
+    One of the two is required: once -vsync vfr drops frames the png number says nothing
+    about which frame is in the png. When the wanted frame has no png the nearest one is used.
+
+    Args:
+        frames_path: folder with the pngs
+        frames_basename: filename prefix, eg. 145147_vfr_
+        showinfo_log: log of the %06d extraction, see parse_showinfo_log
+        time_base: (num, den) of the video stream for -frame_pts filenames, eg. (1, 90000)
+    """
+    def __init__(self, frames_path, frames_basename, showinfo_log=None, time_base=None):
+        if showinfo_log is None and time_base is None:
+            raise ValueError("FrameFileIndex needs showinfo_log (%06d pngs) or time_base (-frame_pts pngs) to map pngs by pts")
+        self.frames_path = frames_path
+        number_pattern = re.compile(rf"{re.escape(frames_basename)}(\d+)\.png$")
+        pts_pattern = re.compile(rf"{re.escape(frames_basename)}pts_(\d+)\.png$")
+
+        by_number = {}
+        by_pts = {}
+        for filename in os.listdir(frames_path):
+            match = pts_pattern.match(filename)
+            if match:
+                if time_base is not None:
+                    by_pts[int(match.group(1)) * time_base[0] / time_base[1]] = filename
+                continue
+            match = number_pattern.match(filename)
+            if match:
+                by_number[int(match.group(1))] = filename
+        if showinfo_log is not None and by_number:
+            written_pts = parse_showinfo_log(showinfo_log)
+            if len(written_pts) != len(by_number):
+                logging.warning(f"{showinfo_log}: {len(written_pts)} written frames for {len(by_number)} pngs, "
+                                f"is it the log of this extraction?")
+            for number, filename in by_number.items():
+                if 1 <= number <= len(written_pts):
+                    by_pts[written_pts[number - 1]] = filename
+
+        self.by_number = by_number
+        self.numbers = np.array(sorted(by_number), dtype=np.int64)
+        pts_items = sorted(by_pts.items())
+        self.pts_times = np.array([pts for pts, _ in pts_items], dtype=np.float64)
+        self.pts_filenames = [filename for _, filename in pts_items]
+        logging.info(f"{frames_path}: {len(by_number)} numbered pngs, {len(self.pts_times)} with pts_time")
+
+    def __len__(self):
+        return max(len(self.by_number), len(self.pts_times))
+
+    def _nearest(self, sorted_values, value):
+        i = np.searchsorted(sorted_values, value)
+        if i == 0:
+            return 0
+        if i == len(sorted_values):
+            return len(sorted_values) - 1
+        return i if sorted_values[i] - value < value - sorted_values[i - 1] else i - 1
+
+    def lookup(self, vbr_frameno=None, pts_time=None, tolerance=0.001):
+        """
+        Returns:
+            tuple: (path, match, distance) - match is "exact" or "nearest" on pts_time
+            (distance in seconds), "unverified" when only the png number could be used
+            (distance in numbers, the png may hold another frame). (None, None, None) if there are no pngs
+        """
+        if pts_time is not None and len(self.pts_times):
+            i = self._nearest(self.pts_times, pts_time)
+            distance = float(abs(self.pts_times[i] - pts_time))
+            return os.path.join(self.frames_path, self.pts_filenames[i]), "exact" if distance <= tolerance else "nearest", distance
+        if vbr_frameno is not None and len(self.numbers):
+            number = int(self.numbers[self._nearest(self.numbers, vbr_frameno)])
+            return os.path.join(self.frames_path, self.by_number[number]), "unverified", abs(number - vbr_frameno)
+        return None, None, None
+
+    def resolve_framelist(self, framelist, tolerance=0.001):
+        """
+        path for every frame of a framelist (framelist_from_timespan) plus a gap report.
+
+        Returns:
+            tuple: (list of (frame, path), report dict with requested, exact, nearest,
+            unverified, max_distance (seconds, nearest only) and the missing vbr_frameno list)
+        """
+        resolved = []
+        missing = []
+        counts = {"exact": 0, "nearest": 0, "unverified": 0}
+        max_distance = 0
+        for frame in framelist:
+            path, match, distance = self.lookup(frame["vbr_frameno"], frame["pts_time"], tolerance)
+            resolved.append((frame, path))
+            if match is not None:
+                counts[match] += 1
+            if match != "exact":
+                missing.append(frame["vbr_frameno"])
+            if match == "nearest":
+                max_distance = max(max_distance, distance)
+        report = {"requested": len(resolved), **counts, "max_distance": max_distance, "missing": missing}
+        if missing:
+            logging.warning(f"{len(missing)} of {len(resolved)} frames have no exact png: {counts['nearest']} nearest "
+                            f"(max distance {max_distance:.3f}s), {counts['unverified']} unverified by png number")
+        return resolved, report
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,123 @@
+import cv2
+import logging
+import numpy as np
+import lib_ffprobe_json as l_ffj
+import lib_metrics as l_met
+
+logging=logging.getLogger(__name__)
+
+def keyframe_times_from_json(in_ffprobe_json_filepath):
+    """pts_time of every keyframe in the ffprobe json, sorted"""
+    arrays = l_ffj.get_vid_frame_arrays(in_ffprobe_json_filepath, extra_fields=('key_frame',))
+    return np.sort(arrays["pts_time"][arrays["key_frame"] == 1])
+
+def _framelist_rows(framelist):
+    # accept both framelist_from_timespan (list of dicts) and framearrays_from_timespan (dict of arrays)
+    if isinstance(framelist, dict):
+        keys = list(framelist.keys())
+        columns = [framelist[key].tolist() for key in keys]
+        return [dict(zip(keys, row)) for row in zip(*columns)]
+    return framelist
+
+def iter_selected_frames(video_path, framelist, vid_ts_list=None, keyframe_times=None, seek_gap=2.0, tolerance=0.001):
+    """
+    Decode only the selected frames of a video, no png dump needed.
+
+    Frames are matched on pts_time. Between selected frames the decoder only grabs
+    (no BGR conversion); when the next frame is more than seek_gap seconds ahead
+    and keyframe_times is given, it seeks to the keyframe before it and decodes forward.
+    A seek that lands past the wanted frame is retried from an earlier keyframe.
+
+    Args:
+        video_path: the mp4
+        framelist: from framelist_from_timespan or framearrays_from_timespan, sorted on time
+        vid_ts_list: unique video timestamps, used to line up OpenCV's stream time with ffprobe pts_time
+        keyframe_times: sorted keyframe pts_time, see keyframe_times_from_json
+        seek_gap: seconds ahead before seeking is used instead of decoding forward
+        tolerance: seconds, a decoded frame this close to the wanted pts_time is a match
+
+    Yields:
+        tuple: (frame dict from the framelist, BGR np.ndarray)
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video {video_path}")
+
+    time_offset = None
+    cur_time = None  # pts_time of the frame the decoder is on
+    last_time = None
+    last_image = None
+
+    def grab():
+        nonlocal time_offset, cur_time
+        l_met.count("decode.grabs")
+        if not cap.grab():
+            return False
+        stream_time = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        if time_offset is None:
+            # first decoded frame is the first ffprobe timestamp
+            time_offset = (vid_ts_list[0] if vid_ts_list is not None else 0.0) - stream_time
+        cur_time = stream_time + time_offset
+        return True
+
+    def seek(k):
+        nonlocal cur_time
+        l_met.count("decode.seeks")
+        if k < 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        else:
+            cap.set(cv2.CAP_PROP_POS_MSEC, (keyframe_times[k] - time_offset) * 1000)
+        cur_time = None
+
+    try:
+        # the stream time of the first frame lines OpenCV up with pts_time, needed before the first seek
+        if keyframe_times is not None and not grab():
+            return
+        for frame in _framelist_rows(framelist):
+            target = frame["pts_time"]
+
+            # the same vbr frame can be picked twice when frame_rate is higher than the video's
+            if last_image is not None and abs(target - last_time) <= tolerance:
+                yield frame, last_image
+                continue
+
+            k = None  # keyframe seeked to for this target
+            if keyframe_times is not None and target - cur_time > seek_gap:
+                k = np.searchsorted(keyframe_times, target + tolerance, side='right') - 1
+                if k >= 0 and keyframe_times[k] > cur_time:
+                    seek(k)
+                else:
+                    k = None
+
+            tries = 0
+            while True:
+                while cur_time is None or cur_time < target - tolerance:
+                    if not grab():
+                        logging.warning(f"video ended before pts_time {target}, {video_path}")
+                        return
+                if cur_time - target <= tolerance or k is None:
+                    break
+                # POS_MSEC seeks go by the average fps and land off on vfr video, past the target
+                # here: seek to an earlier keyframe, after a few tries decode from the start
+                l_met.count("decode.seek_overshoots")
+                tries += 1
+                k = k - 1 if k > 0 and tries < 4 else -1
+                seek(k)
+                if k < 0:
+                    k = None
+
+            if cur_time - target > tolerance:
+                logging.warning(f"wanted pts_time {target} got {cur_time:.6f} (vbr_frameno {frame['vbr_frameno']})")
+            with l_met.timer("decode.retrieve"):
+                ok, image = cap.retrieve()
+            if not ok:
+                logging.error(f"could not retrieve frame at pts_time {cur_time:.6f}")
+                continue
+            last_time, last_image = cur_time, image
+            yield frame, image
+    finally:
+        cap.release()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,108 @@
+import os
+import sys
+import json
+import errno
+import shutil
+import logging
+
+logging=logging.getLogger(__name__)
+
+# linux FICLONE ioctl, _IOW(0x94, 9, int): share the data blocks of another file (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+STAGE_MODES = ("auto", "reflink", "hardlink", "copy", "manifest")
+
+def reflink(src, dst):
+    """copy-on-write clone of src as dst, OSError where the filesystem can not do it"""
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+
+def stage_file(src, dst, mode="auto"):
+    """
+    Put src at dst without copying the data when possible.
+    auto tries reflink, then hardlink, then copies. An existing dst is replaced.
+
+    Returns:
+        str: how it was staged, reflink / hardlink / copy, same when dst is src
+    """
+    if os.path.lexists(dst):
+        if os.path.abspath(src) == os.path.abspath(dst):
+            return "same"
+        if mode in ("auto", "hardlink") and os.path.samefile(src, dst):
+            return "hardlink"
+        # removing a hardlink or clone leaves src as it is
+        os.remove(dst)
+    if mode in ("auto", "reflink") and sys.platform.startswith("linux"):
+        try:
+            reflink(src, dst)
+            return "reflink"
+        except OSError as e:
+            if mode == "reflink":
+                raise
+            logging.debug(f"no reflink for {dst}: {e}")
+    if mode in ("auto", "hardlink"):
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError as e:
+            if mode == "hardlink" or e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EACCES):
+                raise
+            logging.debug(f"no hardlink for {dst}: {e}")
+    shutil.copyfile(src, dst)
+    return "copy"
+
+def stage_frames(resolved, out_path, mode="auto", manifest_path=None):
+    """
+    Stage the pngs of a resolved framelist (l_fidx.FrameFileIndex.resolve_framelist) into out_path.
+    mode manifest stages nothing and only writes the manifest with the original paths.
+
+    The manifest is a json list of {"path", "vbr_frameno", "pts_time", "requested_time", "staged"},
+    path relative to the manifest's folder, so it can be used as the frames source of
+    main_screen_detect_iterate.py --batch.
+
+    Returns:
+        dict: number of files per way of staging
+    """
+    if mode not in STAGE_MODES:
+        raise ValueError(f"unknown stage mode {mode}, one of {STAGE_MODES}")
+    if mode == "manifest" and manifest_path is None:
+        raise ValueError("mode manifest needs a manifest_path")
+    os.makedirs(out_path, exist_ok=True)
+    manifest_folder = os.path.dirname(os.path.abspath(manifest_path)) if manifest_path else None
+    counts = {}
+    manifest = []
+    staged_paths = {}
+    for frame, png_path in resolved:
+        if png_path is None:
+            continue
+        if mode == "manifest":
+            path, how = png_path, "manifest"
+        elif png_path in staged_paths:
+            # nearest fallback can pick the same png for several frames
+            path, how = staged_paths[png_path], "duplicate"
+        else:
+            path = os.path.join(out_path, os.path.basename(png_path))
+            how = stage_file(png_path, path, mode)
+            staged_paths[png_path] = path
+        counts[how] = counts.get(how, 0) + 1
+        if manifest_folder is not None:
+            manifest.append({"path": os.path.relpath(os.path.abspath(path), manifest_folder),
+                             "vbr_frameno": frame["vbr_frameno"],
+                             "pts_time": frame["pts_time"],
+                             "requested_time": frame["requested_time"],
+                             "staged": how})
+    if manifest_path is not None:
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=4)
+    logging.info(f"staged into {out_path}: {counts}")
+    return counts
+
+
+if __name__ == "__main__":
+    pass
@@ -1,38 +1,33 @@
 import os
+import functools
 import numpy as np
 import cv2
 from google.api_core.client_options import ClientOptions
+from google.api_core import exceptions as g_exceptions
 from google.cloud import vision
 import json
-
-def g_cv_doc_text_detect(file_contents, api_key):
-    """Detects text in the image file and returns words with confidence scores."""
-
-    client_options = ClientOptions(api_key=api_key)
-    client = vision.ImageAnnotatorClient(client_options=client_options)
-    
-    content = file_contents
-
-    image = vision.Image(content=content)
-
-    # Use document_text_detection for more detailed results including confidence
-    response = client.document_text_detection(image=image)
-
-    if response.error.message:
-        raise Exception(
-                '{}\nFor more info on error messages, check: '
-                'https://cloud.google.com/apis/design/errors'.format(
-                    response.error.message))
-
-    # The first text annotation is the full text of the image.
-    # Subsequent annotations are for individual words.
-    # To get confidence for each word, we need to iterate through the fullTextAnnotation
-
+import lib_ocr_cache as l_ocrc
+import lib_metrics as l_met
+
+# part of the ocr cache key, change it when the request or the word list format changes
+G_OCR_PARAMS = {"engine": "google_vision", "feature": "DOCUMENT_TEXT_DETECTION"}
+
+@functools.lru_cache(maxsize=None)
+def g_get_client(api_key, api_endpoint=None):
+    """
+    One ImageAnnotatorClient per api key (and endpoint), shared by all calls and threads.
+    api_endpoint is for pointing the client at something else than vision.googleapis.com.
+    """
+    client_options = ClientOptions(api_key=api_key, api_endpoint=api_endpoint)
+    return vision.ImageAnnotatorClient(client_options=client_options)
+
+def g_annotation_to_wordlist(full_text_annotation):
+    """word, confidence and bounding_box for every word in a full_text_annotation"""
     all_word_data = []
 
     # The response from document_text_detection contains a fullTextAnnotation
     # which is structured into pages, blocks, paragraphs, words, and symbols.
-    for page in response.full_text_annotation.pages:
+    for page in full_text_annotation.pages:
         for block in page.blocks:
             for paragraph in block.paragraphs:
                 for word in paragraph.words:
@@ -49,11 +44,187 @@ def g_cv_doc_text_detect(file_contents, api_key):
                         "bounding_box": vertices
                     }
                     all_word_data.append(word_data)
-                                    
-
 
     return all_word_data
 
+def g_cv_doc_text_detect(file_contents, api_key, client=None, cache=None):
+    """
+    Detects text in the image file and returns words with confidence scores.
+    The client is shared between calls (g_get_client), pass client to use another one, eg. a stub.
+    With a lib_ocr_cache.OcrCache as cache, images seen before are not sent again.
+    """
+
+    if cache is not None:
+        cache_key = l_ocrc.ocr_cache_key(file_contents, G_OCR_PARAMS)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+        all_word_data = g_cv_doc_text_detect(file_contents, api_key, client)
+        cache.put(cache_key, all_word_data)
+        return all_word_data
+
+    if client is None:
+        client = g_get_client(api_key)
+    
+    content = file_contents
+
+    image = vision.Image(content=content)
+
+    # Use document_text_detection for more detailed results including confidence
+    l_met.count("google_ocr.requests")
+    l_met.count("google_ocr.request_bytes", len(content))
+    with l_met.timer("google_ocr.latency"):
+        response = client.document_text_detection(image=image)
+
+    if response.error.message:
+        # the exception class of the status code, eg. ResourceExhausted is retried by the dispatcher, InvalidArgument not
+        raise g_exceptions.from_grpc_status(response.error.code,
+                '{}\nFor more info on error messages, check: '
+                'https://cloud.google.com/apis/design/errors'.format(
+                    response.error.message))
+
+    # The first text annotation is the full text of the image.
+    # Subsequent annotations are for individual words.
+    # To get confidence for each word, we need to iterate through the fullTextAnnotation
+    return g_annotation_to_wordlist(response.full_text_annotation)
+
+# vision api limits for one images:annotate request
+G_BATCH_MAX_IMAGES = 16
+G_BATCH_MAX_BYTES = 8 * 1024 * 1024 # 10 MB request limit, keep some room for the rest of the request
+
+def g_batch_chunks(contents_list, max_images=G_BATCH_MAX_IMAGES, max_bytes=G_BATCH_MAX_BYTES):
+    """split a list of encoded images into index lists that each fit in one batch request"""
+    chunk = []
+    chunk_bytes = 0
+    for i, content in enumerate(contents_list):
+        if chunk and (len(chunk) >= max_images or chunk_bytes + len(content) > max_bytes):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(i)
+        chunk_bytes += len(content)
+    if chunk:
+        yield chunk
+
+class GoogleOcrBatchError(Exception):
+    """
+    Some images of a batch call got an error response. errors is {index: error message},
+    word_lists the results of the call with None for the failed images.
+    """
+    def __init__(self, errors, word_lists):
+        self.errors = errors
+        self.word_lists = word_lists
+        super().__init__(
+                '{} of {} images failed: {}\nFor more info on error messages, check: '
+                'https://cloud.google.com/apis/design/errors'.format(
+                    len(errors), len(word_lists), "; ".join(f"{i}: {message}" for i, message in errors.items())))
+
+def g_cv_batch_doc_text_detect(contents_list, api_key, client=None, max_images=G_BATCH_MAX_IMAGES, max_bytes=G_BATCH_MAX_BYTES, cache=None):
+    """
+    document_text_detection for many images, packed into as few batch_annotate_images
+    requests as the limits allow. With a cache only the images not in it are sent, and
+    each result is stored as soon as its request returns.
+    An error response for an image does not stop the others, GoogleOcrBatchError is raised
+    at the end with the failed indices (the other results are in the cache and in the error).
+
+    Returns:
+        list: one word list per image (same as g_cv_doc_text_detect), in input order
+    """
+    all_word_lists = [None] * len(contents_list)
+    cache_keys = None
+    if cache is not None:
+        cache_keys = [l_ocrc.ocr_cache_key(content, G_OCR_PARAMS) for content in contents_list]
+        all_word_lists = [cache.get(cache_key) for cache_key in cache_keys]
+    missing = [i for i, word_list in enumerate(all_word_lists) if word_list is None]
+    if not missing:
+        return all_word_lists
+
+    if client is None:
+        client = g_get_client(api_key)
+    feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+
+    errors = {}
+    for chunk in g_batch_chunks([contents_list[i] for i in missing], max_images, max_bytes):
+        chunk = [missing[j] for j in chunk]
+        requests = [vision.AnnotateImageRequest(image=vision.Image(content=contents_list[i]), features=[feature])
+                    for i in chunk]
+        l_met.count("google_ocr.batch_requests")
+        l_met.count("google_ocr.batch_images", len(chunk))
+        with l_met.timer("google_ocr.batch_latency"):
+            response = client.batch_annotate_images(requests=requests)
+        for i, image_response in zip(chunk, response.responses):
+            if image_response.error.message:
+                errors[i] = image_response.error.message
+                continue
+            all_word_lists[i] = g_annotation_to_wordlist(image_response.full_text_annotation)
+            if cache is not None:
+                cache.put(cache_keys[i], all_word_lists[i])
+    if errors:
+        l_met.count("google_ocr.batch_errors", len(errors))
+        raise GoogleOcrBatchError(errors, all_word_lists)
+    return all_word_lists
+
+def g_wordlist_offset(google_doc_word_list, dx, dy, scale=1.0):
+    """
+    copy of a word list with the boxes moved by dx, dy, eg. from screen ROI to full frame coordinates.
+    scale is how much the ROI was resized before ocr, boxes are scaled back first.
+    """
+    if scale == 1.0:
+        return [{"word": word["word"],
+                 "confidence": word["confidence"],
+                 "bounding_box": [(vertex[0] + dx, vertex[1] + dy) for vertex in word["bounding_box"]]}
+                for word in google_doc_word_list]
+    return [{"word": word["word"],
+             "confidence": word["confidence"],
+             "bounding_box": [(int(round(vertex[0] / scale)) + dx, int(round(vertex[1] / scale)) + dy) for vertex in word["bounding_box"]]}
+            for word in google_doc_word_list]
+
+def g_frames_detect(frames, detect_many):
+    """
+    Fan the ROIs of many frames out to one detect_many call and the word lists back per frame.
+
+    Args:
+        frames: list of (key, rois), rois a list of (content, (x, y)) or (content, (x, y), scale)
+                with x, y the ROI's top left corner in the frame ((0, 0) for a whole frame),
+                see lib_ocr_roi.encode_screen_rois
+        detect_many: list of encoded images -> one word list per image, eg. g_cv_batch_doc_text_detect
+                     or lib_ocr_backend.OcrBackend.ocr_many_fn
+
+    Returns:
+        dict: {key: word list in full frame coordinates}, the "google_ocr" list of the _vbr_ocr.json files
+    """
+    contents_list = []
+    owners = []
+    for key, rois in frames:
+        for roi in rois:
+            content, (x, y) = roi[0], roi[1]
+            contents_list.append(content)
+            owners.append((key, x, y, roi[2] if len(roi) > 2 else 1.0))
+
+    word_lists = detect_many(contents_list) if contents_list else []
+    frame_word_lists = {key: [] for key, _ in frames}
+    for (key, x, y, scale), word_list in zip(owners, word_lists):
+        frame_word_lists[key].extend(g_wordlist_offset(word_list, x, y, scale))
+    return frame_word_lists
+
+def g_cv_batch_frames_detect(frames, api_key, client=None, max_images=G_BATCH_MAX_IMAGES, max_bytes=G_BATCH_MAX_BYTES, cache=None):
+    """
+    OCR for many frames, each either a whole encoded frame or several cropped screen ROIs,
+    all packed into batch requests and fanned back out per frame, see g_frames_detect.
+
+    Returns:
+        dict: {key: word list in full frame coordinates}
+    """
+    return g_frames_detect(frames, lambda contents_list: g_cv_batch_doc_text_detect(
+        contents_list, api_key, client, max_images, max_bytes, cache))
+
+def g_encode_image(cv2_img, ext='.png'):
+    """Encode a decoded frame in memory, gives the same bytes g_cv_doc_text_detect gets from a png file."""
+    ok, buf = cv2.imencode(ext, cv2_img)
+    if not ok:
+        raise ValueError(f"Could not encode image as {ext}")
+    return buf.tobytes()
+
 def g_wordlist_draw_boxes(google_doc_word_list,cv2_img):
     for word in google_doc_word_list:
         vertices = word["bounding_box"]
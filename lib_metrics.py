@@ -0,0 +1,179 @@
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+import functools
+
+# off unless VBR_METRICS=1 or enable() is called; when off timer() hands out one shared
+# no-op context manager and count()/observe() return after a single check
+_enabled = os.environ.get("VBR_METRICS", "") not in ("", "0")
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+# histogram bucket upper bounds, seconds for timers (1 ms .. 60 s), plain values otherwise
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+class _Histogram:
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+
+    def quantile(self, q):
+        """upper bound of the bucket holding the q quantile (max for the overflow bucket)"""
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {"count": self.count, "sum": self.total, "min": self.min, "max": self.max,
+                "mean": self.total / self.count, "p50": self.quantile(0.5), "p90": self.quantile(0.9),
+                "p99": self.quantile(0.99),
+                "buckets": {str(bound): n for bound, n in zip(BUCKETS + ("inf",), self.buckets) if n}}
+
+def count(name, n=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+def observe(name, value):
+    """add value to histogram name, eg. candidates per frame"""
+    if not _enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = _Histogram()
+        histogram.add(value)
+
+class _Timer:
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.t0)
+        return False
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NO_TIMER = _NoTimer()
+
+def timer(name):
+    """
+    with l_met.timer("screen_detect.canny"):
+        ...
+    wall time goes into histogram name
+    """
+    return _Timer(name) if _enabled else _NO_TIMER
+
+def timed(name):
+    """decorator version of timer"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Timer(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def snapshot():
+    """dict with counters and histograms, the format of dump_json"""
+    with _lock:
+        return {"counters": dict(sorted(_counters.items())),
+                "histograms": {name: h.to_dict() for name, h in sorted(_histograms.items())}}
+
+def merge(data):
+    """add a snapshot() from somewhere else, eg. a worker process, to the metrics here"""
+    if not _enabled:
+        return
+    bucket_index = {str(bound): i for i, bound in enumerate(BUCKETS + ("inf",))}
+    with _lock:
+        for name, value in data["counters"].items():
+            _counters[name] = _counters.get(name, 0) + value
+        for name, h in data["histograms"].items():
+            histogram = _histograms.get(name)
+            if histogram is None:
+                histogram = _histograms[name] = _Histogram()
+            histogram.count += h["count"]
+            histogram.total += h["sum"]
+            histogram.min = min(histogram.min, h["min"])
+            histogram.max = max(histogram.max, h["max"])
+            for bound, n in h["buckets"].items():
+                histogram.buckets[bucket_index[bound]] += n
+
+def summary():
+    """the metrics as a text table"""
+    data = snapshot()
+    lines = []
+    for name, value in data["counters"].items():
+        lines.append(f"{name:<36} {value:>12}")
+    for name, h in data["histograms"].items():
+        lines.append(f"{name:<36} {h['count']:>12}  sum {h['sum']:.3f}  mean {h['mean']:.4f}"
+                     f"  p50 {h['p50']:.4f}  p90 {h['p90']:.4f}  p99 {h['p99']:.4f}  max {h['max']:.4f}")
+    return "\n".join(lines)
+
+def dump_json(path):
+    with open(path, 'w') as f:
+        json.dump(snapshot(), f, indent=4)
+
+def report(json_path=None, stream=None):
+    """print the summary and write the json file, what the main scripts call at the end of a run"""
+    if not _enabled:
+        return
+    print(summary(), file=stream or sys.stderr)
+    if json_path:
+        dump_json(json_path)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,170 @@
+import os
+import abc
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cv2
+import lib_metrics as l_met
+import lib_ocr_cache as l_ocrc
+
+logging=logging.getLogger(__name__)
+
+# the local engine is optional, only needed for TesseractOcrBackend
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+class OcrBackend(abc.ABC):
+    """
+    encoded image bytes -> google_ocr word list ({"word", "confidence", "bounding_box"} per word,
+    bounding_box 4 (x, y) vertices clockwise from top left), whatever engine does the work.
+    params identifies the engine and its settings in the ocr cache key.
+    """
+    name = None
+    params = {}
+    # detect_many sends many images in one request, the pipeline then batches the rois of several frames
+    batched = False
+
+    @abc.abstractmethod
+    def detect(self, file_contents):
+        """encoded image bytes -> word list"""
+
+    def detect_many(self, contents_list):
+        """one word list per image, in input order"""
+        return [self.detect(content) for content in contents_list]
+
+    def ocr_fn(self, cache=None):
+        """the ocr_fn of main_pipeline.run_pipeline / lib_ocr_roi, through a lib_ocr_cache.OcrCache if given"""
+        if cache is None:
+            return self.detect
+        return lambda content: cache.cached(self.detect, content, self.params)
+
+    def ocr_many_fn(self, cache=None):
+        """list of encoded images -> word lists (detect_many), images in the cache are not sent"""
+        if cache is None:
+            return self.detect_many
+
+        def cached_many(contents_list):
+            cache_keys = [l_ocrc.ocr_cache_key(content, self.params) for content in contents_list]
+            word_lists = [cache.get(cache_key) for cache_key in cache_keys]
+            missing = [i for i, word_list in enumerate(word_lists) if word_list is None]
+            if missing:
+                for i, word_list in zip(missing, self.detect_many([contents_list[i] for i in missing])):
+                    cache.put(cache_keys[i], word_list)
+                    word_lists[i] = word_list
+            return word_lists
+        return cached_many
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class GoogleOcrBackend(OcrBackend):
+    """google vision document_text_detection, see lib_google_ocr"""
+    name = "google"
+    batched = True
+
+    def __init__(self, api_key, client=None):
+        import lib_google_ocr as l_gocr
+        self._gocr = l_gocr
+        self.api_key = api_key
+        self.client = client
+        self.params = l_gocr.G_OCR_PARAMS
+
+    def detect(self, file_contents):
+        return self._gocr.g_cv_doc_text_detect(file_contents, self.api_key, self.client)
+
+    def detect_many(self, contents_list):
+        return self._gocr.g_cv_batch_doc_text_detect(contents_list, self.api_key, self.client)
+
+    def ocr_many_fn(self, cache=None):
+        # the batch call does its own cache lookups and stores each result as its request returns
+        if cache is None:
+            return self.detect_many
+        return lambda contents_list: self._gocr.g_cv_batch_doc_text_detect(contents_list, self.api_key, self.client,
+                                                                          cache=cache)
+
+def tesseract_data_to_wordlist(data, min_confidence=0):
+    """pytesseract.image_to_data(..., output_type=DICT) -> google_ocr word list, confidence 0..1 like google"""
+    all_word_data = []
+    for text, conf, left, top, width, height in zip(data["text"], data["conf"], data["left"], data["top"],
+                                                   data["width"], data["height"]):
+        conf = float(conf)
+        text = text.strip()
+        if not text or conf < min_confidence:
+            continue
+        all_word_data.append({
+            "word": text,
+            "confidence": conf / 100,
+            "bounding_box": [(left, top), (left + width, top), (left + width, top + height), (left, top + height)]
+        })
+    return all_word_data
+
+def _tesseract_words(file_contents, lang, config, min_confidence):
+    # runs in a worker process
+    image = cv2.imdecode(np.frombuffer(file_contents, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("could not decode image for tesseract")
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    data = pytesseract.image_to_data(rgb, lang=lang, config=config, output_type=pytesseract.Output.DICT)
+    return tesseract_data_to_wordlist(data, min_confidence)
+
+def _limit_worker_threads():
+    # one tesseract per core, not one per core times its own openmp threads
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    cv2.setNumThreads(1)
+
+class TesseractOcrBackend(OcrBackend):
+    """
+    Local tesseract (pytesseract) OCR, no network. Images are recognised in a process pool,
+    so detect can be called from many dispatcher threads at once and throughput scales with cores.
+    The workers come from a forkserver, never forked from the pipeline's decode / detect threads.
+
+    Args:
+        lang: tesseract language(s), eg. "swe+eng"
+        config: extra tesseract options, eg. "--psm 11"
+        workers: processes, None is one per core
+        min_confidence: drop words below this tesseract confidence (0..100)
+    """
+    name = "tesseract"
+
+    def __init__(self, lang="eng", config="", workers=None, min_confidence=0):
+        if pytesseract is None:
+            raise ImportError("TesseractOcrBackend needs pytesseract (pip install pytesseract) and the tesseract binary")
+        self.lang = lang
+        self.config = config
+        self.min_confidence = min_confidence
+        self.params = {"engine": "tesseract", "lang": lang, "config": config, "min_confidence": min_confidence}
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver"),
+                                             initializer=_limit_worker_threads)
+
+    def detect(self, file_contents):
+        with l_met.timer("tesseract.latency"):
+            return self._executor.submit(_tesseract_words, file_contents, self.lang, self.config,
+                                         self.min_confidence).result()
+
+    def detect_many(self, contents_list):
+        return list(self._executor.map(_tesseract_words, contents_list, [self.lang] * len(contents_list),
+                                       [self.config] * len(contents_list), [self.min_confidence] * len(contents_list)))
+
+    def close(self):
+        self._executor.shutdown()
+
+OCR_BACKENDS = {"google": GoogleOcrBackend, "tesseract": TesseractOcrBackend}
+
+def get_backend(name, **kwargs):
+    """eg. get_backend("google", api_key=api_key) or get_backend("tesseract", lang="swe+eng")"""
+    if name not in OCR_BACKENDS:
+        raise ValueError(f"unknown ocr backend {name}, one of {list(OCR_BACKENDS)}")
+    return OCR_BACKENDS[name](**kwargs)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,136 @@
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import lib_metrics as l_met
+
+logging=logging.getLogger(__name__)
+
+def ocr_cache_key(file_contents, ocr_params=None):
+    """sha256 of the encoded image bytes plus the ocr settings, eg. {"engine": "google_doc_text"}"""
+    h = hashlib.sha256()
+    h.update(json.dumps(ocr_params or {}, sort_keys=True).encode())
+    h.update(b"\0")
+    h.update(file_contents)
+    return h.hexdigest()
+
+class OcrCache:
+    """
+    Persistent OCR results keyed on image content, in one sqlite file.
+    Least recently used entries are dropped when the stored results go over max_bytes.
+    Safe to share between the dispatcher threads, and between OcrCache objects and processes
+    on the same file: the total size is a one row table updated in the write transaction.
+    A hit only writes when the entry's last_used is older than touch_interval, so hits from
+    many pipelines do not queue up on the sqlite write lock.
+
+    Args:
+        path: sqlite file, eg. ../ocr_cache.sqlite so all videos share it
+        max_bytes: size limit for the stored results (json text)
+        touch_interval: seconds, how stale last_used can get before a hit updates it
+    """
+    def __init__(self, path, max_bytes=2 * 1024**3, touch_interval=3600.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # other connections can hold the write lock for a moment, wait for it
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.execute("CREATE TABLE IF NOT EXISTS ocr (key TEXT PRIMARY KEY, result TEXT, size INTEGER, last_used REAL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS ocr_last_used ON ocr (last_used)")
+            self._db.execute("DROP INDEX IF EXISTS ocr_size") # the total is kept in ocr_total now
+            self._db.execute("CREATE TABLE IF NOT EXISTS ocr_total (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER)")
+            # files from before ocr_total: summed once here
+            self._db.execute("INSERT OR IGNORE INTO ocr_total (id, bytes) SELECT 0, COALESCE(SUM(size), 0) FROM ocr")
+        except BaseException:
+            self._db.rollback()
+            raise
+        self._db.commit()
+
+    def get(self, key):
+        """cached result or None"""
+        with self._lock:
+            row = self._db.execute("SELECT result, last_used FROM ocr WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                l_met.count("ocr_cache.misses")
+                return None
+            now = time.time()
+            if now - row[1] > self.touch_interval:
+                self._db.execute("UPDATE ocr SET last_used = ? WHERE key = ?", (now, key))
+                self._db.commit()
+            self.hits += 1
+        l_met.count("ocr_cache.hits")
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        result_json = json.dumps(result)
+        size = len(result_json)
+        with self._lock:
+            # IMMEDIATE takes the write lock first, so no other connection changes the
+            # table between the insert, the size total and the evictions
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                old = self._db.execute("SELECT size FROM ocr WHERE key = ?", (key,)).fetchone()
+                self._db.execute("INSERT OR REPLACE INTO ocr (key, result, size, last_used) VALUES (?, ?, ?, ?)",
+                                 (key, result_json, size, time.time()))
+                self._add_bytes(size - (old[0] if old else 0))
+                self._evict()
+            except BaseException:
+                self._db.rollback()
+                raise
+            self._db.commit()
+
+    def _total_bytes(self):
+        return self._db.execute("SELECT bytes FROM ocr_total WHERE id = 0").fetchone()[0]
+
+    def _add_bytes(self, n):
+        self._db.execute("UPDATE ocr_total SET bytes = bytes + ? WHERE id = 0", (n,))
+
+    def _evict(self):
+        total_bytes = self._total_bytes()
+        freed = 0
+        while total_bytes > self.max_bytes:
+            rows = self._db.execute("SELECT key, size FROM ocr ORDER BY last_used LIMIT 64").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if total_bytes <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM ocr WHERE key = ?", (key,))
+                total_bytes -= size
+                freed += size
+                self.evictions += 1
+        if freed:
+            self._add_bytes(-freed)
+
+    def cached(self, ocr_fn, file_contents, ocr_params=None):
+        """ocr_fn(file_contents) through the cache"""
+        key = ocr_cache_key(file_contents, ocr_params)
+        result = self.get(key)
+        if result is None:
+            result = ocr_fn(file_contents)
+            self.put(key, result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM ocr").fetchone()[0]
+            total_bytes = self._total_bytes()
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": entries, "bytes": total_bytes}
+
+    def close(self):
+        logging.info(f"ocr cache {self.path}: {self.stats()}")
+        self._db.close()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import hashlib
+import logging
+import lib_ocr_dispatch as l_ocrd
+
+logging=logging.getLogger(__name__)
+
+def selection_hash(framearrays):
+    """
+    identifies a frame selection (framearrays_from_timespan), the checkpoint keys are
+    positions in it and mean other frames once the selection changes
+    """
+    digest = hashlib.sha1()
+    for field in ("index", "vbr_frameno"):
+        digest.update(field.encode())
+        digest.update(framearrays[field].astype("<i8").tobytes())
+    return digest.hexdigest()
+
+def read_selection(log_path):
+    """the selection hash in the header line of a checkpoint log, None if there is none"""
+    if not os.path.exists(log_path):
+        return None
+    with open(log_path, 'rb') as f:
+        try:
+            return json.loads(f.readline()).get("selection")
+        except ValueError:
+            return None
+
+def iter_log(log_path):
+    """
+    (key, entry, offset) for every line of a checkpoint log. A half written
+    last line (crash while appending) is skipped, so is the header line.
+    """
+    if not os.path.exists(log_path):
+        return
+    with open(log_path, 'rb') as f:
+        offset = 0
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.warning(f"skipping broken line at byte {offset} in {log_path}")
+            else:
+                if "key" in record:
+                    yield record["key"], record["entry"], offset
+            offset += len(line)
+
+def _truncate_torn_line(log_path):
+    # a half written last line has no newline, the next append would be glued onto it
+    if not os.path.exists(log_path):
+        return
+    with open(log_path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        end = size
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        logging.warning(f"dropping the half written last line of {log_path} ({size - end} bytes)")
+        f.truncate(end)
+
+class OcrCheckpoint:
+    """
+    Append-only JSON Lines log of per-frame OCR entries, one line per finished frame,
+    so a crash or quota error only loses the frames in flight.
+
+    Args:
+        log_path: eg. ../145147_out/145147_ocr_checkpoint.jsonl
+        resume: keep what is already in the log, else start a new log
+        fsync: fsync after every line, flush is enough unless the machine itself dies
+        selection: selection_hash of the frames the keys refer to, written in a header line;
+            a log made for another selection is not resumed but started over
+    """
+    def __init__(self, log_path, resume=True, fsync=False, selection=None):
+        self.log_path = log_path
+        self.fsync = fsync
+        if resume and selection is not None and os.path.exists(log_path) and read_selection(log_path) != selection:
+            logging.warning(f"{log_path} is for another frame selection, starting a new log")
+            resume = False
+        if resume:
+            _truncate_torn_line(log_path)
+        self.done = set(key for key, _, _ in iter_log(log_path)) if resume else set()
+        self.f = open(log_path, 'a' if resume else 'w')
+        if selection is not None and self.f.tell() == 0:
+            self.f.write(json.dumps({"selection": selection}) + "\n")
+            self.f.flush()
+
+    def append(self, key, entry):
+        self.f.write(json.dumps({"key": key, "entry": entry}) + "\n")
+        self.f.flush()
+        if self.fsync:
+            os.fsync(self.f.fileno())
+        self.done.add(key)
+
+    def close(self):
+        self.f.close()
+
+def compact(log_path, out_path, ref_field="ocr_ref", indent=4):
+    """
+    Write the final json object from a checkpoint log, keys in sorted order.
+    Only line offsets are kept in memory, each entry is read back when it is written.
+    Entries with ref_field (dedup) get google_ocr from the entry they point to; ref_field is
+    kept, as the json key of that entry (lib_frame_dedup.resolve_ocr_refs reads the same field).
+
+    Returns:
+        int: number of entries written
+    """
+    offsets = {}
+    for key, _, offset in iter_log(log_path):
+        offsets[key] = offset # later lines win
+
+    with open(log_path, 'rb') as log, l_ocrd.JsonObjectWriter(out_path, indent) as writer:
+        def read_entry(key):
+            log.seek(offsets[key])
+            return json.loads(log.readline())["entry"]
+
+        last_ref = (None, None)
+        for key in sorted(offsets):
+            entry = read_entry(key)
+            ref_key = entry.get(ref_field)
+            if ref_key is not None:
+                entry[ref_field] = str(ref_key)
+            seen = set()
+            while ref_key is not None and ref_key in offsets and ref_key not in seen:
+                seen.add(ref_key)
+                if last_ref[0] == ref_key:
+                    entry["google_ocr"] = last_ref[1]
+                    break
+                ref_entry = read_entry(ref_key)
+                if ref_entry.get("google_ocr") is not None:
+                    last_ref = (ref_key, ref_entry["google_ocr"])
+                    entry["google_ocr"] = ref_entry["google_ocr"]
+                    break
+                ref_key = ref_entry.get(ref_field)
+            writer.write(key, entry)
+        return writer.count
+
+
+if __name__ == "__main__":
+    # python lib_ocr_checkpoint.py <log.jsonl> <out.json>
+    print(f"{compact(sys.argv[1], sys.argv[2])} entries written to {sys.argv[2]}")
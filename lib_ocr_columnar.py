@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import numpy as np
+
+# version of the folder layout below, version 1 folders (no per frame extras) still load
+COLUMNS_VERSION = 2
+READABLE_VERSIONS = (1, 2)
+
+# per frame fields of the _new_ocr.json files that get their own column when present
+FRAME_NUMBER_FIELDS = {"vbr_frameno": np.int64, "pts_time": np.float64, "requested_time": np.float64}
+
+def columns_path(json_path):
+    """143800_vfr__vbr_ocr.json -> 143800_vfr__vbr_ocr.cols/"""
+    return os.path.splitext(json_path)[0] + ".cols"
+
+def _save(out_dir, name, arr):
+    np.save(os.path.join(out_dir, name + ".npy"), arr)
+
+def ocr_json_to_columns(ocr_json, out_dir):
+    """
+    Write OCR results ({key: {"google_ocr": [words], ...}}, the _vbr_ocr.json and
+    _new_ocr.json layout) as flat columns in out_dir:
+
+        frame_key      int32  [frames]    index into strings
+        word_offsets   int64  [frames+1]  words of frame i are word_offsets[i]:word_offsets[i+1]
+        word           int32  [words]     index into strings (interned)
+        confidence     float32[words]
+        bounding_box   int16  [words,4,2]
+        vbr_frameno, pts_time, requested_time  [frames], when any entry has them, plus
+            <field>_present bool [frames] when some entries do not
+        extra_<field>  int32  [frames]    every other per frame field (frame, screens, ocr_ref, ...)
+                                          as an index into strings of its json, -1 where the entry has none
+        strings.json   the string table
+
+    Returns:
+        dict: number of frames and words
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    strings = []
+    string_ids = {}
+
+    def intern(s):
+        if s not in string_ids:
+            string_ids[s] = len(strings)
+            strings.append(s)
+        return string_ids[s]
+
+    keys = list(ocr_json.keys())
+    n_words = sum(len(ocr_json[key]["google_ocr"] or []) for key in keys)
+    frame_key = np.empty(len(keys), dtype=np.int32)
+    word_offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    word = np.empty(n_words, dtype=np.int32)
+    confidence = np.empty(n_words, dtype=np.float32)
+    bounding_box = np.empty((n_words, 4, 2), dtype=np.int16)
+    # the fields of all entries, not only the first one
+    fields = {}
+    for key in keys:
+        fields.update(dict.fromkeys(ocr_json[key]))
+    fields.pop("google_ocr", None)
+    frame_numbers = {field: np.full(len(keys), -1, dtype=dtype) for field, dtype in FRAME_NUMBER_FIELDS.items()
+                     if field in fields}
+    present = {field: np.zeros(len(keys), dtype=bool) for field in frame_numbers}
+    extras = {field: np.full(len(keys), -1, dtype=np.int32) for field in fields if field not in frame_numbers}
+
+    null_ocr = [] # positions of frames with "google_ocr": null, not []
+    w = 0
+    for i, key in enumerate(keys):
+        entry = ocr_json[key]
+        frame_key[i] = intern(str(key))
+        for field in frame_numbers:
+            if field in entry:
+                frame_numbers[field][i] = entry[field]
+                present[field][i] = True
+        for field in extras:
+            if field in entry:
+                extras[field][i] = intern(json.dumps(entry[field], ensure_ascii=False))
+        if entry["google_ocr"] is None:
+            null_ocr.append(i)
+        for word_data in entry["google_ocr"] or []:
+            box = np.asarray(word_data["bounding_box"], dtype=np.int64)
+            if box.shape != (4, 2):
+                raise ValueError(f"frame {key}: bounding box with {len(box)} vertices, 4 expected")
+            if np.any(np.abs(box) > np.iinfo(np.int16).max):
+                raise ValueError(f"frame {key}: bounding box {box.tolist()} does not fit int16")
+            word[w] = intern(word_data["word"])
+            confidence[w] = word_data["confidence"]
+            bounding_box[w] = box
+            w += 1
+        word_offsets[i + 1] = w
+
+    _save(out_dir, "frame_key", frame_key)
+    _save(out_dir, "word_offsets", word_offsets)
+    _save(out_dir, "word", word)
+    _save(out_dir, "confidence", confidence)
+    _save(out_dir, "bounding_box", bounding_box)
+    for field, arr in frame_numbers.items():
+        _save(out_dir, field, arr)
+    partial_fields = [field for field, mask in present.items() if not mask.all()]
+    for field in partial_fields:
+        _save(out_dir, field + "_present", present[field])
+    for field, arr in extras.items():
+        _save(out_dir, "extra_" + field, arr)
+    with open(os.path.join(out_dir, "strings.json"), 'w') as f:
+        json.dump(strings, f, ensure_ascii=False)
+    # meta last, a folder without it is incomplete
+    with open(os.path.join(out_dir, "meta.json"), 'w') as f:
+        json.dump({"version": COLUMNS_VERSION, "frames": len(keys), "words": n_words,
+                   "frame_fields": list(frame_numbers), "partial_fields": partial_fields,
+                   "extra_fields": list(extras), "null_ocr": null_ocr}, f)
+    return {"frames": len(keys), "words": n_words}
+
+def convert_json(json_path, out_dir=None):
+    """converter for the existing json files, out_dir defaults to columns_path(json_path)"""
+    with open(json_path, 'r') as f:
+        ocr_json = json.load(f)
+    return ocr_json_to_columns(ocr_json, out_dir or columns_path(json_path))
+
+def load_ocr_columns(cols_dir, mmap=True):
+    """
+    Load a columns folder, the arrays memory mapped unless mmap=False.
+
+    Returns:
+        dict: the arrays by name plus 'strings' (list) and 'meta' (dict)
+    """
+    with open(os.path.join(cols_dir, "meta.json"), 'r') as f:
+        meta = json.load(f)
+    if meta["version"] not in READABLE_VERSIONS:
+        raise ValueError(f"{cols_dir} is version {meta['version']}, expected one of {READABLE_VERSIONS}")
+    meta.setdefault("partial_fields", [])
+    meta.setdefault("extra_fields", [])
+    meta.setdefault("null_ocr", [])
+    mmap_mode = 'r' if mmap else None
+    names = (["frame_key", "word_offsets", "word", "confidence", "bounding_box"] + meta["frame_fields"]
+             + [field + "_present" for field in meta["partial_fields"]]
+             + ["extra_" + field for field in meta["extra_fields"]])
+    cols = {name: np.load(os.path.join(cols_dir, name + ".npy"), mmap_mode=mmap_mode) for name in names}
+    with open(os.path.join(cols_dir, "strings.json"), 'r') as f:
+        cols["strings"] = json.load(f)
+    cols["meta"] = meta
+    return cols
+
+def _confidences(conf):
+    # float32 -> the shortest decimal that reads back as the same float32, eg. 0.9 and not 0.8999999761581421
+    return [float(str(c)) for c in conf]
+
+def frame_words(cols, i):
+    """google_ocr word list of frame number i (position, not key)"""
+    start, end = int(cols["word_offsets"][i]), int(cols["word_offsets"][i + 1])
+    strings = cols["strings"]
+    return [{"word": strings[word_id], "confidence": conf, "bounding_box": box.tolist()}
+            for word_id, conf, box in zip(cols["word"][start:end].tolist(), _confidences(cols["confidence"][start:end]),
+                                          cols["bounding_box"][start:end])]
+
+def columns_to_ocr_json(cols):
+    """
+    back to the {key: {"google_ocr": [...], ...}} layout with all the per frame fields.
+    Only lossy part: confidence has float32 precision (~7 digits).
+    """
+    ocr_json = {}
+    strings = cols["strings"]
+    meta = cols["meta"]
+    null_ocr = set(meta["null_ocr"])
+    for i, key_id in enumerate(cols["frame_key"].tolist()):
+        entry = {"google_ocr": None if i in null_ocr else frame_words(cols, i)}
+        for field in meta["frame_fields"]:
+            if field not in meta["partial_fields"] or cols[field + "_present"][i]:
+                entry[field] = cols[field][i].item()
+        for field in meta["extra_fields"]:
+            string_id = int(cols["extra_" + field][i])
+            if string_id >= 0:
+                entry[field] = json.loads(strings[string_id])
+        ocr_json[strings[key_id]] = entry
+    return ocr_json
+
+
+if __name__ == "__main__":
+    # python lib_ocr_columnar.py 143800_vfr__vbr_ocr.json [out_dir]
+    counts = convert_json(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    print(f"{sys.argv[1]}: {counts['frames']} frames, {counts['words']} words")
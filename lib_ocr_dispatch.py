@@ -0,0 +1,156 @@
+import json
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logging=logging.getLogger(__name__)
+
+# errors worth another attempt: overload, quota and timeouts, dropped connections.
+# an invalid api key, a bad image (INVALID_ARGUMENT) or a bug fail the same way every time
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError)
+try:
+    from google.api_core import exceptions as g_exceptions
+    TRANSIENT_ERRORS += (g_exceptions.ServiceUnavailable, g_exceptions.ResourceExhausted,
+                         g_exceptions.DeadlineExceeded, g_exceptions.InternalServerError)
+except ImportError:
+    pass
+
+class OcrDispatcher:
+    """
+    Runs OCR requests from a thread pool with a bounded number in flight.
+    The backend is any callable payload -> word list, eg.
+    lambda content: l_gocr.g_cv_doc_text_detect(content, api_key), which shares
+    one client, or a local stub when testing.
+
+    Args:
+        ocr_fn: callable(payload) -> result
+        max_in_flight: max concurrent requests (and threads)
+        retries: extra attempts per item after the first one fails
+        backoff: seconds before the first retry, doubled each time (with jitter)
+        retry_on: exception types that are retried, others fail the item at once (default TRANSIENT_ERRORS)
+        skip_failed: log and skip items that still fail, instead of raising
+    """
+    def __init__(self, ocr_fn, max_in_flight=8, retries=3, backoff=1.0, retry_on=TRANSIENT_ERRORS, skip_failed=False):
+        self.ocr_fn = ocr_fn
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_on = retry_on
+        self.skip_failed = skip_failed
+        self.done = 0
+        self.failed = 0
+        self.retried = 0
+        self._lock = threading.Lock() # retried is counted in the worker threads
+
+    def _call(self, key, payload):
+        for attempt in range(self.retries + 1):
+            try:
+                return key, self.ocr_fn(payload)
+            except self.retry_on as e:
+                if attempt == self.retries:
+                    raise
+                with self._lock:
+                    self.retried += 1
+                delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.0)
+                logging.warning(f"ocr {key} failed ({e}), retry {attempt+1} of {self.retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _finished(self, future):
+        try:
+            result = future.result()
+        except Exception:
+            self.failed += 1
+            if not self.skip_failed:
+                raise
+            logging.exception("ocr failed after retries, skipped")
+            return None
+        self.done += 1
+        return result
+
+    def map(self, items):
+        """
+        Args:
+            items: iterable of (key, payload), consumed lazily so payloads
+                   (encoded images) are not all held in memory
+
+        Yields:
+            tuple: (key, result) in completion order, not input order
+        """
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            pending = set()
+            for key, payload in items:
+                if len(pending) >= self.max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        result = self._finished(future)
+                        if result is not None:
+                            yield result
+                pending.add(executor.submit(self._call, key, payload))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = self._finished(future)
+                    if result is not None:
+                        yield result
+
+    def map_batches(self, items, batch_size=16):
+        """
+        Like map, but ocr_fn gets a list of up to batch_size payloads and must return
+        a list of results in the same order, eg.
+        lambda contents: l_gocr.g_cv_batch_doc_text_detect(contents, api_key).
+        Retries are per batch.
+
+        Yields:
+            tuple: (key, result) per item
+        """
+        def batches():
+            batch = []
+            for key, payload in items:
+                batch.append((key, payload))
+                if len(batch) >= batch_size:
+                    yield tuple(k for k, _ in batch), [p for _, p in batch]
+                    batch = []
+            if batch:
+                yield tuple(k for k, _ in batch), [p for _, p in batch]
+
+        for keys, results in self.map(batches()):
+            for key, result in zip(keys, results):
+                yield key, result
+
+class JsonObjectWriter:
+    """
+    Writes a json object one entry at a time, so results land on disk as they
+    complete and are not kept in memory. Same layout as json.dump(..., indent=4).
+
+        with JsonObjectWriter(out_json_path) as writer:
+            for key, annot_list in dispatcher.map(items):
+                writer.write(key, {"google_ocr": annot_list})
+    """
+    def __init__(self, path, indent=4):
+        self.path = path
+        self.indent = indent
+        self.count = 0
+        self.f = None
+
+    def __enter__(self):
+        self.f = open(self.path, 'w')
+        self.f.write("{")
+        return self
+
+    def write(self, key, value):
+        pad = " " * self.indent
+        value_json = json.dumps(value, indent=self.indent).replace("\n", "\n" + pad)
+        self.f.write(("," if self.count else "") + f"\n{pad}{json.dumps(str(key))}: {value_json}")
+        self.f.flush()
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        self.f.write("\n}" if self.count else "}")
+        self.f.close()
+        return False
+
+
+if __name__ == "__main__":
+    pass
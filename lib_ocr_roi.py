@@ -0,0 +1,86 @@
+import cv2
+import numpy as np
+import lib_google_ocr as l_gocr
+
+def median_text_height(google_doc_word_list):
+    """median word box height in pixels, None for an empty list"""
+    heights = [max(v[1] for v in word["bounding_box"]) - min(v[1] for v in word["bounding_box"])
+               for word in google_doc_word_list if word["bounding_box"]]
+    return float(np.median(heights)) if heights else None
+
+def roi_scale(text_height=None, target_text_height=None, min_scale=0.25, max_scale=2.0):
+    """resize factor that brings text_height to target_text_height, 1.0 if either is unknown"""
+    if not text_height or not target_text_height:
+        return 1.0
+    return float(min(max_scale, max(min_scale, target_text_height / text_height)))
+
+def encode_roi(image, rect, scale=1.0, ext='.png', png_compression=1):
+    """
+    Crop one ROI from a decoded frame, resize it and encode it in memory.
+    png_compression 1 is much faster than the default 3 and only a little bigger.
+    """
+    x, y, w, h = rect
+    roi = image[y:y+h, x:x+w]
+    if scale != 1.0:
+        interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_CUBIC
+        roi = cv2.resize(roi, (max(1, int(round(w * scale))), max(1, int(round(h * scale)))), interpolation=interpolation)
+    params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression] if ext == '.png' else []
+    ok, buf = cv2.imencode(ext, roi, params)
+    if not ok:
+        raise ValueError(f"Could not encode ROI {rect} as {ext}")
+    return buf.tobytes()
+
+def encode_screen_rois(image, screens, text_height=None, target_text_height=None, ext='.png', png_compression=1):
+    """
+    The screens from find_screens / detect_screens, cropped and encoded for upload.
+    The whole frame is used when no screens were found.
+
+    Args:
+        image: BGR np.ndarray
+        screens: list of (x, y, w, h)
+        text_height: text height in the frame, eg. median_text_height of an earlier result
+        target_text_height: text height to resize to, None keeps the size
+
+    Returns:
+        list: (content, (x, y), scale) per ROI, the roi format of l_gocr.g_cv_batch_frames_detect
+    """
+    if not screens:
+        screens = [(0, 0, image.shape[1], image.shape[0])]
+    scale = roi_scale(text_height, target_text_height)
+    return [(encode_roi(image, rect, scale, ext, png_compression), (rect[0], rect[1]), scale) for rect in screens]
+
+def ocr_screen_rois(image, screens, ocr_fn, text_height=None, target_text_height=None):
+    """
+    OCR each screen ROI on its own and merge the words back into one frame word list.
+
+    Args:
+        ocr_fn: encoded image bytes -> word list, eg. lambda c: l_gocr.g_cv_doc_text_detect(c, api_key, cache=cache)
+
+    Returns:
+        list: google_ocr word list in full frame coordinates
+    """
+    all_word_data = []
+    for content, (x, y), scale in encode_screen_rois(image, screens, text_height, target_text_height):
+        all_word_data.extend(l_gocr.g_wordlist_offset(ocr_fn(content), x, y, scale))
+    return all_word_data
+
+def ocr_frames_rois(frames, ocr_many_fn, text_height=None, target_text_height=None):
+    """
+    The screen ROIs of several frames in one ocr_many_fn call, so a batch backend sends them
+    in one request (up to 16 images) instead of one request per ROI.
+
+    Args:
+        frames: list of (image, screens), screens [] for the whole frame
+        ocr_many_fn: list of encoded images -> word lists, eg. lib_ocr_backend.OcrBackend.ocr_many_fn
+
+    Returns:
+        list: google_ocr word list in full frame coordinates per frame, in input order
+    """
+    rois = [(i, encode_screen_rois(image, screens, text_height, target_text_height))
+            for i, (image, screens) in enumerate(frames)]
+    word_lists = l_gocr.g_frames_detect(rois, ocr_many_fn)
+    return [word_lists[i] for i in range(len(frames))]
+
+
+if __name__ == "__main__":
+    pass
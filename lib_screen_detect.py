@@ -0,0 +1,364 @@
+import cv2
+import logging
+import numpy as np
+import lib_blackness as l_bl
+import lib_metrics as l_met
+
+logging=logging.getLogger(__name__)
+
+# the settings main_screen_detect_iterate.find_screens has always used
+DEFAULT_PARAMS = {
+    "blur_ksize": 7,
+    # Using the "higher" setting (40, 120) which was found to be most effective.
+    "canny_low": 40,
+    "canny_high": 120,
+    # Skip very small contours to reduce noise
+    "min_w": 300,
+    "min_h": 200,
+    # EX criteria, as fractions of the image size
+    "width_range": (0.15, 0.40),
+    "height_range": (0.15, 0.6),
+    "aspect_range": (0.8, 2.5),
+    "min_blackness": 50,
+    "max_screens": 3,
+    # a candidate overlapping a selected screen by more than this (of its own area) is dropped
+    "max_overlap": 0.3,
+    # 2 or 4 (a power of 2, others raise ValueError): find the contours on a 1/2 or 1/4 size image
+    # and refine the box edges at full size
+    "downscale": 1,
+}
+
+class DebugSink:
+    """
+    Writes the debug images (edges, candidates, final screens) to a folder.
+    Only pass one to detect_screens when you want them, drawing and writing is not free.
+    """
+    def __init__(self, foldername, basename, debuglevel=0):
+        self.foldername = foldername
+        self.basename = basename
+        self.debuglevel = debuglevel
+
+    def edges(self, edges):
+        if self.debuglevel > 2:
+            cv2.imwrite(self.foldername+f'{self.basename}_05_edges.png', edges)
+
+    def candidates(self, image, all_candidates):
+        debug_img = image.copy()
+        for candidate in all_candidates:
+            x, y, w, h = candidate['x'], candidate['y'], candidate['w'], candidate['h']
+            if candidate['category'] == 'EX':
+                color = (0, 255, 0)  # Green
+                thickness = 3
+            else:
+                color = (128, 128, 128) # Gray
+                thickness = 1
+            cv2.rectangle(debug_img, (x, y), (x+w, y+h), color, thickness)
+            cv2.putText(debug_img, f"#{candidate['id']} ({candidate['category']}) ({candidate['blackness_percentage']:.2f})", (x+5, y+20),
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+        cv2.imwrite(self.foldername+f'{self.basename}_06_candidates.png', debug_img)
+        logging.info(f"Saved candidates debug image.")
+
+    def final(self, image, final_screens):
+        final_img = image.copy()
+        for i, screen in enumerate(final_screens):
+            x, y, w, h = screen['x'], screen['y'], screen['w'], screen['h']
+            cv2.rectangle(final_img, (x, y), (x+w, y+h), (0, 255, 0), 3)
+            cv2.putText(final_img, f"Screen {i+1}", (x, y - 10),
+                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+            # Save individual screen ROI (Region of Interest)
+            cv2.imwrite(self.foldername+f'{self.basename}_08_final_screen_{i+1}.png', image[y:y+h, x:x+w])
+            logging.info(f"=== FINAL SCREEN {i+1} (from Cand. #{screen['id']}) ===")
+            logging.info(f"  Position: ({x}, {y}), Size: {w}x{h}")
+        cv2.imwrite(self.foldername+f'{self.basename}_08_final.png', final_img)
+
+# smallest blur sigma on the downscaled image, see _coarse_boxes
+COARSE_MIN_SIGMA = 0.8
+
+def _params(params):
+    if not params:
+        return DEFAULT_PARAMS
+    merged = dict(DEFAULT_PARAMS)
+    merged.update(params)
+    downscale = merged["downscale"]
+    if not isinstance(downscale, (int, np.integer)) or downscale < 1 or downscale & (downscale - 1):
+        raise ValueError(f"downscale must be a power of 2 (1, 2, 4, ...), not {downscale!r}")
+    return merged
+
+def categorize(candidate, img_width, img_height, params):
+    """'EX' if the candidate has the size, shape and blackness of a screen, else 'PO'"""
+    w, h = candidate['w'], candidate['h']
+    width_check = (params["width_range"][0] * img_width) < w < (params["width_range"][1] * img_width)
+    height_check = (params["height_range"][0] * img_height) < h < (params["height_range"][1] * img_height)
+    aspect_check = params["aspect_range"][0] < candidate['aspect_ratio'] < params["aspect_range"][1]
+    blackness_check = candidate['blackness_percentage'] > params["min_blackness"]
+    return 'EX' if width_check and height_check and aspect_check and blackness_check else 'PO'
+
+def _contour_boxes(gray, params, ksize, debug=None, sigma=0):
+    # (contour, bounding rect) for every external contour of the Canny edges
+    with l_met.timer("screen_detect.canny"):
+        blurred = cv2.GaussianBlur(gray, (ksize, ksize), sigma)
+        edges = cv2.Canny(blurred, params["canny_low"], params["canny_high"])
+    if debug is not None:
+        debug.edges(edges)
+
+    with l_met.timer("screen_detect.contours"):
+        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    logging.debug("Found %d initial contours.", len(contours))
+    return [(contour, cv2.boundingRect(contour)) for contour in contours]
+
+def _edge_line(gray, rect, side, band, params):
+    # full resolution position of one side of rect: the outermost line within +-band
+    # of the coarse border that has at least half as many Canny edge pixels as the best line
+    img_height, img_width = gray.shape[:2]
+    x, y, w, h = rect
+    pad = band + params["blur_ksize"]
+    if side in ('top', 'bottom'):
+        line = y if side == 'top' else y + h - 1
+        start = max(0, line - pad)
+        strip = gray[start:min(img_height, line + pad + 1), x + band:x + w - band]
+    else:
+        line = x if side == 'left' else x + w - 1
+        start = max(0, line - pad)
+        strip = gray[y + band:y + h - band, start:min(img_width, line + pad + 1)].T
+    if strip.size == 0:
+        return line
+    ksize = params["blur_ksize"]
+    edges = cv2.Canny(cv2.GaussianBlur(strip, (ksize, ksize), 0), params["canny_low"], params["canny_high"])
+    lo = max(0, line - band - start)
+    counts = np.count_nonzero(edges[lo:line + band + 1 - start], axis=1)
+    if counts.max() == 0:
+        return line
+    strong = np.flatnonzero(counts >= counts.max() / 2)
+    return start + lo + int(strong[0] if side in ('top', 'left') else strong[-1])
+
+def refine_rect(gray, rect, band, params=None):
+    """(x, y, w, h) from a downscaled image, with each side moved to the edge found at full resolution"""
+    params = _params(params)
+    top = _edge_line(gray, rect, 'top', band, params)
+    bottom = _edge_line(gray, rect, 'bottom', band, params)
+    left = _edge_line(gray, rect, 'left', band, params)
+    right = _edge_line(gray, rect, 'right', band, params)
+    if bottom <= top or right <= left:
+        return rect
+    return (left, top, right - left + 1, bottom - top + 1)
+
+def _coarse_boxes(gray, params, debug=None):
+    # contours on a 1/downscale image, boxes scaled back and refined in narrow bands at full size
+    f = params["downscale"]
+    small = gray
+    # halving twice is cheaper than one INTER_AREA resize by 4
+    for _ in range(f.bit_length() - 1):
+        small = cv2.resize(small, (small.shape[1] // 2, small.shape[0] // 2), interpolation=cv2.INTER_AREA)
+    # the full size blur scaled to the small image: sigma / f, but not below the 0.8 of a 3x3
+    # kernel. Canny's thresholds are gradient steps per pixel, the INTER_AREA averaging lowers
+    # the noise but not the step of a text or texture edge, so the small image needs that much
+    # smoothing whatever f is (less, eg. what is left of sigma after the averaging, gave more
+    # differences from full size detection at both 1/2 and 1/4). Default 7x7: 0.8 at 1/2 and 1/4,
+    # a 15x15 blur_ksize: 1.3 at 1/2, 0.8 at 1/4
+    ksize = params["blur_ksize"]
+    sigma_full = 0.3 * ((ksize - 1) * 0.5 - 1) + 0.8 # what GaussianBlur uses for sigma 0
+    sigma = max(COARSE_MIN_SIGMA, sigma_full / f)
+    small_ksize = 2 * int(np.ceil(2 * sigma)) + 1
+    band = 2 * f + 2
+    boxes = []
+    with l_met.timer("screen_detect.refine"):
+        for contour, (x, y, w, h) in _contour_boxes(small, params, small_ksize, debug, sigma):
+            # size filter with some slack, the exact one runs on the refined box
+            if w * f < 0.9 * params["min_w"] or h * f < 0.9 * params["min_h"]:
+                continue
+            rect = refine_rect(gray, (x * f, y * f, w * f, h * f), band, params)
+            boxes.append((contour * f, rect))
+    return boxes
+
+def find_candidates(image, gray, params=None, debug=None, integral=None):
+    """
+    Canny + external contours, one candidate dict per contour that passes the size filter.
+    Blackness is scored from a lib_blackness.BlacknessIntegral of gray (pass one to reuse it).
+    With params downscale 2 or 4 the contours come from a smaller image, see refine_rect.
+
+    Returns:
+        list: dicts with id, x, y, w, h, aspect_ratio, contour, blackness_percentage, avg_y, category
+    """
+    params = _params(params)
+    if params["downscale"] > 1:
+        boxes = _coarse_boxes(gray, params, debug)
+    else:
+        boxes = _contour_boxes(gray, params, params["blur_ksize"], debug)
+    boxes = [(contour, rect) for contour, rect in boxes if rect[2] >= params["min_w"] and rect[3] >= params["min_h"]]
+    l_met.observe("screen_detect.candidates_per_frame", len(boxes))
+    if not boxes:
+        return []
+    img_height, img_width = image.shape[:2]
+
+    if integral is None and params["downscale"] > 1:
+        # the few refined boxes are cheaper to average than a full size summed-area table
+        blackness = np.array([(255 - cv2.mean(gray[y:y+h, x:x+w])[0]) / 255 * 100 for _, (x, y, w, h) in boxes])
+    else:
+        # one summed-area table per frame scores all candidates, whatever their size
+        if integral is None:
+            integral = l_bl.BlacknessIntegral(gray)
+        blackness = integral.blackness_percentage([rect for _, rect in boxes])
+
+    all_candidates = []
+    for (contour, (x, y, w, h)), blackness_percentage in zip(boxes, blackness.tolist()):
+        candidate = {
+            'id': len(all_candidates),
+            'x': x, 'y': y, 'w': w, 'h': h,
+            'aspect_ratio': w / float(h) if h > 0 else 0,
+            'contour': contour,
+            'blackness_percentage': blackness_percentage,
+            'avg_y': (y+y+h)/2
+        }
+        candidate['category'] = categorize(candidate, img_width, img_height, params)
+        logging.debug("Candidate #%d: Pos(%d,%d) Size(%dx%d) Aspect(%.2f) Blackness(%.2f) y_avg(%.2f) -> Category: %s",
+                      candidate['id'], x, y, w, h, candidate['aspect_ratio'], candidate['blackness_percentage'],
+                      candidate['avg_y'], candidate['category'])
+        all_candidates.append(candidate)
+    return all_candidates
+
+def select_screens(all_candidates, params=None):
+    """
+    Pick up to max_screens EX candidates, lowest avg_y first, dropping overlaps.
+
+    Returns:
+        list: the selected candidate dicts sorted left to right
+    """
+    params = _params(params)
+    final_screens = []
+    # Prioritize closer to y avg
+    sorted_candidates = sorted([c for c in all_candidates if c['category'] == 'EX'], key=lambda c: c['avg_y'])
+
+    for candidate in sorted_candidates:
+        if len(final_screens) >= params["max_screens"]:
+            break # Stop once we have 3 screens
+
+        # Check for significant overlap with already selected screens
+        is_overlapping = False
+        for screen in final_screens:
+            x1 = max(candidate['x'], screen['x'])
+            y1 = max(candidate['y'], screen['y'])
+            x2 = min(candidate['x'] + candidate['w'], screen['x'] + screen['w'])
+            y2 = min(candidate['y'] + candidate['h'], screen['y'] + screen['h'])
+
+            intersection = max(0, x2 - x1) * max(0, y2 - y1)
+            candidate_area = candidate['w'] * candidate['h']
+            if intersection / candidate_area > params["max_overlap"]:
+                is_overlapping = True
+                logging.debug("Candidate #%d overlaps with a selected screen. Discarding.", candidate['id'])
+                break
+
+        if not is_overlapping:
+            final_screens.append(candidate)
+
+    return sorted(final_screens, key=lambda s: s['x'])
+
+def _detect_screens_gray(image, gray, params, debug=None):
+    l_met.count("screen_detect.full_detections")
+    all_candidates = find_candidates(image, gray, params, debug)
+    final_screens = select_screens(all_candidates, params)
+
+    if debug is not None:
+        debug.candidates(image, all_candidates)
+        debug.final(image, final_screens)
+    if not final_screens:
+        logging.debug("No final screens selected after filtering.")
+    return [(s['x'], s['y'], s['w'], s['h']) for s in final_screens]
+
+def detect_screens(image, params=None, debug=None):
+    """
+    Finds the main screens in a BGR image. Pure function: no copies, drawing
+    or file writes unless a DebugSink is passed as debug.
+
+    Args:
+        image: BGR np.ndarray
+        params: overrides for DEFAULT_PARAMS
+        debug: DebugSink or None
+
+    Returns:
+        list: (x, y, w, h) per screen, left to right
+    """
+    params = _params(params)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return _detect_screens_gray(image, gray, params, debug)
+
+def _side_edge_fraction(gray, rect, side, band, params):
+    # Canny on a thin strip around one side of rect, fraction of the side that has an edge
+    img_height, img_width = gray.shape[:2]
+    x, y, w, h = rect
+    pad = band + params["blur_ksize"]
+    if side in ('top', 'bottom'):
+        line = y if side == 'top' else y + h - 1
+        y0, y1 = max(0, line - pad), min(img_height, line + pad + 1)
+        strip = gray[y0:y1, x:x+w]
+    else:
+        line = x if side == 'left' else x + w - 1
+        x0, x1 = max(0, line - pad), min(img_width, line + pad + 1)
+        strip = gray[y:y+h, x0:x1].T
+    if strip.size == 0:
+        return 0.0
+    ksize = params["blur_ksize"]
+    edges = cv2.Canny(cv2.GaussianBlur(strip, (ksize, ksize), 0), params["canny_low"], params["canny_high"])
+    offset = line - (y0 if side in ('top', 'bottom') else x0)
+    edges = edges[max(0, offset - band):offset + band + 1]
+    return float(np.count_nonzero(edges.any(axis=0))) / edges.shape[1]
+
+def verify_screen(gray, rect, params=None, band=4, min_edge_fraction=0.6):
+    """
+    Cheap check that a screen found in an earlier frame is still there: the inside
+    is still dark enough and all four sides still have an edge near the old border.
+    """
+    params = _params(params)
+    x, y, w, h = rect
+    blackness_percentage = (255 - np.mean(gray[y:y+h, x:x+w])) / 255 * 100
+    if blackness_percentage <= params["min_blackness"]:
+        return False
+    for side in ('top', 'bottom', 'left', 'right'):
+        if _side_edge_fraction(gray, rect, side, band, params) < min_edge_fraction:
+            return False
+    return True
+
+class ScreenTracker:
+    """
+    detect_screens for consecutive frames of one video. The screens of the last full
+    detection are reused as long as verify_screen passes for all of them, full
+    detection runs again on a miss or after redetect_every tracked frames.
+
+    Args:
+        params: overrides for DEFAULT_PARAMS
+        redetect_every: max frames in a row without a full detection
+        band: pixels around each old border that are searched for an edge
+        min_edge_fraction: part of each side that must still have an edge
+    """
+    def __init__(self, params=None, redetect_every=30, band=4, min_edge_fraction=0.6):
+        self.params = _params(params)
+        self.redetect_every = redetect_every
+        self.band = band
+        self.min_edge_fraction = min_edge_fraction
+        self.screens = []
+        self.frames_since_detect = 0
+        self.full_detections = 0
+        self.tracked_frames = 0
+
+    def reset(self):
+        self.screens = []
+        self.frames_since_detect = 0
+
+    def update(self, image):
+        """screens for the next frame, same output as detect_screens"""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if self.screens and self.frames_since_detect < self.redetect_every:
+            if all(verify_screen(gray, rect, self.params, self.band, self.min_edge_fraction) for rect in self.screens):
+                self.frames_since_detect += 1
+                self.tracked_frames += 1
+                l_met.count("screen_detect.tracked_frames")
+                return list(self.screens)
+            logging.debug("tracked screens lost after %d frames, full detection", self.frames_since_detect)
+
+        self.screens = _detect_screens_gray(image, gray, self.params)
+        self.frames_since_detect = 0
+        self.full_detections += 1
+        return list(self.screens)
+
+
+if __name__ == "__main__":
+    pass
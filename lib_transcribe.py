@@ -0,0 +1,240 @@
+import os
+import json
+import wave
+import logging
+import logging as std_logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+import lib_ffprobe_json as l_ffj
+
+logging=logging.getLogger(__name__)
+
+WHISPER_SAMPLE_RATE = 16000
+
+def load_whisper_model(model_name="KBLab/kb-whisper-large", device="cpu", compute_type="int8", cpu_threads=0):
+    """the model wip_wav_to_txt.py used, the default model_factory of transcribe_wav"""
+    from faster_whisper import WhisperModel
+    return WhisperModel(model_name, device=device, compute_type=compute_type, cpu_threads=cpu_threads)
+
+def iter_wav_blocks(wav_path, block_seconds=0.03):
+    """
+    Read a wav file block by block with the wave module, never the whole file.
+
+    Yields:
+        tuple: (start time in seconds, float32 mono samples in -1..1, sample rate)
+    """
+    with wave.open(wav_path, 'rb') as wav:
+        rate = wav.getframerate()
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        if width not in (1, 2, 4):
+            raise ValueError(f"{wav_path}: {8 * width} bit samples are not supported")
+        block_frames = max(1, int(rate * block_seconds))
+        position = 0
+        while True:
+            raw = wav.readframes(block_frames)
+            if not raw:
+                return
+            if width == 1:
+                samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+            else:
+                dtype = np.int16 if width == 2 else np.int32
+                samples = np.frombuffer(raw, dtype=dtype).astype(np.float32) / np.iinfo(dtype).max
+            if channels > 1:
+                samples = samples.reshape(-1, channels).mean(axis=1)
+            yield position / rate, samples, rate
+            position += len(samples)
+
+def iter_vad_chunks(wav_path, max_chunk=30.0, min_chunk=5.0, min_silence=0.3, threshold_db=-40.0, block_seconds=0.03):
+    """
+    Energy based voice activity chunking. Blocks with RMS above threshold_db (dBFS) are speech.
+    A chunk ends at the first silence of min_silence seconds once it is min_chunk long, or at
+    the last silent block when it reaches max_chunk (30 s is whisper's window). Chunks without
+    speech are dropped. Only the current chunk is held in memory.
+
+    Yields:
+        tuple: (start time in seconds, float32 mono samples, sample rate)
+    """
+    blocks = []
+    start = None
+    speech = False
+    silent_run = 0.0
+    last_silent = None # index in blocks of the end of the last silent block
+
+    def chunk(n):
+        return start, np.concatenate([samples for _, samples in blocks[:n]]), rate
+
+    for t, samples, rate in iter_wav_blocks(wav_path, block_seconds):
+        if start is None:
+            start = t
+        blocks.append((t, samples))
+        rms = np.sqrt(np.mean(samples ** 2)) if len(samples) else 0.0
+        is_speech = 20 * np.log10(max(rms, 1e-10)) > threshold_db
+        speech = speech or is_speech
+        silent_run = 0.0 if is_speech else silent_run + len(samples) / rate
+        if not is_speech:
+            last_silent = len(blocks)
+        duration = t + len(samples) / rate - start
+
+        if duration >= min_chunk and silent_run >= min_silence:
+            cut = len(blocks)
+        elif duration >= max_chunk:
+            # cut in the last pause, unless that leaves a short chunk
+            cut = last_silent if last_silent and blocks[last_silent - 1][0] - start >= min_chunk else len(blocks)
+        else:
+            continue
+        if speech:
+            yield chunk(cut)
+        rest = blocks[cut:]
+        blocks = []
+        start = None
+        speech = False
+        silent_run = 0.0
+        last_silent = None
+        for t_rest, samples_rest in rest:
+            if start is None:
+                start = t_rest
+            blocks.append((t_rest, samples_rest))
+            # the carried over blocks are after the last silent block, so speech
+            speech = True
+    if blocks and speech:
+        yield chunk(len(blocks))
+
+def resample(samples, rate, target_rate=WHISPER_SAMPLE_RATE):
+    """linear resampling, enough for speech; extract the wav with -ar 16000 -ac 1 to skip it"""
+    if rate == target_rate or not len(samples):
+        return samples
+    n = int(round(len(samples) * target_rate / rate))
+    return np.interp(np.arange(n) * rate / target_rate, np.arange(len(samples)), samples).astype(np.float32)
+
+_worker_model = None
+
+def _init_worker(model_factory, model_kwargs):
+    # once per worker process, the model stays loaded for all its chunks
+    global _worker_model
+    _worker_model = model_factory(**model_kwargs)
+
+def _transcribe_chunk(chunk_start, samples, rate, transcribe_kwargs):
+    segments, info = _worker_model.transcribe(resample(samples, rate), **transcribe_kwargs)
+    return [{"start": chunk_start + segment.start,
+             "end": chunk_start + segment.end,
+             "text": segment.text.strip(),
+             "language": info.language} for segment in segments]
+
+def audio_start_time(in_ffprobe_json_filepath):
+    """pts_time of the first audio frame, where the extracted wav starts on the video timeline"""
+    for frame in l_ffj.iter_ffprobe_frames(in_ffprobe_json_filepath):
+        if frame.get('media_type') == 'audio' and 'pts_time' in frame:
+            return float(frame['pts_time'])
+    return 0.0
+
+def map_segments_to_timeline(segments, vid_ts_list=None, audio_offset=0.0):
+    """
+    pts_start / pts_end on the video pts_time timeline, plus the vbr_frameno
+    (position in vid_ts_list, like lib_ffprobe_json) shown at start and end
+    """
+    for segment in segments:
+        segment["pts_start"] = segment["start"] + audio_offset
+        segment["pts_end"] = segment["end"] + audio_offset
+    if vid_ts_list is not None and segments:
+        framenos = l_ffj.closest_frames_to_times([t for s in segments for t in (s["pts_start"], s["pts_end"])], vid_ts_list)
+        for i, segment in enumerate(segments):
+            segment["vbr_frameno_start"] = int(framenos[2 * i])
+            segment["vbr_frameno_end"] = int(framenos[2 * i + 1])
+    return segments
+
+def transcribe_wav(wav_path, out_jsonl, workers=2, model_factory=load_whisper_model, model_kwargs=None,
+                   transcribe_kwargs=None, vid_ts_list=None, audio_offset=0.0, max_pending=None, vad_kwargs=None):
+    """
+    Transcribe a wav in VAD chunks on a process pool, each worker loads the model once.
+    Segments are appended to out_jsonl (one json object per line) in time order as soon as
+    all earlier chunks are done. At most max_pending chunks (default 2 per worker) are
+    read ahead, so memory does not grow with the recording.
+
+    Args:
+        model_factory: picklable callable returning an object with faster_whisper's
+            transcribe(audio, **kwargs) -> (segments, info), eg. a stub for tests
+        model_kwargs: for model_factory, default int8 on cpu with the cores split between workers
+        transcribe_kwargs: for model.transcribe, default language sv like wip_wav_to_txt.py
+        vid_ts_list, audio_offset: see map_segments_to_timeline
+
+    Returns:
+        int: number of segments written
+    """
+    if model_kwargs is None:
+        model_kwargs = {"cpu_threads": max(1, (os.cpu_count() or 1) // workers)} if model_factory is load_whisper_model else {}
+    if transcribe_kwargs is None:
+        transcribe_kwargs = {"language": "sv", "condition_on_previous_text": False}
+    max_pending = max_pending or 2 * workers
+
+    written = 0
+    done = {}
+    next_to_write = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_factory, model_kwargs)) as executor, \
+            open(out_jsonl, 'w', encoding='utf-8') as out:
+        pending = {}
+
+        def collect(return_when):
+            nonlocal next_to_write, written
+            finished, _ = wait(pending, return_when=return_when)
+            for future in finished:
+                done[pending.pop(future)] = future.result()
+            while next_to_write in done:
+                segments = map_segments_to_timeline(done.pop(next_to_write), vid_ts_list, audio_offset)
+                for segment in segments:
+                    out.write(json.dumps(segment, ensure_ascii=False) + "\n")
+                out.flush()
+                written += len(segments)
+                next_to_write += 1
+
+        for i, (chunk_start, samples, rate) in enumerate(iter_vad_chunks(wav_path, **(vad_kwargs or {}))):
+            while len(pending) + len(done) >= max_pending:
+                collect(FIRST_COMPLETED)
+            pending[executor.submit(_transcribe_chunk, chunk_start, samples, rate, transcribe_kwargs)] = i
+            logging.debug(f"chunk {i} at {chunk_start:.2f}s, {len(samples) / rate:.1f}s submitted")
+        while pending:
+            collect(FIRST_COMPLETED)
+    logging.info(f"{written} segments written to {out_jsonl}")
+    return written
+
+def load_segments(jsonl_path):
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def attach_speech(ocr_json, segments):
+    """
+    Add "speech" (text of the segments spoken at the frame's pts_time) to every entry
+    of a _new_ocr.json style dict, for joining speech and ocr per frame.
+    """
+    segments = sorted(segments, key=lambda s: s["pts_start"])
+    starts = np.array([s["pts_start"] for s in segments])
+    for entry in ocr_json.values():
+        t = entry["pts_time"]
+        i = np.searchsorted(starts, t, side='right')
+        # segments can overlap a little at chunk borders, look back a few
+        entry["speech"] = [s["text"] for s in segments[max(0, i - 3):i] if s["pts_end"] >= t]
+    return ocr_json
+
+
+if __name__ == "__main__":
+    # python lib_transcribe.py audio.wav transcription.jsonl --vfr-json ../145147/145147_vfr.json
+    parser = argparse.ArgumentParser(description="transcribe a wav in parallel vad chunks to json lines")
+    parser.add_argument("wav")
+    parser.add_argument("out_jsonl")
+    parser.add_argument("--vfr-json", help="map the segments onto this video's pts_time / vbr_frameno")
+    parser.add_argument("--workers", type=int, default=2, help="processes, each holds its own copy of the model")
+    parser.add_argument("--model", default="KBLab/kb-whisper-large")
+    parser.add_argument("--language", default="sv")
+    args = parser.parse_args()
+    std_logging.basicConfig(level=std_logging.INFO, format='%(asctime)s-%(levelname)s-%(module)s-%(funcName)s- %(lineno)s- %(message)s')
+    vid_ts_list = audio_offset = None
+    if args.vfr_json:
+        import lib_ts_index as l_tsi
+        vid_ts_list = l_tsi.get_timestamps(args.vfr_json)
+        audio_offset = audio_start_time(args.vfr_json)
+    n = transcribe_wav(args.wav, args.out_jsonl, args.workers,
+                       model_kwargs={"model_name": args.model, "cpu_threads": max(1, (os.cpu_count() or 1) // args.workers)},
+                       transcribe_kwargs={"language": args.language, "condition_on_previous_text": False},
+                       vid_ts_list=vid_ts_list, audio_offset=audio_offset or 0.0)
+    print(f"{n} segments saved to {args.out_jsonl}")
@@ -0,0 +1,113 @@
+import os
+import sys
+import json
+import logging
+import numpy as np
+import lib_ffprobe_json as l_ffj
+
+logging=logging.getLogger(__name__)
+
+# bump when the content of the index files changes, old indexes are then rebuilt
+INDEX_VERSION = 3
+
+# per timestamp arrays besides pts_time, all in the index since version 3
+INDEX_FIELDS = ("video_frame", "key_frame", "pkt_size", "pict_type")
+
+def index_paths(in_ffprobe_json_filepath):
+    """
+    Sidecar files for <basename>_vfr.json, stored next to it.
+
+    Returns:
+        dict: paths for 'meta' (json), 'pts_time', 'video_frame', 'key_frame', 'pkt_size' and 'pict_type' (.npy)
+    """
+    base = os.path.splitext(in_ffprobe_json_filepath)[0]
+    return {
+        "meta": base + ".tsidx.json",
+        "pts_time": base + ".tsidx_pts.npy",
+        "video_frame": base + ".tsidx_frames.npy",
+        "key_frame": base + ".tsidx_keyframes.npy",
+        "pkt_size": base + ".tsidx_pktsize.npy",
+        "pict_type": base + ".tsidx_picttype.npy",
+    }
+
+def _source_key(in_ffprobe_json_filepath):
+    st = os.stat(in_ffprobe_json_filepath)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "version": INDEX_VERSION}
+
+def is_index_fresh(in_ffprobe_json_filepath):
+    """True if the sidecar index exists and was built from the current json (same size and mtime)"""
+    paths = index_paths(in_ffprobe_json_filepath)
+    try:
+        with open(paths["meta"], 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if meta.get("source") != _source_key(in_ffprobe_json_filepath):
+        return False
+    return all(os.path.exists(paths[key]) for key in ("pts_time",) + INDEX_FIELDS)
+
+def _save_npy(path, arr):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, arr)
+    os.replace(tmp_path, path)
+
+def build_timestamp_index(in_ffprobe_json_filepath):
+    """
+    Parse the ffprobe json once (streaming) and write the sidecar index.
+    The meta file is written last, so an interrupted build is seen as stale.
+    """
+    source = _source_key(in_ffprobe_json_filepath)
+    arrays = l_ffj.get_vid_frame_arrays(in_ffprobe_json_filepath, extra_fields=('key_frame', 'pkt_size', 'pict_type'))
+    paths = index_paths(in_ffprobe_json_filepath)
+
+    for key in ("pts_time",) + INDEX_FIELDS:
+        _save_npy(paths[key], arrays[key])
+    tmp_meta = paths["meta"] + ".tmp"
+    with open(tmp_meta, 'w') as f:
+        json.dump({"source": source, "frames": int(len(arrays["pts_time"]))}, f)
+    os.replace(tmp_meta, paths["meta"])
+    logging.info(f"built timestamp index for {in_ffprobe_json_filepath}, {len(arrays['pts_time'])} unique timestamps")
+
+def load_timestamp_index(in_ffprobe_json_filepath, rebuild=True):
+    """
+    Memory mapped timestamp index for an ffprobe json, rebuilt when the json has changed.
+
+    Args:
+        in_ffprobe_json_filepath: <basename>_vfr.json
+        rebuild: if False a stale or missing index raises FileNotFoundError
+
+    Returns:
+        dict: 'pts_time' (float64, unique, vbr_frameno is the position in it)
+        'video_frame' (int64, first video frame in the json with that pts_time),
+        'key_frame' (int8, 1 for keyframes), 'pkt_size' (int64, -1 unknown) and 'pict_type' (U1, '?' unknown)
+    """
+    if not is_index_fresh(in_ffprobe_json_filepath):
+        if not rebuild:
+            raise FileNotFoundError(f"no up to date timestamp index for {in_ffprobe_json_filepath}")
+        build_timestamp_index(in_ffprobe_json_filepath)
+    paths = index_paths(in_ffprobe_json_filepath)
+    return {key: np.load(paths[key], mmap_mode='r') for key in ("pts_time",) + INDEX_FIELDS}
+
+def get_keyframe_times(in_ffprobe_json_filepath):
+    """pts_time of the keyframes, for lib_frame_source.iter_selected_frames"""
+    index = load_timestamp_index(in_ffprobe_json_filepath)
+    return np.sort(index["pts_time"][index["key_frame"] == 1])
+
+def get_adaptive_framearrays(in_ffprobe_json_filepath, start_time=-1, end_time=-1, **kwargs):
+    """lib_ffprobe_json.framearrays_adaptive from the index, kwargs are its min_interval, max_interval, ..."""
+    index = load_timestamp_index(in_ffprobe_json_filepath)
+    pict_type = index["pict_type"] if np.any(index["pict_type"] != '?') else None
+    return l_ffj.framearrays_adaptive(start_time, end_time, index["pts_time"], index["pkt_size"], pict_type,
+                                      index["key_frame"], **kwargs)
+
+def get_timestamps(in_ffprobe_json_filepath):
+    """Drop-in for lib_ffprobe_json.get_timestamps_from_frames backed by the index"""
+    return load_timestamp_index(in_ffprobe_json_filepath)["pts_time"]
+
+
+if __name__ == "__main__":
+    # python lib_ts_index.py ../145147/145147_vfr.json  -> (re)build the index
+    for json_path in sys.argv[1:]:
+        build_timestamp_index(json_path)
+        print(f"{json_path}: {len(get_timestamps(json_path))} timestamps")
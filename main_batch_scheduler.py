@@ -0,0 +1,307 @@
+import os
+import sys
+import glob
+import logging
+import logging as std_logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import numpy as np
+import lib_ffprobe_json as l_ffj
+import lib_ts_index as l_tsi
+import lib_ocr_cache as l_ocrc
+import lib_ocr_backend as l_ocrb
+import lib_ocr_columnar as l_ocol
+import lib_metrics as l_met
+import main_pipeline as m_pl
+
+logging=logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".mov", ".avi")
+
+def discover_videos(root):
+    """
+    Every <basename>_vfr.json under root (root/<basename>/ like the iter_* scripts, or root itself)
+    with a video next to it whose name is <basename> or ends with _<basename>, eg. 20250924_145147.mp4.
+
+    Returns:
+        list: main_pipeline.video_layout dicts plus 'video', sorted on basename
+    """
+    videos = []
+    for vfr_json in sorted(glob.glob(os.path.join(root, "*_vfr.json")) + glob.glob(os.path.join(root, "*", "*_vfr.json"))):
+        basename = os.path.basename(vfr_json)[:-len("_vfr.json")]
+        folder = os.path.dirname(vfr_json)
+        candidates = [f for f in sorted(os.listdir(folder)) if f.lower().endswith(VIDEO_EXTENSIONS)
+                      and (os.path.splitext(f)[0] == basename or os.path.splitext(f)[0].endswith("_" + basename))]
+        if not candidates:
+            logging.warning(f"{vfr_json}: no video for {basename} in {folder}, skipped")
+            continue
+        if len(candidates) > 1:
+            logging.warning(f"{basename}: more than one video, using {candidates[0]}")
+        video_path = os.path.join(folder, candidates[0])
+        layout = m_pl.video_layout(video_path, basename, vfr_json)
+        layout["video"] = video_path
+        videos.append(layout)
+    return sorted(videos, key=lambda layout: layout["basename"])
+
+def _mtime(path):
+    # a .cols folder is only complete once its meta.json is written
+    if os.path.isdir(path):
+        path = os.path.join(path, "meta.json")
+    return os.stat(path).st_mtime_ns if os.path.exists(path) else None
+
+def outputs_fresh(outputs, inputs):
+    """make style: every output exists and none is older than the newest input"""
+    out_times = [_mtime(path) for path in outputs]
+    if any(t is None for t in out_times):
+        return False
+    return min(out_times) >= max(_mtime(path) or 0 for path in inputs)
+
+class CpuBudget:
+    """counting semaphore where a job takes as many cpus as it uses"""
+    def __init__(self, cpus):
+        self.cpus = cpus
+        self.free = cpus
+        self._cond = threading.Condition()
+
+    def acquire(self, n):
+        n = min(n, self.cpus)
+        with self._cond:
+            self._cond.wait_for(lambda: self.free >= n)
+            self.free -= n
+        return n
+
+    def release(self, n):
+        with self._cond:
+            self.free += n
+            self._cond.notify_all()
+
+class Stage:
+    """
+    One job of a video's graph: run() is skipped when fresh() says the outputs are up to date.
+    cpus is what the stage takes from the CpuBudget while it runs.
+    """
+    def __init__(self, name, run, fresh, cpus=1):
+        self.name = name
+        self.run = run
+        self.fresh = fresh
+        self.cpus = cpus
+
+def _save_framearrays(path, framearrays, settings):
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, **framearrays, **{f"setting_{key}": value for key, value in settings.items()})
+    os.replace(tmp_path, path)
+
+def load_framearrays(path, settings=None):
+    """the selection saved by the select stage, None if missing or made with other settings"""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        if settings is not None and any(f"setting_{key}" not in data or float(data[f"setting_{key}"]) != float(value)
+                                        for key, value in settings.items()):
+            return None
+        return {key: data[key] for key in data.files if not key.startswith("setting_")}
+
+def video_stages(layout, ocr_fn, fps=2, start_time=-1, end_time=-1, pipeline_cpus=2, pipeline_kwargs=None, ocr_many_fn=None):
+    """
+    index -> select -> detect + ocr -> merge for one video.
+    detect and ocr are one stage: main_pipeline.run_pipeline streams the decoded frames
+    through both, splitting them would mean decoding every frame twice. That stage takes
+    pipeline_cpus (decode and detect threads) plus one cpu per ocr dispatcher thread
+    (ocr_concurrency in pipeline_kwargs), which encode the screen rois.
+
+        index   <basename>_vfr.tsidx* from the ffprobe json (lib_ts_index)
+        select  <basename>_framearrays.npz, the frames for fps / start / end
+        ocr     <basename>_new_ocr.json through run_pipeline, resumed from the checkpoint log
+        merge   <basename>_new_ocr.cols, the columnar copy (lib_ocr_columnar)
+    """
+    settings = {"fps": fps, "start_time": start_time, "end_time": end_time}
+    ocr_threads = (pipeline_kwargs or {}).get("ocr_concurrency", 8)
+    cols_dir = l_ocol.columns_path(layout["new_ocr_json"])
+
+    def select():
+        # a changed selection also invalidates the checkpoint log: it carries the
+        # l_ockp.selection_hash of the frames its keys refer to, run_pipeline starts it over
+        vid_timestamplist = l_tsi.get_timestamps(layout["vfr_json"])
+        framearrays = l_ffj.framearrays_from_timespan(start_time, end_time, fps, vid_timestamplist)
+        os.makedirs(layout["out_dir"], exist_ok=True)
+        _save_framearrays(layout["framearrays"], framearrays, settings)
+
+    def ocr():
+        framearrays = load_framearrays(layout["framearrays"], settings)
+        m_pl.run_pipeline(layout["video"], fps, ocr_fn, layout["basename"], layout["vfr_json"], layout["out_dir"],
+                          resume=True, framearrays=framearrays, ocr_many_fn=ocr_many_fn, **(pipeline_kwargs or {}))
+
+    return [
+        Stage("index", lambda: l_tsi.build_timestamp_index(layout["vfr_json"]),
+              lambda: l_tsi.is_index_fresh(layout["vfr_json"])),
+        Stage("select", select,
+              lambda: outputs_fresh([layout["framearrays"]], [layout["vfr_json"]])
+              and load_framearrays(layout["framearrays"], settings) is not None),
+        Stage("ocr", ocr,
+              lambda: outputs_fresh([layout["new_ocr_json"]], [layout["framearrays"], layout["video"]]),
+              cpus=pipeline_cpus + ocr_threads),
+        Stage("merge", lambda: l_ocol.convert_json(layout["new_ocr_json"], cols_dir),
+              lambda: outputs_fresh([cols_dir], [layout["new_ocr_json"]])),
+    ]
+
+def run_video(layout, stages, budget, force=False, dry_run=False):
+    """
+    Run the stages of one video in order, each under the cpu budget.
+    Once a stage runs, the later ones run too (their inputs just changed).
+
+    Returns:
+        dict: {stage name: "fresh" | "done" | "stale" (dry run)}
+    """
+    status = {}
+    rerun = force
+    for stage in stages:
+        if not rerun and stage.fresh():
+            status[stage.name] = "fresh"
+            continue
+        rerun = True
+        if dry_run:
+            status[stage.name] = "stale"
+            continue
+        cpus = budget.acquire(stage.cpus)
+        try:
+            logging.info(f"{layout['basename']}: {stage.name} started")
+            with l_met.timer(f"scheduler.{stage.name}"):
+                stage.run()
+        finally:
+            budget.release(cpus)
+        status[stage.name] = "done"
+        logging.info(f"{layout['basename']}: {stage.name} done")
+    return status
+
+def limit_ocr(ocr_fn, max_concurrent, semaphore=None):
+    """ocr_fn with at most max_concurrent calls at a time over all videos (or the calls holding semaphore)"""
+    semaphore = semaphore or threading.BoundedSemaphore(max_concurrent)
+
+    def limited(content):
+        with semaphore:
+            return ocr_fn(content)
+    return limited
+
+def run_batch(root, ocr_fn, cpus=None, ocr_concurrency=16, max_videos=None, fps=2, start_time=-1, end_time=-1,
+              pipeline_cpus=2, force=False, dry_run=False, pipeline_kwargs=None, ocr_cpus=0, ocr_many_fn=None):
+    """
+    Discover the videos under root and run their stages concurrently.
+    cpus bounds the cpu work of all stages together, ocr_concurrency the ocr calls in flight over
+    all videos; each video's own dispatcher still has its ocr_concurrency from pipeline_kwargs.
+    ocr_cpus are the cpus the ocr backend itself keeps busy for the whole batch (the tesseract
+    worker processes, 0 for google), they are taken off the budget up front.
+    ocr_many_fn: the batch call of the backend (OcrBackend.ocr_many_fn), see run_pipeline, one
+    batch request counts as one call in flight.
+
+    Returns:
+        dict: {basename: stage status dict, or the exception if the video failed}
+    """
+    videos = discover_videos(root)
+    cpus = cpus or os.cpu_count() or 1
+    if ocr_cpus >= cpus:
+        logging.warning(f"the ocr backend takes {ocr_cpus} of {cpus} cpus, one left for the stages")
+    budget = CpuBudget(max(1, cpus - ocr_cpus))
+    semaphore = threading.BoundedSemaphore(ocr_concurrency)
+    limited_ocr_fn = limit_ocr(ocr_fn, ocr_concurrency, semaphore) if ocr_fn is not None else None
+    limited_ocr_many_fn = limit_ocr(ocr_many_fn, ocr_concurrency, semaphore) if ocr_many_fn is not None else None
+    logging.info(f"{len(videos)} videos under {root}, cpu budget {budget.cpus} (+{ocr_cpus} ocr backend), "
+                 f"ocr concurrency {ocr_concurrency}")
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_videos or max(1, len(videos))) as executor:
+        futures = {executor.submit(run_video, layout,
+                                   video_stages(layout, limited_ocr_fn, fps, start_time, end_time, pipeline_cpus, pipeline_kwargs,
+                                                limited_ocr_many_fn),
+                                   budget, force, dry_run): layout["basename"]
+                   for layout in videos}
+        for future in as_completed(futures):
+            basename = futures[future]
+            try:
+                results[basename] = future.result()
+            except Exception as e:
+                logging.exception(f"{basename} failed")
+                results[basename] = e
+    return dict(sorted(results.items()))
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="run main_pipeline for every <basename>_vfr.json + video under a folder")
+    parser.add_argument("root", help="folder with the <basename>/ folders, eg. ..")
+    parser.add_argument("--fps", type=float, default=2)
+    parser.add_argument("--start", type=float, default=-1)
+    parser.add_argument("--end", type=float, default=-1)
+    parser.add_argument("--cpus", type=int, help="cpu budget for all stages together, default all cores")
+    parser.add_argument("--pipeline-cpus", type=int, default=2, help="cpus one detect + ocr stage takes (decode and detect threads)")
+    parser.add_argument("--videos", type=int, help="videos in progress at the same time, default all")
+    parser.add_argument("--ocr-concurrency", type=int, default=16, help="ocr calls in flight over all videos")
+    parser.add_argument("--video-ocr-concurrency", type=int, default=4,
+                        help="ocr dispatcher threads per video, each counts as a cpu in the budget")
+    parser.add_argument("--ocr-batch-frames", type=int, default=4, help="see main_pipeline.py run --ocr-batch-frames")
+    parser.add_argument("--ocr-backend", default="google", choices=list(l_ocrb.OCR_BACKENDS))
+    parser.add_argument("--api-key-env", default="gooog", help="environment variable with the google api key")
+    parser.add_argument("--tesseract-lang", default="eng")
+    parser.add_argument("--ocr-workers", type=int, help="tesseract processes, taken off the cpu budget, default half of it")
+    parser.add_argument("--cache", help="ocr cache sqlite file, eg. ../ocr_cache.sqlite")
+    parser.add_argument("--track-every", type=int, default=30)
+    parser.add_argument("--downscale", type=int, default=1, choices=[1, 2, 4], help="see main_pipeline.py run --downscale")
+    parser.add_argument("--no-dedup", action="store_true")
+    parser.add_argument("--full-frame", action="store_true")
+    parser.add_argument("--target-text-height", type=float, help="see main_pipeline.py run --target-text-height")
+    parser.add_argument("--force", action="store_true", help="run every stage, even if its output is up to date")
+    parser.add_argument("--dry-run", action="store_true", help="only show which stages would run")
+    parser.add_argument("--metrics", nargs="?", const="", help="timings json, default <root>/batch_metrics.json")
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    if args.metrics is not None:
+        l_met.enable()
+    backend = None
+    ocr_cpus = 0
+    if not args.dry_run:
+        # created before the video threads start, and the tesseract pool uses a forkserver:
+        # no worker process is forked from a process running decode / detect threads
+        if args.ocr_backend == "google":
+            api_key = os.environ.get(args.api_key_env)
+            if not api_key:
+                print(f"❌ Error: no api key in ${args.api_key_env}")
+                return 1
+            backend = l_ocrb.GoogleOcrBackend(api_key)
+        else:
+            ocr_cpus = args.ocr_workers or max(1, (args.cpus or os.cpu_count() or 1) // 2)
+            backend = l_ocrb.TesseractOcrBackend(args.tesseract_lang, workers=ocr_cpus)
+    cache = l_ocrc.OcrCache(args.cache) if args.cache and backend is not None else None
+    pipeline_kwargs = {"ocr_concurrency": args.video_ocr_concurrency, "track_every": args.track_every,
+                       "dedup": not args.no_dedup, "screen_rois": not args.full_frame,
+                       "detect_params": {"downscale": args.downscale},
+                       "target_text_height": args.target_text_height, "ocr_batch_frames": args.ocr_batch_frames}
+    batched = backend is not None and backend.batched and args.ocr_batch_frames
+    logging.info(f"=== Batch run - {datetime.now()} - {args.root} ===")
+    try:
+        results = run_batch(args.root, backend.ocr_fn(cache) if backend is not None else None, args.cpus,
+                            args.ocr_concurrency, args.videos, args.fps, args.start, args.end, args.pipeline_cpus,
+                            args.force, args.dry_run, pipeline_kwargs, ocr_cpus,
+                            backend.ocr_many_fn(cache) if batched else None)
+    finally:
+        if backend is not None:
+            backend.close()
+        if cache is not None:
+            cache.close()
+
+    failed = 0
+    for basename, status in results.items():
+        if isinstance(status, Exception):
+            failed += 1
+            print(f"❌ {basename}: {status}")
+        else:
+            print(f"{'✅' if not args.dry_run else '  '} {basename}: " + ", ".join(f"{name} {s}" for name, s in status.items()))
+    if args.metrics is not None:
+        l_met.report(args.metrics or os.path.join(args.root, "batch_metrics.json"))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    # python main_batch_scheduler.py .. --cpus 16 --ocr-concurrency 32 --cache ../ocr_cache.sqlite
+    std_logging.basicConfig(level=std_logging.INFO, format='%(asctime)s-%(levelname)s-%(module)s-%(funcName)s- %(lineno)s- %(message)s')
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,321 @@
+import os
+import sys
+import queue
+import logging
+import logging as std_logging
+import argparse
+import threading
+import numpy as np
+from datetime import datetime
+import lib_ffprobe_json as l_ffj
+import lib_ts_index as l_tsi
+import lib_frame_source as l_fsrc
+import lib_screen_detect as l_sd
+import lib_frame_dedup as l_fdd
+import lib_ocr_dispatch as l_ocrd
+import lib_ocr_roi as l_ocrr
+import lib_google_ocr as l_gocr
+import lib_ocr_cache as l_ocrc
+import lib_ocr_checkpoint as l_ockp
+import lib_metrics as l_met
+import lib_ocr_backend as l_ocrb
+
+logging=logging.getLogger(__name__)
+
+_STAGE_DONE = object()
+
+class _StageError:
+    def __init__(self, exc):
+        self.exc = exc
+
+def threaded_stage(items, maxsize=16, name="stage"):
+    """
+    Run a generator in its own thread and hand its items over through a bounded
+    queue, so the stages before and after it work at the same time.
+    An exception in the stage is raised again in the consumer. When the consumer
+    stops early (exception or close()) the thread is told to stop, closes its
+    generator (and with it eg. the VideoCapture) and is joined.
+    """
+    q = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def worker():
+        try:
+            for item in items:
+                if not put(item):
+                    break
+        except BaseException as e:
+            put(_StageError(e))
+        finally:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+            put(_STAGE_DONE)
+
+    thread = threading.Thread(target=worker, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _STAGE_DONE:
+                return
+            if isinstance(item, _StageError):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+        # drop the frames still queued
+        while not q.empty():
+            q.get_nowait()
+
+def video_layout(video_path, basename=None, vfr_json_path=None, out_dir=None):
+    """
+    The paths the iter_* scripts use for a video, eg. ../145147/20250924_145147.mp4 gives
+    basename 145147, ../145147/145147_vfr.json and ../145147_out/
+    """
+    video_dir = os.path.dirname(os.path.abspath(video_path))
+    if basename is None:
+        basename = os.path.splitext(os.path.basename(video_path))[0].split("_")[-1]
+    if vfr_json_path is None:
+        vfr_json_path = os.path.join(video_dir, f"{basename}_vfr.json")
+    if out_dir is None:
+        out_dir = os.path.join(os.path.dirname(video_dir), f"{basename}_out")
+    return {"basename": basename, "vfr_json": vfr_json_path, "out_dir": out_dir,
+            "new_ocr_json": os.path.join(out_dir, f"{basename}_new_ocr.json"),
+            "checkpoint": os.path.join(out_dir, f"{basename}_ocr_checkpoint.jsonl"),
+            "framearrays": os.path.join(out_dir, f"{basename}_framearrays.npz"),
+            "metrics": os.path.join(out_dir, f"{basename}_metrics.json")}
+
+def google_ocr_fn(api_key, cache=None):
+    """encoded image bytes -> word list through google vision"""
+    return lambda content: l_gocr.g_cv_doc_text_detect(content, api_key, cache=cache)
+
+def select_frames(vfr_json_path, fps, start_time=-1, end_time=-1, adaptive=None):
+    """
+    timestamps (from the index) and the frame selection, stages 1 and 2.
+    adaptive: None for every 1/fps, else kwargs for l_ffj.framearrays_adaptive (min_interval, max_interval, change_factor)
+    """
+    vid_timestamplist = l_tsi.get_timestamps(vfr_json_path)
+    if adaptive is not None:
+        framearrays = l_tsi.get_adaptive_framearrays(vfr_json_path, start_time, end_time, **adaptive)
+    else:
+        framearrays = l_ffj.framearrays_from_timespan(start_time, end_time, fps, vid_timestamplist)
+    return vid_timestamplist, framearrays
+
+def detect_stage(decoded, track_every=30, detect_params=None):
+    tracker = l_sd.ScreenTracker(detect_params, redetect_every=track_every) if track_every else None
+    for frame, image in decoded:
+        l_met.count("pipeline.frames")
+        screens = tracker.update(image) if tracker is not None else l_sd.detect_screens(image, detect_params)
+        yield frame, image, screens
+    if tracker is not None:
+        logging.info(f"detect: {tracker.full_detections} full detections, {tracker.tracked_frames} tracked frames")
+
+def run_pipeline(video_path, fps=2, ocr_fn=None, basename=None, vfr_json_path=None, out_dir=None,
+                 start_time=-1, end_time=-1, ocr_concurrency=8, queue_size=16, track_every=30,
+                 dedup=True, screen_rois=True, resume=False, framearrays=None, adaptive=None, detect_params=None,
+                 target_text_height=None, ocr_many_fn=None, ocr_batch_frames=4):
+    """
+    timestamps -> frame selection -> decode -> screen detect -> dedup -> OCR -> <basename>_new_ocr.json
+    in one pass. Decode and detection run in their own threads and OCR requests run
+    concurrently, connected by bounded queues. Every finished frame is appended to
+    <basename>_ocr_checkpoint.jsonl and the final json is compacted from that log.
+
+    Args:
+        video_path: the mp4
+        fps: frames per second to pick, like framerate in the iter_* scripts
+        ocr_fn: encoded image bytes -> google_ocr word list, see google_ocr_fn and lib_ocr_backend.OcrBackend.ocr_fn
+        ocr_many_fn: list of encoded images -> word lists (lib_ocr_backend.OcrBackend.ocr_many_fn), when given the
+            rois of ocr_batch_frames frames go to one call, for google one batch request instead of one per roi
+        screen_rois: OCR the detected screens only (lib_ocr_roi) instead of the whole frame
+        dedup: reuse the last OCR result for frames where the screens did not change
+        resume: skip (not even decode) the frames already in the checkpoint log, if it is for the same frame selection
+        framearrays: a frame selection made earlier (framearrays_from_timespan), fps/start/end are then not used
+        adaptive: pick frames where the picture changed instead of every 1/fps, see select_frames
+        detect_params: overrides for l_sd.DEFAULT_PARAMS, eg. {"downscale": 2}
+        target_text_height: resize the rois so the text is this many pixels high (lib_ocr_roi), small
+            text is upscaled. The text height is the median of the first frame with words, kept for
+            the rest of the run so the same picture always gives the same upload (and cache key)
+
+    Returns:
+        str: path of the written <basename>_new_ocr.json
+    """
+    layout = video_layout(video_path, basename, vfr_json_path, out_dir)
+    os.makedirs(layout["out_dir"], exist_ok=True)
+
+    if framearrays is None:
+        vid_timestamplist, framearrays = select_frames(layout["vfr_json"], fps, start_time, end_time, adaptive)
+    else:
+        vid_timestamplist = l_tsi.get_timestamps(layout["vfr_json"])
+    keyframes = l_tsi.get_keyframe_times(layout["vfr_json"])
+    logging.info(f"{layout['basename']}: {len(vid_timestamplist)} timestamps, {len(framearrays['index'])} frames selected")
+
+    checkpoint = l_ockp.OcrCheckpoint(layout["checkpoint"], resume=resume, selection=l_ockp.selection_hash(framearrays))
+    if checkpoint.done:
+        todo = np.array([ii not in checkpoint.done for ii in framearrays["index"].tolist()], dtype=bool)
+        framearrays = {key: framearrays[key][todo] for key in framearrays}
+        logging.info(f"resume: {len(checkpoint.done)} frames already done, {len(framearrays['index'])} left")
+
+    decoded = threaded_stage(l_fsrc.iter_selected_frames(video_path, framearrays, vid_timestamplist, keyframes),
+                             queue_size, "decode")
+    detected = threaded_stage(detect_stage(decoded, track_every, detect_params), queue_size, "detect")
+
+    text_height = None # read by the dispatcher threads, set once from the consumer loop
+
+    def ocr_frame(payload):
+        image, screens = payload
+        with l_met.timer("pipeline.ocr_frame"):
+            if screen_rois:
+                return l_ocrr.ocr_screen_rois(image, screens, ocr_fn, text_height, target_text_height)
+            if target_text_height:
+                # no screens is the whole frame
+                return l_ocrr.ocr_screen_rois(image, [], ocr_fn, text_height, target_text_height)
+            return ocr_fn(l_gocr.g_encode_image(image))
+
+    def ocr_batch(payloads):
+        with l_met.timer("pipeline.ocr_batch"):
+            if screen_rois or target_text_height:
+                return l_ocrr.ocr_frames_rois([(image, screens if screen_rois else []) for image, screens in payloads],
+                                              ocr_many_fn, text_height, target_text_height)
+            return ocr_many_fn([l_gocr.g_encode_image(image) for image, _ in payloads])
+
+    frame_dedup = l_fdd.FrameDedup() if dedup else None
+    in_flight = {} # entries waiting for their ocr result, the rest is only in the checkpoint log
+    ref_frame = None
+
+    def ocr_items():
+        nonlocal ref_frame
+        for frame, image, screens in detected:
+            ii = frame["index"]
+            entry = {"frame": str(frame["vbr_frameno"]),
+                     "google_ocr": None,
+                     "vbr_frameno": frame["vbr_frameno"],
+                     "pts_time": frame["pts_time"],
+                     "requested_time": frame["requested_time"],
+                     "screens": [list(s) for s in screens]}
+            ref_key = frame_dedup.check(ii, image, screens) if frame_dedup is not None else None
+            if ref_key is not None:
+                # google_ocr is filled in from the reference when the log is compacted.
+                # ocr_ref is the key of the reference entry, ocr_ref_frame its frame
+                entry["ocr_ref"] = ref_key
+                entry["ocr_ref_frame"] = ref_frame
+                checkpoint.append(ii, entry)
+                l_met.count("pipeline.dedup_skipped")
+                continue
+            ref_frame = entry["frame"]
+            in_flight[ii] = entry
+            yield ii, (image, screens)
+
+    if ocr_many_fn is not None:
+        dispatcher = l_ocrd.OcrDispatcher(ocr_batch, max_in_flight=ocr_concurrency)
+        results = dispatcher.map_batches(ocr_items(), ocr_batch_frames)
+    else:
+        dispatcher = l_ocrd.OcrDispatcher(ocr_frame, max_in_flight=ocr_concurrency)
+        results = dispatcher.map(ocr_items())
+    try:
+        for ii, annot_list in results:
+            entry = in_flight.pop(ii)
+            entry["google_ocr"] = annot_list
+            if target_text_height and text_height is None and annot_list:
+                text_height = l_ocrr.median_text_height(annot_list)
+                if text_height is not None:
+                    logging.info(f"text height {text_height:.1f} px, rois scaled by {l_ocrr.roi_scale(text_height, target_text_height):.2f}")
+            checkpoint.append(ii, entry)
+            logging.info(f"{len(checkpoint.done)} frames done, last vbr_frameno {entry['vbr_frameno']}")
+    finally:
+        # detect first: its thread is the one reading decoded
+        detected.close()
+        decoded.close()
+        checkpoint.close()
+
+    with l_met.timer("pipeline.compact"):
+        written = l_ockp.compact(layout["checkpoint"], layout["new_ocr_json"])
+    logging.info(f"{written} frames written to {layout['new_ocr_json']}")
+    if frame_dedup is not None:
+        logging.info(f"dedup: {frame_dedup.ocr_frames} frames sent to ocr, {frame_dedup.skipped_frames} reused")
+    return layout["new_ocr_json"]
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="vbr frame selection, screen detection and ocr in one pass")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="process one video")
+    run.add_argument("--video", required=True, help="eg. ../145147/20250924_145147.mp4")
+    run.add_argument("--fps", type=float, default=2)
+    run.add_argument("--basename", help="default: last _ part of the video filename, eg. 145147")
+    run.add_argument("--vfr-json", help="default: <video folder>/<basename>_vfr.json")
+    run.add_argument("--out-dir", help="default: ../<basename>_out/")
+    run.add_argument("--start", type=float, default=-1)
+    run.add_argument("--adaptive", action="store_true", help="pick frames by packet size / picture type instead of every 1/fps")
+    run.add_argument("--min-interval", type=float, default=0.25, help="adaptive: min seconds between frames")
+    run.add_argument("--max-interval", type=float, default=2.0, help="adaptive: max seconds between frames")
+    run.add_argument("--change-factor", type=float, default=2.0, help="adaptive: packet size vs recent median that counts as a change")
+    run.add_argument("--end", type=float, default=-1)
+    run.add_argument("--ocr-backend", default="google", choices=list(l_ocrb.OCR_BACKENDS),
+                     help="google vision, or tesseract on the local cpus")
+    run.add_argument("--api-key-env", default="gooog", help="environment variable with the google api key")
+    run.add_argument("--tesseract-lang", default="eng", help="eg. swe+eng")
+    run.add_argument("--ocr-workers", type=int, help="tesseract processes, default one per core")
+    run.add_argument("--cache", help="ocr cache sqlite file, eg. ../ocr_cache.sqlite")
+    run.add_argument("--ocr-concurrency", type=int, default=8, help="ocr requests in flight, for tesseract at least --ocr-workers")
+    run.add_argument("--ocr-batch-frames", type=int, default=4,
+                     help="google: frames whose rois go in one batch request (up to 16 images), 0 for one request per roi")
+    run.add_argument("--queue-size", type=int, default=16)
+    run.add_argument("--track-every", type=int, default=30, help="0 runs full screen detection on every frame")
+    run.add_argument("--downscale", type=int, default=1, choices=[1, 2, 4],
+                     help="screen detection on a 1/2 or 1/4 size image, edges refined at full size")
+    run.add_argument("--no-dedup", action="store_true")
+    run.add_argument("--full-frame", action="store_true", help="ocr the whole frame, not only the screens")
+    run.add_argument("--target-text-height", type=float,
+                     help="resize the rois so the text is this many pixels high, eg. 30 upscales small text")
+    run.add_argument("--resume", action="store_true", help="continue from <basename>_ocr_checkpoint.jsonl")
+    run.add_argument("--metrics", nargs="?", const="", help="collect timings and counters, written to this json "
+                     "(default <out-dir>/<basename>_metrics.json) and printed at the end")
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    if args.ocr_backend == "google":
+        api_key = os.environ.get(args.api_key_env)
+        if not api_key:
+            print(f"❌ Error: no api key in ${args.api_key_env}")
+            return 1
+        backend = l_ocrb.GoogleOcrBackend(api_key)
+    else:
+        backend = l_ocrb.TesseractOcrBackend(args.tesseract_lang, workers=args.ocr_workers)
+    if args.metrics is not None:
+        l_met.enable()
+    adaptive = {"min_interval": args.min_interval, "max_interval": args.max_interval,
+                "change_factor": args.change_factor} if args.adaptive else None
+    cache = l_ocrc.OcrCache(args.cache) if args.cache else None
+    logging.info(f"=== Pipeline run - {datetime.now()} - {args.video} ===")
+    with backend:
+        out_path = run_pipeline(args.video, args.fps, backend.ocr_fn(cache), args.basename, args.vfr_json,
+                                args.out_dir, args.start, args.end, args.ocr_concurrency, args.queue_size,
+                                args.track_every, not args.no_dedup, not args.full_frame, args.resume, adaptive=adaptive,
+                                detect_params={"downscale": args.downscale},
+                                target_text_height=args.target_text_height,
+                                ocr_many_fn=backend.ocr_many_fn(cache) if backend.batched and args.ocr_batch_frames else None,
+                                ocr_batch_frames=args.ocr_batch_frames)
+    if cache is not None:
+        cache.close()
+    print(f"\n✅ saved {out_path}")
+    if args.metrics is not None:
+        metrics_path = args.metrics or video_layout(args.video, args.basename, args.vfr_json, args.out_dir)["metrics"]
+        l_met.report(metrics_path)
+        print(f"metrics saved to {metrics_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    std_logging.basicConfig(level=std_logging.INFO, format='%(asctime)s-%(levelname)s-%(module)s-%(funcName)s- %(lineno)s- %(message)s')
+    sys.exit(main(sys.argv[1:]))
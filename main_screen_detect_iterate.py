@@ -1,215 +1,161 @@
 # claude_perspective_optimized.py
-import blackness
+import lib_screen_detect as l_sd
+import lib_metrics as l_met
 import sys
 import numpy as np
 import cv2
 import os
 import logging
+import logging as std_logging
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 import uuid
 from pathlib import Path
-# --- Script Setup ---
-if len(sys.argv) < 3:
-    print("❌ Error: Please provide an image file path as an argument and a outputfolder path.")
-    print("Usage: python3 claude_perspective_optimized.py <path_to_image.png> folder")
-    sys.exit(1)
 
-input_image = sys.argv[1]
-basename = Path(input_image).stem #filename without extension
-basename = basename+"_out"
-foldername = sys.argv[2]
-foldername = foldername + "/"
-# Create the output folder
-os.makedirs(foldername, exist_ok=True)
-debuglevel = 0
-
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO, # Changed to INFO for cleaner production output
-    format='%(asctime)s-%(levelname)s-%(module)s-%(funcName)s- %(lineno)s- %(message)s',
-    handlers=[
-        logging.FileHandler(foldername+'claude_log_optimized.log', mode='a'),
-        logging.StreamHandler()
-    ]
-)
 logging=logging.getLogger(__name__)
 
-def find_screens(image_path):
+def setup_logging(foldername):
+    """file + console logging for the command line runs"""
+    std_logging.basicConfig(
+        level=std_logging.INFO, # Changed to INFO for cleaner production output
+        format='%(asctime)s-%(levelname)s-%(module)s-%(funcName)s- %(lineno)s- %(message)s',
+        handlers=[
+            std_logging.FileHandler(foldername+'claude_log_optimized.log', mode='a'),
+            std_logging.StreamHandler()
+        ]
+    )
+
+def find_screens(image_path, foldername=None, debuglevel=0):
     """
     Finds the 3 main screens in an image using a single, optimized Canny edge detection setting.
+    image_path can also be a BGR ndarray, eg. from lib_frame_source.iter_selected_frames.
+    Debug images are written to foldername when one is given, see lib_screen_detect.DebugSink.
     """
     
     # Load the image
-    image = cv2.imread(image_path)
+    if isinstance(image_path, np.ndarray):
+        image = image_path
+        basename = "ndarray_out"
+    else:
+        image = cv2.imread(image_path)
+        basename = Path(image_path).stem+"_out" #filename without extension
     if image is None:
         logging.error(f"Could not load image from {image_path}")
         return []
 
-    img_height, img_width = image.shape[:2]
-    logging.info(f"Image loaded: {image_path}, Dimensions: {img_width}x{img_height}")
-    
-    # --- Preprocessing ---
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(gray, (7, 7), 0)
-    
-    # --- Optimized Edge Detection ---
-    # Using the "higher" setting (40, 120) which was found to be most effective.
-    low_thresh, high_thresh = 40, 120
-    edges = cv2.Canny(blurred, low_thresh, high_thresh)
-    if debuglevel>2: cv2.imwrite(foldername+f'{basename}_05_edges.png', edges)
-
-    logging.info(f"Using optimized edge detection: Canny({low_thresh}, {high_thresh})")
-    
-    # --- Contour Detection and Filtering ---
-    contours, _ = cv2.findContours(edges.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    logging.info(f"Found {len(contours)} initial contours.")
-    
-    all_candidates = []
-    candidate_id = 0
-    debug_img = image.copy()
-    
-    for contour in contours:
-        x, y, w, h = cv2.boundingRect(contour)
-        
-        # Skip very small contours to reduce noise
-        if w < 300 or h < 200:
-            continue
-        
-        # Calculate metrics
-        contour_area = cv2.contourArea(contour)
-        hull = cv2.convexHull(contour)
-        hull_area = cv2.contourArea(hull)
-        solidity = contour_area / float(hull_area) if hull_area > 0 else 0
-        width_ratio = w / float(img_width)
-        height_ratio = h / float(img_height)
-        aspect_ratio = w / float(h) if h > 0 else 0
-        blackness_percentage = blackness.get_blackness_percentage(image[y:y+h,x:x+w])
-        avg_y=(y+y+h)/2
-        
-        
-        # Store candidate info
-        candidate = {
-            'id': candidate_id,
-            'x': x, 'y': y, 'w': w, 'h': h,
-            'aspect_ratio': aspect_ratio,
-            'contour': contour,
-            'blackness_percentage': blackness_percentage,
-            'avg_y': avg_y
-        }
-        
-        # Define filtering criteria (you can adjust these if needed)
-        width_check = (0.15 * img_width) < w < (0.40 * img_width)
-        height_check = (0.15 * img_height) < h < (0.6 * img_height)
-        aspect_check = 0.8 < aspect_ratio < 2.5
-        blackness_check =  blackness_percentage > 50
-        
-        # Categorize candidate
-        if width_check and height_check and aspect_check and blackness_check:
-            candidate['category'] = 'EX'
-            color = (0, 255, 0)  # Green
-            thickness = 3
-        else:
-            candidate['category'] = 'PO' # Simplified category
-            color = (128, 128, 128) # Gray
-            thickness = 1
-        
-
-        logging.info(f"Candidate #{candidate_id}: Pos({x},{y}) Size({w}x{h}) Aspect({aspect_ratio:.2f}) Solidity({solidity:.2f}) Blackness({blackness_percentage:.2f}) y_avg({avg_y:.2f}) -> Category: {candidate['category']}")
-        
-        all_candidates.append(candidate)
-        
-        # Draw on debug image
-        cv2.rectangle(debug_img, (x, y), (x+w, y+h), color, thickness)
-        cv2.putText(debug_img, f"#{candidate_id} ({candidate['category']}) ({candidate['blackness_percentage']:.2f})", (x+5, y+20),
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-        
-        candidate_id += 1
-    
-    cv2.imwrite(foldername+f'{basename}_06_candidates.png', debug_img)
-    logging.info(f"Saved candidates debug image.")
-
-    # --- Final Selection Logic (with overlap removal) ---
-    final_screens = []
-    y_ex_center_sum = 0
-    ex_num = 0
-
-    for candidate in all_candidates:
-        if candidate['category'] == 'EX':
-            y_ex_center_sum = y_ex_center_sum + (candidate['avg_y'])
-            ex_num = ex_num + 1
-    y_ex_center_avg = y_ex_center_sum / ex_num
-    logging.info(f"y_ex_center_avg: {y_ex_center_avg}")
-
-    for candidate in all_candidates:
-        if candidate['category'] == 'EX':
+    debug = l_sd.DebugSink(foldername, basename, debuglevel) if foldername else None
+    with l_met.timer("find_screens"):
+        screens = l_sd.detect_screens(image, debug=debug)
+    l_met.count("find_screens.frames")
 
-            logging.info(f"EX_Candidate #{candidate_id}:  avg_y #({candidate['avg_y']:.2f})")
+    # debug, an info line per image slows down batches
+    logging.debug(f"✅ Final processing complete. Found {len(screens)} screens.")
+    return screens
 
-                
-
-
-    # Sort candidates to prioritize the best ones
-    # sorted_candidates = sorted([c for c in all_candidates if c['category'] == 'EX'],
-    #                           key=lambda c: (c['blackness_percentage']-49)/50 *c['w']*c['h'], reverse=True) # Prioritize larger screens
-    sorted_candidates = sorted([c for c in all_candidates if c['category'] == 'EX'],
-                              key=lambda c: (c['avg_y'], reversed==True)) # Prioritize closer to y avg 
-
-    for candidate in sorted_candidates:
-        if len(final_screens) >= 3:
-            break # Stop once we have 3 screens
-
-        # Check for significant overlap with already selected screens
-        is_overlapping = False
-        for screen in final_screens:
-            # Calculate Intersection over Union (IoU) or a simpler overlap metric
-            x1 = max(candidate['x'], screen['x'])
-            y1 = max(candidate['y'], screen['y'])
-            x2 = min(candidate['x'] + candidate['w'], screen['x'] + screen['w'])
-            y2 = min(candidate['y'] + candidate['h'], screen['y'] + screen['h'])
-            
-            intersection = max(0, x2 - x1) * max(0, y2 - y1)
-            candidate_area = candidate['w'] * candidate['h']
-            
-            # If the intersection is more than 30% of the candidate's area, it's an overlap
-            if intersection / candidate_area > 0.3:
-                is_overlapping = True
-                logging.warning(f"Candidate #{candidate['id']} overlaps with a selected screen. Discarding.")
-                break
-        
-        if not is_overlapping:
-            final_screens.append(candidate)
-    
-    # --- Generate Final Output ---
-    final_img = image.copy()
-    if not final_screens:
-        logging.error("No final screens selected after filtering.")
-    else:
-        logging.info(f"Selected {len(final_screens)} final screens.")
-        final_screens = sorted(final_screens, key=lambda s: s['x'])
-
-    for i, screen in enumerate(final_screens):
-        x, y, w, h = screen['x'], screen['y'], screen['w'], screen['h']
-        cv2.rectangle(final_img, (x, y), (x+w, y+h), (0, 255, 0), 3)
-        cv2.putText(final_img, f"Screen {i+1}", (x, y - 10),
-                   cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-        
-        # Save individual screen ROI (Region of Interest)
-        screen_roi = image[y:y+h, x:x+w]
-        cv2.imwrite(foldername+f'{basename}_08_final_screen_{i+1}.png', screen_roi)
-        
-        logging.info(f"=== FINAL SCREEN {i+1} (from Cand. #{screen['id']}) ===")
-        logging.info(f"  Position: ({x}, {y}), Size: {w}x{h}")
+# --- Batch Mode ---
+def batch_image_paths(frames_source):
+    """
+    Image paths for batch mode.
+    frames_source is a folder (all .png in it, sorted) or a framelist json: a list of
+    paths or of dicts with a "path" key. Relative paths are taken from the json's folder.
+    """
+    if os.path.isdir(frames_source):
+        return [os.path.join(frames_source, f) for f in sorted(os.listdir(frames_source)) if f.endswith(".png")]
+
+    with open(frames_source, 'r') as f:
+        entries = json.load(f)
+    json_folder = os.path.dirname(frames_source)
+    image_paths = []
+    for entry in entries:
+        path = entry["path"] if isinstance(entry, dict) else entry
+        image_paths.append(os.path.join(json_folder, path))
+    return image_paths
+
+def _find_screens_chunk(image_paths, track_every=0, metrics=False):
+    # runs in a worker process, one task per chunk of images.
+    # chunks are consecutive frames, so with tracking each chunk gets its own tracker.
+    # with metrics the chunk's lib_metrics snapshot goes back to the parent
+    if metrics:
+        l_met.enable()
+        l_met.reset()
+    tracker = l_sd.ScreenTracker(redetect_every=track_every) if track_every else None
+    results = []
+    for image_path in image_paths:
+        try:
+            if tracker is None:
+                screens = find_screens(image_path)
+            else:
+                image = cv2.imread(image_path)
+                screens = tracker.update(image) if image is not None else []
+        except Exception:
+            logging.exception(f"find_screens failed for {image_path}")
+            screens = []
+        results.append((image_path, screens))
+    return results, l_met.snapshot() if metrics else None
+
+def find_screens_batch(image_paths, out_json_path, workers=None, chunksize=16, track_every=0):
+    """
+    Run find_screens over many images in a process pool and write one json
+    {image_path: [[x, y, w, h], ...]} in the order of image_paths.
 
-    cv2.imwrite(foldername+f'{basename}_08_final.png', final_img)
-    
-    logging.info(f"✅ Final processing complete. Found {len(final_screens)} screens.")
-    return [(s['x'], s['y'], s['w'], s['h']) for s in final_screens]
+    Args:
+        workers: number of processes, None is one per core
+        chunksize: images per submitted task
+        track_every: >0 uses lib_screen_detect.ScreenTracker, full detection at least every track_every frames
+    """
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_find_screens_chunk, image_paths[i:i+chunksize], track_every, l_met.is_enabled())
+                   for i in range(0, len(image_paths), chunksize)]
+        for done, future in enumerate(as_completed(futures), 1):
+            chunk_results, chunk_metrics = future.result()
+            for image_path, screens in chunk_results:
+                results[image_path] = [list(screen) for screen in screens]
+            if chunk_metrics is not None:
+                l_met.merge(chunk_metrics)
+            logging.info(f"batch: {done} of {len(futures)} chunks done")
+
+    out_json = {image_path: results[image_path] for image_path in image_paths}
+    with open(out_json_path, 'w') as f:
+        json.dump(out_json, f, indent=4)
+    return out_json
 
 # --- Main Execution ---
 if __name__ == "__main__":
+    batch_mode = len(sys.argv) > 1 and sys.argv[1] == "--batch"
+    script_args = sys.argv[2:] if batch_mode else sys.argv[1:]
+    if len(script_args) < 2:
+        print("❌ Error: Please provide an image file path as an argument and a outputfolder path.")
+        print("Usage: python3 claude_perspective_optimized.py <path_to_image.png> folder")
+        print("       python3 claude_perspective_optimized.py --batch <frames_folder|framelist.json> folder [workers] [chunksize] [track_every]")
+        sys.exit(1)
+
+    input_image = script_args[0]
+    foldername = script_args[1] + "/"
+    # Create the output folder
+    os.makedirs(foldername, exist_ok=True)
+    setup_logging(foldername)
+    debuglevel = 0
+
+    if batch_mode:
+        workers = int(script_args[2]) if len(script_args) > 2 else None
+        chunksize = int(script_args[3]) if len(script_args) > 3 else 16
+        track_every = int(script_args[4]) if len(script_args) > 4 else 0
+        image_paths = batch_image_paths(input_image)
+        logging.info(f"=== Monitor Detection Batch - {datetime.now()} - {len(image_paths)} images ===\n")
+        screens_by_image = find_screens_batch(image_paths, foldername+"screens.json", workers, chunksize, track_every)
+        found = sum(1 for screens in screens_by_image.values() if screens)
+        print(f"\n✅ Batch done: screens found in {found} of {len(screens_by_image)} images, saved to {foldername}screens.json")
+        # VBR_METRICS=1 python3 main_screen_detect_iterate.py --batch ... for timings
+        l_met.report(foldername+"metrics.json")
+        sys.exit(0)
+
+    # per candidate details in the log for single images, too slow for batches
+    std_logging.getLogger(l_sd.__name__).setLevel(std_logging.DEBUG)
     logging.info(f"=== Monitor Detection Log - {datetime.now()} ===\n")
     
-    screens = find_screens(input_image)
+    screens = find_screens(input_image, foldername, debuglevel)
     
     if screens:
         print(f"\n✅ SUCCESS: Detected {len(screens)} screens.")
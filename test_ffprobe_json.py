@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+import lib_ffprobe_json as l_ffj
+
+def test_adaptive_settle_pick_on_end_time():
+    # a burst at the start gets its settle pick min_interval later, here exactly end_time (gap 0 to the end)
+    times = l_ffj.adaptive_request_times(np.array([0.0, 0.1]), 0.0, 0.25, min_interval=0.25, max_interval=2.0)
+    assert times.tolist() == [0.0, 0.25]
+
+def test_adaptive_coinciding_picks_kept():
+    times = l_ffj.adaptive_request_times(np.array([1.0, 1.0, 3.0]), 0.0, 5.0, min_interval=0.0, max_interval=2.0)
+    # a zero gap between two picks does not drop the pick or what follows it
+    assert {0.0, 1.0, 3.0} <= set(times.tolist())
+    assert np.all(np.diff(times) >= 0)
+
+def test_adaptive_change_on_start_time():
+    # the change coincides with the start pick, it gets a settle pick like a burst
+    times = l_ffj.adaptive_request_times(np.array([0.0, 1.0]), 0.0, 2.0, min_interval=0.25, max_interval=2.0)
+    assert times.tolist() == [0.0, 0.25, 1.0]
+
+def test_adaptive_max_interval_fill():
+    times = l_ffj.adaptive_request_times(np.array([]), 0.0, 5.0, min_interval=0.25, max_interval=2.0)
+    assert times[0] == 0.0
+    assert np.all(np.diff(np.append(times, 5.0)) <= 2.0 + 1e-9)
+    times = l_ffj.adaptive_request_times(np.array([4.0]), 0.0, 10.0, min_interval=0.25, max_interval=1.5)
+    assert 4.0 in times.tolist()
+    assert np.all(np.diff(np.append(times, 10.0)) <= 1.5 + 1e-9)
+
+def test_adaptive_burst_thinned_to_min_interval():
+    times = l_ffj.adaptive_request_times(np.array([1.0, 1.05, 1.1, 1.15]), 0.0, 2.0, min_interval=0.25, max_interval=2.0)
+    assert times.tolist() == pytest.approx([0.0, 1.0, 1.25])
+
+@pytest.mark.parametrize("ts", [[], [3.0]])
+def test_adaptive_selection_too_few_timestamps(ts):
+    framearrays = l_ffj.framearrays_adaptive(-1, -1, ts, [1000] * len(ts))
+    assert set(framearrays) == set(l_ffj.framearrays_from_timespan(-1, -1, 2, [3.0]))
+    assert all(len(column) == 0 for column in framearrays.values())
+
+def test_adaptive_selection_picks_changes():
+    ts = np.arange(0, 10, 0.1)
+    pkt_size = np.full(len(ts), 1000)
+    pkt_size[45] = 50000
+    framearrays = l_ffj.framearrays_adaptive(-1, -1, ts, pkt_size, min_interval=0.25, max_interval=2.0)
+    assert 45 in framearrays["vbr_frameno"].tolist()
+    assert np.all(np.diff(framearrays["vbr_frameno"]) > 0)
+    assert np.all(framearrays["pts_time"] == ts[framearrays["vbr_frameno"]])
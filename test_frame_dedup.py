@@ -0,0 +1,36 @@
+import numpy as np
+import lib_frame_dedup as l_fdd
+
+SCREENS = [(20, 20, 200, 120)]
+
+def _frame(value):
+    image = np.full((240, 320, 3), 200, np.uint8)
+    image[20:140, 20:220] = 30
+    image[60:80, 40:40 + value] = 220  # a bar whose length stands in for the screen text
+    return image
+
+def test_iter_dedup_ocr_ref_is_the_reference_key():
+    frames = [("a", _frame(50), SCREENS), ("b", _frame(50), SCREENS), ("c", _frame(150), SCREENS)]
+    calls = []
+
+    def ocr_fn(image):
+        calls.append(image)
+        return [{"word": str(len(calls))}]
+
+    out = dict(l_fdd.iter_dedup_ocr(frames, ocr_fn))
+    assert len(calls) == 2
+    assert out["b"] == {"google_ocr": [{"word": "1"}], "ocr_ref": "a"}
+    assert "ocr_ref" not in out["a"] and "ocr_ref" not in out["c"]
+
+def test_resolve_ocr_refs_pipeline_output():
+    # main_pipeline / compact: ocr_ref is the json key of the reference, ocr_ref_frame its frame
+    outjson = {"0": {"frame": "10", "google_ocr": [{"word": "a"}]},
+               "1": {"frame": "11", "google_ocr": None, "ocr_ref": "0", "ocr_ref_frame": "10"},
+               "2": {"frame": "12", "google_ocr": None, "ocr_ref": 1, "ocr_ref_frame": "10"}}
+    l_fdd.resolve_ocr_refs(outjson)
+    assert outjson["1"]["google_ocr"] == outjson["2"]["google_ocr"] == [{"word": "a"}]
+    assert outjson["1"]["ocr_ref_frame"] == "10"
+
+def test_resolve_ocr_refs_missing_reference():
+    outjson = {"1": {"google_ocr": None, "ocr_ref": "0"}}
+    assert l_fdd.resolve_ocr_refs(outjson)["1"]["google_ocr"] is None
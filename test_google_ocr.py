@@ -0,0 +1,93 @@
+import pytest
+import numpy as np
+import lib_google_ocr as l_gocr
+import lib_ocr_roi as l_ocrr
+import lib_ocr_cache as l_ocrc
+import lib_ocr_dispatch as l_ocrd
+
+def test_batch_chunks_at_image_limit(stub_client):
+    contents = [f"w{i}".encode() for i in range(2 * l_gocr.G_BATCH_MAX_IMAGES + 3)]
+    word_lists = l_gocr.g_cv_batch_doc_text_detect(contents, "stub-key", stub_client)
+    assert stub_client.batch_sizes == [l_gocr.G_BATCH_MAX_IMAGES, l_gocr.G_BATCH_MAX_IMAGES, 3]
+    # one word list per image, in input order across the chunks
+    assert [word_list[0]["word"] for word_list in word_lists] == [c.decode() for c in contents]
+
+def test_batch_chunks_exactly_at_limit(stub_client):
+    contents = [b"w"] * l_gocr.G_BATCH_MAX_IMAGES
+    l_gocr.g_cv_batch_doc_text_detect(contents, "stub-key", stub_client)
+    assert stub_client.batch_sizes == [l_gocr.G_BATCH_MAX_IMAGES]
+
+def test_batch_chunks_at_byte_limit():
+    contents = [b"x" * 400, b"x" * 400, b"x" * 300, b"x" * 900, b"x" * 50]
+    assert list(l_gocr.g_batch_chunks(contents, max_images=16, max_bytes=1000)) == [[0, 1], [2], [3, 4]]
+    # an image over the limit on its own still gets a request
+    assert list(l_gocr.g_batch_chunks([b"x" * 2000, b"x"], max_bytes=1000)) == [[0], [1]]
+
+def test_batch_error_response_raises(stub_client):
+    contents = [b"a", b"b", b"error: image too big", b"d"]
+    with pytest.raises(Exception, match="error: image too big"):
+        l_gocr.g_cv_batch_doc_text_detect(contents, "stub-key", stub_client, max_images=2)
+    # the chunk with the bad image was sent, the error is not swallowed
+    assert stub_client.batch_sizes == [2, 2]
+
+def test_batch_error_keeps_other_results(stub_client, tmp_path):
+    cache = l_ocrc.OcrCache(str(tmp_path / "cache.sqlite"))
+    try:
+        with pytest.raises(l_gocr.GoogleOcrBatchError) as error:
+            l_gocr.g_cv_batch_doc_text_detect([b"a", b"error: bad", b"c", b"d"], "stub-key", stub_client,
+                                              max_images=2, cache=cache)
+        assert list(error.value.errors) == [1]
+        assert [word_list and word_list[0]["word"] for word_list in error.value.word_lists] == ["a", None, "c", "d"]
+        # the retry only sends the failed image, the rest came back from the cache
+        with pytest.raises(l_gocr.GoogleOcrBatchError):
+            l_gocr.g_cv_batch_doc_text_detect([b"a", b"error: bad", b"c", b"d"], "stub-key", stub_client, cache=cache)
+    finally:
+        cache.close()
+    assert stub_client.batch_sizes == [2, 2, 1]
+
+def test_batch_cache_sends_only_missing(stub_client, tmp_path):
+    cache = l_ocrc.OcrCache(str(tmp_path / "cache.sqlite"))
+    try:
+        l_gocr.g_cv_batch_doc_text_detect([b"a", b"b"], "stub-key", stub_client, cache=cache)
+        word_lists = l_gocr.g_cv_batch_doc_text_detect([b"b", b"c", b"a"], "stub-key", stub_client, cache=cache)
+    finally:
+        cache.close()
+    assert stub_client.batch_sizes == [2, 1]
+    assert [word_list[0]["word"] for word_list in word_lists] == ["b", "c", "a"]
+
+def test_map_batches_with_batch_detect(stub_client):
+    dispatcher = l_ocrd.OcrDispatcher(
+        lambda contents: l_gocr.g_cv_batch_doc_text_detect(contents, "stub-key", stub_client), max_in_flight=2)
+    results = dict(dispatcher.map_batches([(i, f"w{i}".encode()) for i in range(20)], batch_size=8))
+    assert {key: word_list[0]["word"] for key, word_list in results.items()} == {i: f"w{i}" for i in range(20)}
+    assert sorted(stub_client.batch_sizes) == [4, 8, 8]
+
+def test_map_batches_error_response_propagates(stub_client):
+    dispatcher = l_ocrd.OcrDispatcher(
+        lambda contents: l_gocr.g_cv_batch_doc_text_detect(contents, "stub-key", stub_client), retries=0)
+    with pytest.raises(Exception, match="error: quota"):
+        list(dispatcher.map_batches([(0, b"a"), (1, b"error: quota"), (2, b"c")], batch_size=2))
+
+def test_batch_frames_detect_offsets(stub_client):
+    frames = [("10", [(b"a", (100, 50)), (b"b c", (0, 0), 2.0)]), ("11", [(b"d", (0, 0))])]
+    word_lists = l_gocr.g_cv_batch_frames_detect(frames, "stub-key", stub_client)
+    assert [w["word"] for w in word_lists["10"]] == ["a", "b", "c"]
+    assert word_lists["10"][0]["bounding_box"][0] == (100, 50)
+    # scale 2.0: the roi was upscaled, boxes are halved back
+    assert word_lists["10"][2]["bounding_box"][1] == (1, 0)
+    assert stub_client.batch_sizes == [3]
+
+def test_frames_rois_one_call_for_all_rois():
+    sizes = []
+
+    def ocr_many_fn(contents_list):
+        sizes.append(len(contents_list))
+        return [[{"word": str(i), "confidence": 0.9, "bounding_box": [(0, 0), (1, 0), (1, 1), (0, 1)]}]
+                for i in range(len(contents_list))]
+
+    image = np.zeros((100, 200, 3), np.uint8)
+    frames = [(image, [(10, 20, 50, 50), (100, 20, 50, 50)]), (image, [])]
+    word_lists = l_ocrr.ocr_frames_rois(frames, ocr_many_fn)
+    assert sizes == [3]
+    assert [[w["word"] for w in word_list] for word_list in word_lists] == [["0", "1"], ["2"]]
+    assert word_lists[0][1]["bounding_box"][0] == (100, 20)
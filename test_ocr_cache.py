@@ -0,0 +1,65 @@
+import sqlite3
+import threading
+import lib_ocr_cache as l_ocrc
+
+WORDS = [{"word": "x" * 80, "confidence": 0.9, "bounding_box": [[0, 0]] * 4}]
+
+def _sum_size(cache):
+    return cache._db.execute("SELECT COALESCE(SUM(size), 0) FROM ocr").fetchone()[0]
+
+def test_total_follows_puts_replaces_and_evictions(tmp_path):
+    cache = l_ocrc.OcrCache(str(tmp_path / "cache.sqlite"), max_bytes=2000)
+    try:
+        for i in range(30):
+            cache.put(f"k{i}", WORDS)
+        cache.put("k29", [])  # replace with a smaller result
+        assert cache.stats()["bytes"] == _sum_size(cache) <= 2000
+        assert cache.evictions > 0
+        assert cache.get("k29") == [] and cache.get("k0") is None
+    finally:
+        cache.close()
+
+def test_total_shared_between_connections(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    caches = [l_ocrc.OcrCache(path, max_bytes=20000) for _ in range(2)]
+
+    def fill(cache, tag):
+        for i in range(200):
+            cache.put(f"{tag}{i}", WORDS)
+
+    threads = [threading.Thread(target=fill, args=(cache, tag)) for cache, tag in zip(caches, "ab")]
+    try:
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        assert caches[0].stats()["bytes"] == caches[1].stats()["bytes"] == _sum_size(caches[0]) <= 20000
+    finally:
+        [cache.close() for cache in caches]
+
+def test_hit_writes_only_when_last_used_is_stale(tmp_path):
+    cache = l_ocrc.OcrCache(str(tmp_path / "cache.sqlite"))
+    try:
+        cache.put("k", WORDS)
+        changes = cache._db.total_changes
+        assert cache.get("k") == WORDS
+        assert cache._db.total_changes == changes
+        cache.touch_interval = 0
+        assert cache.get("k") == WORDS
+        assert cache._db.total_changes == changes + 1
+        assert cache.hits == 2
+    finally:
+        cache.close()
+
+def test_total_from_a_file_without_it(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE ocr (key TEXT PRIMARY KEY, result TEXT, size INTEGER, last_used REAL)")
+    db.executemany("INSERT INTO ocr VALUES (?, '[]', ?, 0)", [("a", 100), ("b", 250)])
+    db.commit()
+    db.close()
+    cache = l_ocrc.OcrCache(path)
+    try:
+        assert cache.stats()["bytes"] == 350
+        cache.put("c", [])
+        assert cache.stats()["bytes"] == 352
+    finally:
+        cache.close()
@@ -0,0 +1,107 @@
+import json
+import numpy as np
+import lib_ocr_checkpoint as l_ockp
+
+def _entry(frame, words=None, ref=None):
+    entry = {"frame": str(frame), "google_ocr": None if words is None else [{"word": w} for w in words]}
+    if ref is not None:
+        entry["ocr_ref"] = ref
+    return entry
+
+def _selection(framenos):
+    return l_ockp.selection_hash({"index": np.arange(len(framenos)), "vbr_frameno": np.array(framenos)})
+
+def _compact(log_path, tmp_path):
+    out_path = str(tmp_path / "out.json")
+    l_ockp.compact(log_path, out_path)
+    with open(out_path) as f:
+        return json.load(f)
+
+def test_resume_skips_done_keys(tmp_path):
+    log_path = str(tmp_path / "ckpt.jsonl")
+    selection = _selection([10, 20, 30])
+    checkpoint = l_ockp.OcrCheckpoint(log_path, resume=True, selection=selection)
+    checkpoint.append(0, _entry(10, ["a"]))
+    checkpoint.append(1, _entry(20, ["b"]))
+    checkpoint.close()
+
+    checkpoint = l_ockp.OcrCheckpoint(log_path, resume=True, selection=selection)
+    assert checkpoint.done == {0, 1}
+    checkpoint.append(2, _entry(30, ["c"]))
+    checkpoint.close()
+    out = _compact(log_path, tmp_path)
+    assert list(out) == ["0", "1", "2"]
+    assert out["2"]["google_ocr"] == [{"word": "c"}]
+
+def test_no_resume_starts_over(tmp_path):
+    log_path = str(tmp_path / "ckpt.jsonl")
+    checkpoint = l_ockp.OcrCheckpoint(log_path)
+    checkpoint.append(0, _entry(10, ["a"]))
+    checkpoint.close()
+    checkpoint = l_ockp.OcrCheckpoint(log_path, resume=False)
+    assert checkpoint.done == set()
+    checkpoint.close()
+    assert list(l_ockp.iter_log(log_path)) == []
+
+def test_torn_last_line_ignored(tmp_path):
+    log_path = str(tmp_path / "ckpt.jsonl")
+    checkpoint = l_ockp.OcrCheckpoint(log_path, selection=_selection([10, 20]))
+    checkpoint.append(0, _entry(10, ["a"]))
+    checkpoint.close()
+    # crash in the middle of writing the next line
+    with open(log_path, 'a') as f:
+        f.write('{"key": 1, "entry": {"frame": "2')
+    assert [key for key, _, _ in l_ockp.iter_log(log_path)] == [0]
+
+    checkpoint = l_ockp.OcrCheckpoint(log_path, selection=_selection([10, 20]))
+    assert checkpoint.done == {0}
+    # the next append is not glued onto the torn line
+    checkpoint.append(1, _entry(20, ["b"]))
+    checkpoint.close()
+    assert [key for key, _, _ in l_ockp.iter_log(log_path)] == [0, 1]
+    assert _compact(log_path, tmp_path)["1"]["google_ocr"] == [{"word": "b"}]
+
+def test_other_selection_starts_new_log(tmp_path):
+    log_path = str(tmp_path / "ckpt.jsonl")
+    checkpoint = l_ockp.OcrCheckpoint(log_path, selection=_selection([10, 20]))
+    checkpoint.append(0, _entry(10, ["a"]))
+    checkpoint.close()
+
+    # same positions, other frames: key 0 means vbr frame 15 now
+    checkpoint = l_ockp.OcrCheckpoint(log_path, resume=True, selection=_selection([15, 20]))
+    assert checkpoint.done == set()
+    checkpoint.close()
+    assert l_ockp.read_selection(log_path) == _selection([15, 20])
+    assert list(l_ockp.iter_log(log_path)) == []
+
+def test_selection_hash():
+    assert _selection([10, 20]) == _selection([10, 20])
+    assert _selection([10, 20]) != _selection([10, 21])
+    assert _selection([10, 20]) != _selection([10, 20, 30])
+
+def test_compact_resolves_ref_appended_after_dedup_entry(tmp_path):
+    # main_pipeline order: a dedup entry is appended when it is decoded, the frame it
+    # points to only when its ocr result comes back, later in the log
+    log_path = str(tmp_path / "ckpt.jsonl")
+    checkpoint = l_ockp.OcrCheckpoint(log_path)
+    checkpoint.append(1, _entry(11, ref=0))
+    checkpoint.append(2, _entry(12, ref=1))  # chain: 2 -> 1 -> 0
+    checkpoint.append(3, _entry(13, ["x"]))
+    checkpoint.append(0, _entry(10, ["a", "b"]))
+    checkpoint.append(4, _entry(14, ref=3))
+    checkpoint.close()
+    out = _compact(log_path, tmp_path)
+    assert list(out) == ["0", "1", "2", "3", "4"]
+    assert out["1"]["google_ocr"] == out["2"]["google_ocr"] == [{"word": "a"}, {"word": "b"}]
+    assert out["4"]["google_ocr"] == [{"word": "x"}]
+    assert out["1"]["frame"] == "11"
+    # ocr_ref stays, as the json key of the reference
+    assert out["1"]["ocr_ref"] == "0" and out["2"]["ocr_ref"] == "1"
+
+def test_compact_ref_to_missing_key(tmp_path):
+    # the reference was lost in a crash: the entry stays without a result
+    log_path = str(tmp_path / "ckpt.jsonl")
+    checkpoint = l_ockp.OcrCheckpoint(log_path)
+    checkpoint.append(1, _entry(11, ref=0))
+    checkpoint.close()
+    assert _compact(log_path, tmp_path)["1"]["google_ocr"] is None
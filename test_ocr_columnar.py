@@ -0,0 +1,65 @@
+import os
+import json
+import numpy as np
+import pytest
+import lib_ocr_columnar as l_ocol
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "143800_vfr__vbr_ocr.json")
+
+def _word(text, x=1, confidence=0.9):
+    return {"word": text, "confidence": confidence, "bounding_box": [[x, 2], [x + 2, 2], [x + 2, 4], [x, 4]]}
+
+def _round_trip(ocr_json, tmp_path):
+    out_dir = str(tmp_path / "ocr.cols")
+    l_ocol.ocr_json_to_columns(ocr_json, out_dir)
+    return l_ocol.columns_to_ocr_json(l_ocol.load_ocr_columns(out_dir))
+
+def test_round_trip_new_ocr_fields(tmp_path):
+    # the _new_ocr.json layout of main_pipeline: a dedup entry with ocr_ref / ocr_ref_frame,
+    # an entry without requested_time, and google_ocr null (never sent) next to [] (no words)
+    new_ocr = {
+        "0": {"frame": "10", "google_ocr": [_word("a"), _word("ö", 5, 0.3)], "vbr_frameno": 10, "pts_time": 1.5,
+              "requested_time": 1.5, "screens": [[0, 0, 5, 5], [10, 0, 5, 5]]},
+        "1": {"frame": "11", "google_ocr": [_word("a")], "vbr_frameno": 11, "pts_time": 2.0, "requested_time": 2.0,
+              "screens": [[0, 0, 5, 5]], "ocr_ref": "0", "ocr_ref_frame": "10"},
+        "2": {"frame": "12", "google_ocr": [], "vbr_frameno": 12, "pts_time": 2.5, "screens": []},
+        "3": {"google_ocr": None, "pts_time": 3.0},
+    }
+    back = _round_trip(new_ocr, tmp_path)
+    assert back == new_ocr
+    assert list(back) == list(new_ocr)
+    assert "requested_time" not in back["2"] and "vbr_frameno" not in back["3"]
+    assert back["3"]["google_ocr"] is None and back["2"]["google_ocr"] == []
+
+def test_round_trip_field_only_in_later_entries(tmp_path):
+    # the fields are collected from all entries, not from the first one
+    ocr_json = {"5": {"google_ocr": [_word("x")]},
+                "6": {"google_ocr": [_word("y")], "pts_time": 0.25, "note": {"source": "manual"}}}
+    back = _round_trip(ocr_json, tmp_path)
+    assert back == ocr_json
+    meta = l_ocol.load_ocr_columns(str(tmp_path / "ocr.cols"))["meta"]
+    assert meta["partial_fields"] == ["pts_time"]
+    assert meta["extra_fields"] == ["note"]
+
+def test_confidence_float32_only_loss(tmp_path):
+    ocr_json = {"0": {"google_ocr": [_word("a", confidence=0.123456789)]}}
+    confidence = _round_trip(ocr_json, tmp_path)["0"]["google_ocr"][0]["confidence"]
+    assert confidence == pytest.approx(0.123456789, abs=1e-7)
+    assert np.float32(confidence) == np.float32(0.123456789)
+
+def test_bounding_box_over_int16_raises(tmp_path):
+    ocr_json = {"0": {"google_ocr": [_word("a", x=40000)]}}
+    with pytest.raises(ValueError, match="int16"):
+        l_ocol.ocr_json_to_columns(ocr_json, str(tmp_path / "ocr.cols"))
+
+@pytest.mark.skipif(not os.path.exists(FIXTURE), reason="checked-in ocr json not there")
+def test_round_trip_checked_in_json(tmp_path):
+    with open(FIXTURE, 'r') as f:
+        ocr_json = json.load(f)
+    back = _round_trip(ocr_json, tmp_path)
+    assert list(back) == list(ocr_json)
+    for key, entry in ocr_json.items():
+        words = back[key]["google_ocr"]
+        assert [w["word"] for w in words] == [w["word"] for w in entry["google_ocr"]]
+        assert [w["bounding_box"] for w in words] == [w["bounding_box"] for w in entry["google_ocr"]]
+        assert {k: v for k, v in back[key].items() if k != "google_ocr"} == {k: v for k, v in entry.items() if k != "google_ocr"}
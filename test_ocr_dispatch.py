@@ -0,0 +1,86 @@
+import pytest
+import lib_google_ocr as l_gocr
+import lib_ocr_dispatch as l_ocrd
+from conftest import StubVisionClient
+
+def _ocr_fn(client):
+    return lambda content: l_gocr.g_cv_doc_text_detect(content, "stub-key", client)
+
+def test_stub_client_word_list(stub_client):
+    words = l_gocr.g_cv_doc_text_detect(b"foo bar", "stub-key", stub_client)
+    assert [w["word"] for w in words] == ["foo", "bar"]
+    assert words[1]["bounding_box"] == [(1, 0), (2, 0), (2, 1), (1, 1)]
+
+def test_map_results_keyed_by_item():
+    client = StubVisionClient(delay=0.01)
+    items = [(i, f"word{i}".encode()) for i in range(40)]
+    dispatcher = l_ocrd.OcrDispatcher(_ocr_fn(client), max_in_flight=4)
+    results = dict(dispatcher.map(items))
+    assert sorted(results) == list(range(40))
+    assert all(results[i][0]["word"] == f"word{i}" for i in range(40))
+    assert dispatcher.done == 40 and client.calls == 40
+
+def test_map_batches_keeps_order_within_batches():
+    dispatcher = l_ocrd.OcrDispatcher(lambda contents: [c.decode() for c in contents], max_in_flight=2)
+    results = list(dispatcher.map_batches([(i, str(i).encode()) for i in range(10)], batch_size=4))
+    assert sorted(results) == [(i, str(i)) for i in range(10)]
+
+def test_in_flight_bounded():
+    client = StubVisionClient(delay=0.02)
+    pulled = []
+
+    def items():
+        for i in range(30):
+            pulled.append(i)
+            yield i, b"word"
+
+    dispatcher = l_ocrd.OcrDispatcher(_ocr_fn(client), max_in_flight=3)
+    for key, _ in dispatcher.map(items()):
+        # the source is read lazily, never more than max_in_flight ahead of the results
+        assert len(pulled) - dispatcher.done <= 3 + 1
+    assert 1 < client.max_active <= 3
+
+def test_error_propagates_after_retries(stub_client):
+    dispatcher = l_ocrd.OcrDispatcher(_ocr_fn(stub_client), max_in_flight=2, retries=2, backoff=0)
+    with pytest.raises(Exception, match="error: quota"):
+        list(dispatcher.map([(0, b"ok"), (1, b"error: quota")]))
+    assert dispatcher.failed == 1 and dispatcher.retried == 2
+
+def test_permanent_error_not_retried_by_default(stub_client):
+    # INVALID_ARGUMENT fails the same way every time, no backoff for it
+    dispatcher = l_ocrd.OcrDispatcher(_ocr_fn(stub_client), retries=3, backoff=0)
+    with pytest.raises(Exception, match="error: bad image"):
+        list(dispatcher.map([(0, b"error: bad image")]))
+    assert dispatcher.retried == 0 and stub_client.calls == 1
+
+def test_unavailable_retried_by_default(stub_client):
+    dispatcher = l_ocrd.OcrDispatcher(_ocr_fn(stub_client), retries=2, backoff=0)
+    with pytest.raises(l_ocrd.TRANSIENT_ERRORS):
+        list(dispatcher.map([(0, b"unavailable")]))
+    assert dispatcher.retried == 2 and stub_client.calls == 3
+
+def test_retries_counted_from_all_threads():
+    attempts = {}
+
+    def flaky(content):
+        # every item fails once
+        attempts[content] = attempts.get(content, 0) + 1
+        if attempts[content] == 1:
+            raise ConnectionError("reset")
+        return content
+
+    dispatcher = l_ocrd.OcrDispatcher(flaky, max_in_flight=8, retries=1, backoff=0)
+    assert len(dict(dispatcher.map((i, i) for i in range(200)))) == 200
+    assert dispatcher.retried == 200 and dispatcher.done == 200
+
+def test_error_not_retried_when_not_in_retry_on(stub_client):
+    dispatcher = l_ocrd.OcrDispatcher(_ocr_fn(stub_client), retries=3, backoff=0, retry_on=(ConnectionError,))
+    with pytest.raises(Exception, match="error: bad image"):
+        list(dispatcher.map([(0, b"error: bad image")]))
+    assert dispatcher.retried == 0 and stub_client.calls == 1
+
+def test_skip_failed(stub_client):
+    dispatcher = l_ocrd.OcrDispatcher(_ocr_fn(stub_client), retries=0, skip_failed=True)
+    results = dict(dispatcher.map([(0, b"a"), (1, b"error"), (2, b"c")]))
+    assert sorted(results) == [0, 2]
+    assert dispatcher.failed == 1 and dispatcher.done == 2
@@ -0,0 +1,112 @@
+import time
+import wave
+import types
+import numpy as np
+import pytest
+import lib_transcribe as l_tr
+
+RATE = 16000
+
+def _write_wav(path, pieces, rate=RATE):
+    """pieces: (seconds, amplitude), a 440 Hz tone is speech, amplitude 0 silence"""
+    t = np.arange(int(sum(seconds for seconds, _ in pieces) * rate)) / rate
+    samples = np.concatenate([amplitude * np.sin(2 * np.pi * 440 * t[:int(seconds * rate)])
+                              for seconds, amplitude in pieces])
+    with wave.open(str(path), 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes((samples * 32767).astype(np.int16).tobytes())
+    return str(path)
+
+class StubWhisperModel:
+    """
+    Stands in for faster_whisper's WhisperModel: one segment per chunk with the chunk length
+    as text. Longer chunks take longer (delay seconds per second of audio), so with two workers
+    the chunks finish out of order; finished_log gets the text of each chunk as it finishes.
+    """
+    def __init__(self, delay=0.0, finished_log=None):
+        self.delay = delay
+        self.finished_log = finished_log
+
+    def transcribe(self, audio, **kwargs):
+        seconds = len(audio) / l_tr.WHISPER_SAMPLE_RATE
+        time.sleep(self.delay * seconds)
+        text = f"{seconds:.2f}"
+        if self.finished_log:
+            with open(self.finished_log, 'a') as f:
+                f.write(text + "\n")
+        return [types.SimpleNamespace(start=0.5, end=seconds, text=f" {text} ")], types.SimpleNamespace(language="sv")
+
+def _chunks(wav_path, **vad_kwargs):
+    return [(start, len(samples) / rate) for start, samples, rate in l_tr.iter_vad_chunks(wav_path, **vad_kwargs)]
+
+def test_vad_cut_at_silence_after_min_chunk(tmp_path):
+    # the pause at 2 s is before min_chunk, the one at 6.5 s ends the first chunk
+    wav_path = _write_wav(tmp_path / "a.wav", [(2, 0.5), (0.5, 0), (4, 0.5), (1, 0), (3, 0.5)])
+    chunks = _chunks(wav_path, min_chunk=5.0, min_silence=0.3, max_chunk=30.0)
+    assert len(chunks) == 2
+    assert chunks[0][0] == 0.0
+    # cut after 0.3 s of the pause, within a block
+    assert chunks[0][1] == pytest.approx(6.8, abs=0.03)
+    assert chunks[1][0] == pytest.approx(6.8, abs=0.03)
+    assert chunks[1][0] + chunks[1][1] == pytest.approx(10.5, abs=0.03)
+
+def test_vad_drops_silent_chunks(tmp_path):
+    wav_path = _write_wav(tmp_path / "a.wav", [(6, 0.5), (7, 0), (6, 0.5)])
+    chunks = _chunks(wav_path, min_chunk=5.0, min_silence=0.3)
+    # 6.3 - 11.3 s is a chunk of silence only, not yielded; the next one starts after it
+    assert len(chunks) == 2
+    assert chunks[0][1] == pytest.approx(6.3, abs=0.03)
+    assert chunks[1][0] == pytest.approx(11.3, abs=0.03)
+    assert chunks[1][0] + chunks[1][1] == pytest.approx(19.0, abs=0.03)
+
+def test_vad_max_chunk_cut_in_last_pause_carries_rest_over(tmp_path):
+    # the only pause (0.1 s) is shorter than min_silence: at max_chunk the chunk is cut there
+    # and the speech after it is carried over into the next chunk
+    wav_path = _write_wav(tmp_path / "a.wav", [(12, 0.5), (0.1, 0), (28, 0.5)])
+    chunks = _chunks(wav_path, min_chunk=5.0, min_silence=0.3, max_chunk=30.0)
+    assert len(chunks) == 2
+    assert chunks[0][0] == 0.0
+    assert chunks[0][1] == pytest.approx(12.1, abs=0.03)
+    assert chunks[1][0] == pytest.approx(12.1, abs=0.03)
+    assert chunks[1][0] + chunks[1][1] == pytest.approx(40.1, abs=0.03)
+    # no sample lost or repeated at the cut
+    assert sum(seconds for _, seconds in chunks) == pytest.approx(40.1, abs=1 / RATE)
+
+def test_vad_max_chunk_without_pause(tmp_path):
+    wav_path = _write_wav(tmp_path / "a.wav", [(70, 0.5)])
+    chunks = _chunks(wav_path, max_chunk=30.0)
+    assert [round(start) for start, _ in chunks] == [0, 30, 60]
+    assert all(seconds <= 30.03 for _, seconds in chunks)
+
+def test_transcribe_wav_in_order_from_out_of_order_workers(tmp_path):
+    # chunks of 9, 6 and 5 s: the 9 s one is still running when the 6 s one is done
+    wav_path = _write_wav(tmp_path / "a.wav", [(8.7, 0.5), (0.5, 0), (5.5, 0.5), (0.5, 0), (4.2, 0.5), (0.5, 0)])
+    finished_log = tmp_path / "finished.txt"
+    out_jsonl = tmp_path / "out.jsonl"
+    vid_ts_list = np.arange(0, 40, 0.5)
+    n = l_tr.transcribe_wav(wav_path, str(out_jsonl), workers=2, model_factory=StubWhisperModel,
+                            model_kwargs={"delay": 0.05, "finished_log": str(finished_log)},
+                            vid_ts_list=vid_ts_list, audio_offset=10.0)
+    segments = l_tr.load_segments(str(out_jsonl))
+    assert n == len(segments) == 3
+    finished = finished_log.read_text().split()
+    assert finished != [s["text"] for s in segments]
+    # written in time order anyway, with times from the chunk start
+    assert [s["start"] for s in segments] == sorted(s["start"] for s in segments)
+    assert segments[0]["start"] == pytest.approx(0.5)
+    assert segments[1]["start"] == pytest.approx(9.5, abs=0.03)
+    for segment in segments:
+        assert segment["language"] == "sv"
+        # audio_offset moves the segment onto the video timeline, vbr_frameno is the closest timestamp
+        assert segment["pts_start"] == pytest.approx(segment["start"] + 10.0)
+        assert segment["pts_end"] == pytest.approx(segment["end"] + 10.0)
+        assert segment["vbr_frameno_start"] == int(np.argmin(np.abs(vid_ts_list - segment["pts_start"])))
+        assert segment["vbr_frameno_end"] == int(np.argmin(np.abs(vid_ts_list - segment["pts_end"])))
+
+def test_attach_speech():
+    segments = [{"pts_start": 1.0, "pts_end": 3.0, "text": "hej"}, {"pts_start": 2.5, "pts_end": 5.0, "text": "då"}]
+    ocr_json = {"0": {"pts_time": 0.5}, "1": {"pts_time": 2.7}, "2": {"pts_time": 4.0}}
+    l_tr.attach_speech(ocr_json, segments)
+    assert [entry["speech"] for entry in ocr_json.values()] == [[], ["hej", "då"], ["då"]]
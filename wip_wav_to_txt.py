@@ -1,27 +1,32 @@
-from faster_whisper import WhisperModel
 import json
+import lib_transcribe as l_tr
 
-# Load model (downloads ~3GB on first run; use int8 for lower RAM/slightly faster on CPU)
-model = WhisperModel("KBLab/kb-whisper-large", device="cpu", compute_type="int8")
+# KBLab/kb-whisper-large int8 on cpu (downloads ~3GB on first run), loaded once per worker process.
+# the wav is read in vad chunks and the chunks are transcribed in parallel, segments go to
+# transcription.jsonl as they are done
+# ffmpeg -i 20250924_145147.mp4 -vn -ac 1 -ar 16000 audio.wav
+if __name__ == "__main__":
+    n_segments = l_tr.transcribe_wav("audio.wav", "transcription.jsonl", workers=2,
+                                     transcribe_kwargs={"language": "sv", "condition_on_previous_text": False})
+    segments = l_tr.load_segments("transcription.jsonl")
+    languages = [segment["language"] for segment in segments]
+    language = max(set(languages), key=languages.count) if languages else None
+    print(f"Detected language: {language}")
 
-# Transcribe (outputs segments with timestamps)
-segments, info = model.transcribe("audio.wav", language="sv", condition_on_previous_text=False)
-print(f"Detected language: {info.language} (prob: {info.language_probability:.2f})")
+    # same json as before for your parsing/sync needs
+    output = {
+        "language": language,
+        "segments": [
+            {
+                "start": segment["start"],
+                "end": segment["end"],
+                "text": segment["text"]
+            } for segment in segments
+        ]
+    }
 
-# Collect into JSON for your parsing/sync needs
-output = {
-    "language": info.language,
-    "segments": [
-        {
-            "start": segment.start,
-            "end": segment.end,
-            "text": segment.text.strip()
-        } for segment in segments
-    ]
-}
+    # Save to JSON
+    with open("transcription.json", "w", encoding="utf-8") as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
 
-# Save to JSON
-with open("transcription.json", "w", encoding="utf-8") as f:
-    json.dump(output, f, ensure_ascii=False, indent=2)
-
-print("Transcription saved to transcription.json")
+    print(f"Transcription saved to transcription.json ({n_segments} segments)")